@@ -112,12 +112,9 @@ MIDDLEWARE = [
     "common.middleware.DisableCSRFForAPIMiddleware",  
     # "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "common.middleware.AccessTokenBlacklistMiddleware",  # Check for blacklisted tokens
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "common.middleware.AttachJWTTokenMiddleware",
-    "common.middleware.RefreshTokenMiddleware",
-    "common.middleware.DisplayCurrentUserMiddleware",
+    "common.middleware.AuthenticationPipelineMiddleware",
     "common.middleware.InputValidationMiddleware",
     "csp.middleware.CSPMiddleware",
     "utils.security_headers.SecurityHeadersMiddleware",
@@ -156,6 +153,16 @@ TOKEN_CONFIG = {
     "COOKIE_MAX_AGE_SECONDS": int(os.environ.get("COOKIE_MAX_AGE_SECONDS", str(15 * 60))), 
 }
 
+# Index of revoked token ids checked on every request, see common.revocation.
+# An empty URL checks the blacklist tables instead.
+REVOKED_TOKENS_REDIS_URL = os.environ.get(
+    "REVOKED_TOKENS_REDIS_URL", "redis://redis:6379/2"
+)
+REVOKED_TOKENS_KEY_PREFIX = os.environ.get("REVOKED_TOKENS_KEY_PREFIX", "revoked")
+REVOKED_TOKENS_TIMEOUT = float(os.environ.get("REVOKED_TOKENS_TIMEOUT", "0.5"))
+REVOKED_TOKENS_RETRY = float(os.environ.get("REVOKED_TOKENS_RETRY", "30"))
+REVOKED_TOKENS_FILTER_TTL = float(os.environ.get("REVOKED_TOKENS_FILTER_TTL", "30"))
+
 
 # CORS and CSRF settings
 CORS_ALLOWED_ORIGINS = os.environ.get("CORS_ALLOWED_ORIGINS", "").split(",")
@@ -236,6 +243,79 @@ SYNCHRONIZABLE_MODELS = [
     "path.PathStation",
 ]
 
+# Fields of synchronizable models that are derived locally and not synced
+SYNC_EXCLUDED_FIELDS = {
+    "users.CustomUser": ["current_status"],
+}
+
+# Which stations receive changes of a model (see orcSync.routing); models not
+# listed here are broadcast to every station.
+SYNC_ROUTING_RULES = {
+    "declaracions.Declaracion": "path:path_id",
+    "declaracions.Checkin": "path:declaracion.path_id",
+    "declaracions.ChangeTruck": "path:declaracion.path_id",
+    "declaracions.ManualPayment": "path:checkin.declaracion.path_id",
+    "workstations.WorkedAt": "station:station_id",
+}
+
+# Priority lanes of /api/sync/get-pending/, highest first, with the share of
+# a page each lane gets while it has a backlog (see orcSync.lanes). Models not
+# listed in SYNC_MODEL_LANES use the "default" lane.
+SYNC_LANES = {"realtime": 6, "default": 3, "bulk": 1}
+SYNC_MODEL_LANES = {
+    "declaracions.Declaracion": "realtime",
+    "declaracions.Checkin": "realtime",
+    "declaracions.ChangeTruck": "realtime",
+    "declaracions.ManualPayment": "realtime",
+    "users.CustomUser": "bulk",
+    "address.RegionOrCity": "bulk",
+    "address.ZoneOrSubcity": "bulk",
+    "address.Woreda": "bulk",
+}
+
+# Page size for /api/sync/get-pending/ (stations may ask for less via ?limit=)
+SYNC_PULL_DEFAULT_LIMIT = int(os.environ.get("SYNC_PULL_DEFAULT_LIMIT", "500"))
+SYNC_PULL_MAX_LIMIT = int(os.environ.get("SYNC_PULL_MAX_LIMIT", "2000"))
+
+# Confirmations of fully acknowledged events returned per get-pending call
+SYNC_CONFIRMATION_LIMIT = int(os.environ.get("SYNC_CONFIRMATION_LIMIT", "500"))
+
+# Failed pushes of a change before it is parked in DeadLetter and skipped
+SYNC_DEAD_LETTER_ATTEMPTS = int(os.environ.get("SYNC_DEAD_LETTER_ATTEMPTS", "3"))
+
+# Sync history every station has received is deleted after SYNC_RETENTION_DAYS,
+# SYNC_RETENTION_BATCH events per transaction, and archived to SYNC_ARCHIVE_DIR
+# first when it is set
+SYNC_RETENTION_DAYS = int(os.environ.get("SYNC_RETENTION_DAYS", "30"))
+SYNC_RETENTION_BATCH = int(os.environ.get("SYNC_RETENTION_BATCH", "5000"))
+SYNC_ARCHIVE_DIR = os.environ.get("SYNC_ARCHIVE_DIR", "")
+
+# Rows per chunk of /api/sync/snapshot/ (stations may ask for less via ?limit=)
+SYNC_SNAPSHOT_DEFAULT_CHUNK = int(os.environ.get("SYNC_SNAPSHOT_DEFAULT_CHUNK", "5000"))
+SYNC_SNAPSHOT_MAX_CHUNK = int(os.environ.get("SYNC_SNAPSHOT_MAX_CHUNK", "20000"))
+
+# Notify stations of new changes at <base_url><SYNC_NOTIFY_PATH> so they pull
+# right away (see orcSync.dispatch); polling remains the fallback.
+SYNC_NOTIFY_ENABLED = os.environ.get("SYNC_NOTIFY_ENABLED", "False") == "True"
+SYNC_NOTIFY_PATH = os.environ.get("SYNC_NOTIFY_PATH", "/api/sync/notify/")
+SYNC_NOTIFY_TOKEN = os.environ.get("SYNC_NOTIFY_TOKEN", "")
+SYNC_NOTIFY_CONCURRENCY = int(os.environ.get("SYNC_NOTIFY_CONCURRENCY", "20"))
+SYNC_NOTIFY_TIMEOUT = float(os.environ.get("SYNC_NOTIFY_TIMEOUT", "5"))
+SYNC_NOTIFY_ATTEMPTS = int(os.environ.get("SYNC_NOTIFY_ATTEMPTS", "3"))
+SYNC_NOTIFY_BACKOFF = float(os.environ.get("SYNC_NOTIFY_BACKOFF", "0.5"))
+SYNC_NOTIFY_BREAKER_THRESHOLD = int(
+    os.environ.get("SYNC_NOTIFY_BREAKER_THRESHOLD", "5")
+)
+SYNC_NOTIFY_BREAKER_COOLDOWN = float(
+    os.environ.get("SYNC_NOTIFY_BREAKER_COOLDOWN", "60")
+)
+
+# Seconds a verified station or APIKey key stays cached in each process
+API_KEY_CACHE_TTL = int(os.environ.get("API_KEY_CACHE_TTL", "60"))
+
+# Seconds the permission codenames of every role stay cached in each process
+ROLE_PERMISSIONS_CACHE_TTL = int(os.environ.get("ROLE_PERMISSIONS_CACHE_TTL", "60"))
+
 # Celery Configuration
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND", "redis://redis:6379/1")
@@ -251,6 +331,16 @@ CELERY_TASK_RETRY_POLICY = {
     "interval_step": 10,
     "interval_max": 60,
 }
+CELERY_BEAT_SCHEDULE = {
+    "flush-sync-outbox": {
+        "task": "orcSync.tasks.task.flush_outbox_task",
+        "schedule": float(os.environ.get("SYNC_OUTBOX_FLUSH_INTERVAL", "30")),
+    },
+    "compact-sync-history": {
+        "task": "orcSync.tasks.task.compact_sync_history_task",
+        "schedule": float(os.environ.get("SYNC_RETENTION_INTERVAL", "86400")),
+    },
+}
 
 # External APIs and Tokens
 DERASH_API_KEY = os.environ.get("DERASH_API_KEY")
@@ -269,6 +359,16 @@ EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
 
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "common.authentication.PipelineAuthentication",
+        "rest_framework.authentication.SessionAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "common.parsers.ValidatedJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
 SPECTACULAR_SETTINGS = {
@@ -2,10 +2,10 @@ from django.shortcuts import get_object_or_404
 from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiParameter
 from rest_framework import filters, viewsets
 from rest_framework.response import Response
-from rest_framework_api_key.permissions import HasAPIKey
 
 from api.serializers import CustomUserSerializer
 from users.models import CustomUser
+from utils.api_keys import CachedHasAPIKey
 
 
 class CustomUserViewSet(viewsets.ModelViewSet):
@@ -17,7 +17,7 @@ class CustomUserViewSet(viewsets.ModelViewSet):
     Supports search by name, email, and username.
     """
     
-    permission_classes = [HasAPIKey]
+    permission_classes = [CachedHasAPIKey]
     queryset = CustomUser.objects.filter(role__name__in=["controller", "admin"])
     serializer_class = CustomUserSerializer
     filter_backends = [filters.SearchFilter]
@@ -0,0 +1,260 @@
+"""
+Cookie based JWT authentication, done once per request.
+
+AuthenticationPipelineMiddleware resolves the route once, decodes the access
+cookie once and loads the user together with the state of its session in a
+single query. The outcome is kept on the request as
+`jwt_auth`, where PipelineAuthentication hands it to DRF, so views do not
+authenticate the token again.
+"""
+
+import jwt
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
+from django.urls import Resolver404, resolve
+from rest_framework.authentication import BaseAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from common.revocation import revoked_tokens
+from users.models import UserSession
+
+User = get_user_model()
+
+# Requests under these prefixes are not authenticated at all.
+SKIPPED_PREFIXES = ("/admin/", "/static/", "/media/")
+
+# No revocation check on the way in, the views issue new tokens.
+UNCHECKED_PREFIXES = ("/api/users/login", "/api/users/register")
+
+# Routes that do not require the access, refresh and session cookies.
+EXEMPT_PREFIXES = (
+    "/user/register/",
+    "/user/login",
+    "/user/signup",
+    "/user/logout",
+    "/sync/get-pending/",
+    "/sync/push/",
+    "/sync/acknowledge/",
+    "/users/register/",
+    "/users/login",
+    "/users/signup",
+    "/users/logout",
+    "/api/sync/get-pending/",
+    "/api/sync/push/",
+    "/api/sync/acknowledge/",
+    "/api/sync/blobs/",
+    "/api/sync/snapshot/",
+    "/api/sync/merkle/",
+    "/api/users/register/",
+    "/api/users/login",
+    "/api/users/signup",
+    "/api/users/logout",
+)
+
+EXEMPT_URL_NAMES = frozenset(
+    {
+        "login",
+        "verify-email",
+        "signup",
+        "forget",
+        "truck-list",
+        "check-truck",
+        "weighbridgerecord-list",
+        "password_reset_confirm",
+        "check-logic",
+        "logout",
+        "schema-json",
+        "schema-swagger-ui",
+        "schema",
+        "swagger-ui",
+        "redoc",
+        "user-api-detail",
+        "user-api-list",
+        "trucks-list",
+        "without_truck_checkin",
+        "trucks-detail",
+        "revenue_trends_report",
+        "station-revenue-report",
+        "stats-overview",
+        "tax-rate-analysis",
+        "employee-revenue-report",
+        "tax-payer-revenue-trends",
+        "deleteTax",
+        "controller-today-report",
+        "controller-revenue-by-date-type",
+        "controller-combined-revenue-by-date-type",
+    }
+)
+
+# Routes whose views act as the user of the access cookie.
+COOKIE_USER_URL_NAMES = frozenset(
+    {
+        "tax-list",
+        "update-profile",
+        "assign-station",
+        "declaracion-list",
+        "workstationsbyemployee",
+        "addDeduction",
+        "profile",
+        "exporter-list",
+        "customuser-detail",
+        "exporter-detail",
+        "workedat-list",
+        "trucks-detail",
+        "driver-list",
+        "driver-detail",
+        "checkin-list",
+        "view",
+        "api-root",
+        "user-list",
+        "customuser-list",
+        "workstations-list",
+        "checkin-fetch-checkins",
+        "workstations-detail",
+        "employeebyworkstation",
+        "unemployeebyworkstation",
+        "workedat-delete",
+        "permission-list",
+        "group-list",
+        "check-logic",
+        "change-password",
+        "derashpayment",
+        "getDerashPayment",
+        "activating_diactivate",
+        "give_report",
+        "read_report",
+        "commodity-list",
+        "commodity-detail",
+        "taxpayertype-list",
+        "taxpayertype-detail",
+        "update_declaracions",
+        "regionorcity-list",
+        "regionorcity-detail",
+        "zoneorsubcity-list",
+        "zoneorsubcity-detail",
+        "woreda-list",
+        "woreda-detail",
+        "zoneorsubcity-get-by-region",
+        "woreda-get-by-ZoneSubcity",
+        "tax-detail",
+        "manualPayment",
+        "update_without_truck_journey",
+        "without_truck_checkin_logic",
+        "journey_without_truck-list",
+        "issueEmployee",
+        "audit-log",
+        "add_path",
+        "news-list",
+        "news-detail",
+        "path-list",
+        "update_path",
+        "path-detail",
+        "add_path_station",
+        "audit-log-table-names",
+        "audit-log-list",
+        "change_truck-list",
+        "change_truck-detail",
+        "model_report",
+        "revenue_report",
+        "yearly_revenue_report",
+        "monthly_revenue_report",
+        "daily_revenue_report",
+        "top_exporters_report",
+        "top_trucks_report",
+        "workstation_revenue_report",
+        "daily_revenue_reporttop_exporters_report",
+        "vehicle-list",
+        "vehicle-detail",
+        "declaracion-detail",
+        "revenue_and_number",
+        "controllerbyworkstation",
+        "department-list",
+        "changetruck-list",
+        "ongoing_declaracion-list",
+        "ongoing_declaracion-detail",
+        "station-revenue-report",
+        "weekly-trends",
+        "station-tax-payer",
+        "completed_declaracion-list",
+        "completed_declaracion-detail",
+        "zoime-sync-user-list",
+        "zoime-sync-user-trigger",
+        "admin-password-reset",
+        "verify-user",
+    }
+)
+
+EXPIRED = "expired"
+INVALID = "invalid"
+
+
+def url_name(path):
+    try:
+        return resolve(path).url_name
+    except Resolver404:
+        return None
+
+
+def decode_access(token):
+    """
+    Returns `(claims, error)` for an access token, where `error` is None,
+    EXPIRED or INVALID.
+    """
+    if not token:
+        return None, INVALID
+    try:
+        claims = jwt.decode(
+            token,
+            settings.SIMPLE_JWT["SIGNING_KEY"],
+            algorithms=[api_settings.ALGORITHM],
+        )
+    except jwt.ExpiredSignatureError:
+        return None, EXPIRED
+    except jwt.InvalidTokenError:
+        return None, INVALID
+    if claims.get(api_settings.TOKEN_TYPE_CLAIM) != "access":
+        return None, INVALID
+    return claims, None
+
+
+def token_is_revoked(jti):
+    return revoked_tokens.is_revoked(jti)
+
+
+def load_user(claims, session_token=None):
+    """
+    The user a token was issued to, annotated with `has_session`, whether
+    `session_token` is one of its active sessions.
+    """
+    user_id = claims.get(api_settings.USER_ID_CLAIM)
+    if user_id is None:
+        return None
+    sessions = UserSession.objects.filter(
+        user=OuterRef("pk"), session_token=session_token or "", is_active=True
+    )
+    return (
+        User.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+        .annotate(has_session=Exists(sessions))
+        .first()
+    )
+
+
+def session_is_valid(user, session_token):
+    return (
+        bool(session_token) and user.session_token == session_token and user.has_session
+    )
+
+
+def is_inactive(user):
+    return (user.current_status or "").lower() == "inactive"
+
+
+class PipelineAuthentication(BaseAuthentication):
+    """
+    Hands DRF the user AuthenticationPipelineMiddleware authenticated. The
+    `auth` of the request is the claims of the access token.
+    """
+
+    def authenticate(self, request):
+        return getattr(request._request, "jwt_auth", None)
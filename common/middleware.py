@@ -1,531 +1,184 @@
-import os
-from datetime import datetime, timedelta, timezone
-from typing import Any
+import logging
 
-import jwt
-import pytz
 from django.conf import settings
-from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse
-from django.urls import Resolver404, resolve
 from django.utils.deprecation import MiddlewareMixin
 from rest_framework import status
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework_simplejwt.settings import api_settings
-from rest_framework_simplejwt.tokens import AccessToken, RefreshToken, TokenError
-
-from users.models import CustomUser
+from rest_framework_simplejwt.tokens import RefreshToken, TokenError
+
+from common.authentication import (
+    COOKIE_USER_URL_NAMES,
+    EXEMPT_PREFIXES,
+    EXEMPT_URL_NAMES,
+    EXPIRED,
+    INVALID,
+    SKIPPED_PREFIXES,
+    UNCHECKED_PREFIXES,
+    decode_access,
+    is_inactive,
+    load_user,
+    session_is_valid,
+    token_is_revoked,
+    url_name,
+)
 from utils import set_current_user
 
-User = get_user_model()
-
 
-class AccessTokenBlacklistMiddleware:
+class AuthenticationPipelineMiddleware:
     """
-    Middleware to check if access token is blacklisted on every request.
-    Prevents use of stolen/copied tokens after logout.
+    Authenticates a request from its access, refresh and session cookies in
+    one pass, see common.authentication:
+
+    - a revoked access token is rejected;
+    - outside the exempt routes all three cookies are required, an expired
+      access token is refreshed and the session must still be active;
+    - the user of the token becomes the request's user, for DRF through
+      PipelineAuthentication and for the models through set_current_user.
     """
-    
-    def __init__(self, get_response):
-        self.get_response = get_response
-        import logging
-        self.logger = logging.getLogger('security.blacklist')
-    
-    def __call__(self, request):
-        # Skip validation for non-API endpoints and login/register
-        skip_paths = ['/admin/', '/static/', '/media/', '/api/users/login', '/api/users/register']
-        
-        if any(request.path.startswith(path) for path in skip_paths):
-            return self.get_response(request)
-        
-        # Check if access token is blacklisted
-        access_token = request.COOKIES.get('access')
-        
-        if access_token:
-            try:
-                from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
-                
-                # Decode token to get JTI
-                token = AccessToken(access_token)
-                jti = token.payload.get('jti')
-                
-                self.logger.info(f"Checking blacklist for JTI: {jti}, Path: {request.path}")
-                
-                # Check if blacklisted
-                is_blacklisted = OutstandingToken.objects.filter(
-                    jti=jti,
-                    blacklistedtoken__isnull=False
-                ).exists()
-                
-                if is_blacklisted:
-                    self.logger.warning(f"BLACKLISTED TOKEN DETECTED! JTI: {jti}, Path: {request.path}")
-                    
-                    # Token is blacklisted - reject request
-                    response = JsonResponse({
-                        'error': 'Authentication credentials have been revoked',
-                        'detail': 'This token has been blacklisted. Please log in again.',
-                        'code': 'TOKEN_BLACKLISTED'
-                    }, status=401)
-                    
-                    # Clear all cookies
-                    response.delete_cookie('access')
-                    response.delete_cookie('refresh')
-                    response.delete_cookie('session')
-                    response.delete_cookie('csrftoken')
-                    
-                    return response
-                else:
-                    self.logger.info(f"Token JTI {jti} is NOT blacklisted")
-                    
-            except Exception as e:
-                # Log the error but don't block the request
-                self.logger.error(f"Error checking blacklist: {e}", exc_info=True)
-                pass
-        
-        return self.get_response(request)
-
-
-
-def get_user_from_token(token):
-    try:
-        access_token = AccessToken(token)
-        user_id = access_token["user_id"]
-        user = User.objects.get(id=user_id)
-        set_current_user(user)
-        return user
-    except User.DoesNotExist:
-        return None
-    except Exception:
-        return None
-
-
-class AttachJWTTokenMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
-        if (
-            request.path.startswith(settings.STATIC_URL)
-            or request.path.startswith(settings.MEDIA_URL)
-            or request.path.startswith("/admin/")
-        ):
-            return self.get_response(request)
-
-        try:
-            url_name = resolve(path=request.path).url_name
-        except Resolver404:
-            url_name = None
-        if (
-            url_name
-            in [
-                "tax-list",
-                "update-profile",
-                "assign-station",
-                "declaracion-list",
-                "workstationsbyemployee",
-                "addDeduction",
-                "profile",
-                "exporter-list",
-                "customuser-detail",
-                "exporter-detail",
-                "workedat-list",
-                "trucks-detail",
-                "driver-list",
-                "driver-detail",
-                "checkin-list",
-                # "logout",
-                "view",
-                "api-root",
-                "user-list",
-                "customuser-list",
-                "workstations-list",
-                "declaracion-list",
-                "checkin-fetch-checkins",
-                "workstations-detail",
-                "employeebyworkstation",
-                "unemployeebyworkstation",
-                "workedat-delete",
-                "permission-list",
-                "group-list",
-                "check-logic",
-                "change-password",
-                "derashpayment",
-                "getDerashPayment",
-                "activating_diactivate",
-                "give_report",
-                "read_report",
-                "commodity-list",
-                "commodity-detail",
-                "taxpayertype-list",
-                "taxpayertype-detail",
-                "update_declaracions",
-                "regionorcity-list",
-                "regionorcity-detail",
-                "zoneorsubcity-list",
-                "zoneorsubcity-detail",
-                "woreda-list",
-                "woreda-detail",
-                "zoneorsubcity-get-by-region",
-                "woreda-get-by-ZoneSubcity",
-                "tax-detail",
-                "manualPayment",
-                "update_without_truck_journey",
-                "without_truck_checkin_logic",
-                "journey_without_truck-list",
-                "issueEmployee",
-                "audit-log",
-                "add_path",
-                "news-list",
-                "news-detail",
-                "path-list",
-                "update_path",
-                "path-detail",
-                "add_path_station",
-                "audit-log-table-names",
-                "audit-log-list",
-                "change_truck-list",
-                "change_truck-detail",
-                "model_report",
-                "revenue_report",
-                "yearly_revenue_report",
-                "monthly_revenue_report",
-                "daily_revenue_report",
-                "top_exporters_report",
-                "top_trucks_report",
-                "workstation_revenue_report",
-                "daily_revenue_reporttop_exporters_report",
-                "vehicle-list",
-                "vehicle-detail",
-                "declaracion-detail",
-                "revenue_and_number",
-                "controllerbyworkstation",
-                "department-list",
-                "changetruck-list",
-                "ongoing_declaracion-list",
-                "ongoing_declaracion-detail",
-                "station-revenue-report",
-                "weekly-trends",
-                "station-tax-payer",
-                "completed_declaracion-list",
-                "completed_declaracion-detail",
-                "zoime-sync-user-list",
-                "zoime-sync-user-trigger",
-                "admin-password-reset",
-                "verify-user",
-            ]
-            and request.path != "/admin/login/"
-        ):
-            token = request.COOKIES.get("access")
-            csrf_token = request.COOKIES.get("csrftoken")
-            if token:
-                request.META["HTTP_AUTHORIZATION"] = f"Bearer {token}"
-            if csrf_token:
-                request.META["HTTP_X_CSRFTOKEN"] = csrf_token
 
-        response = self.get_response(request)
-        return response
-
-
-class RefreshTokenMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
-
-    def check_user_status(self, user):
-        if user is not None:
-            set_current_user(user)
-            if user.get_latest_status() is not None:
-                if user.get_latest_status() == "Inactive":
-                    return JsonResponse(
-                        {"error": "Your Account is InActive please Contact the Admin"},
-                        status=status.HTTP_401_UNAUTHORIZED,
-                    )
-        return None
-    
-    def validate_session(self, user, session_token):
-        """Validate if the session token is still active in the database."""
-        if not session_token:
-            return False
-        
-        # Check if user's current session token matches
-        if user.session_token != session_token:
-            return False
-        
-        # Check if session exists and is active
-        from users.models import UserSession
-        session_exists = UserSession.objects.filter(
-            user=user,
-            session_token=session_token,
-            is_active=True
-        ).exists()
-        
-        return session_exists
-
-    def __call__(self, request):
-        
-        exempt_paths = [
-            "/admin/",
-            "/admin/login/",
-            "/user/register/",
-            "/user/login",
-            "/user/signup",
-            "/user/logout",
-            "/sync/get-pending/",
-            "/sync/push/",
-            "/sync/acknowledge/",
-            "/users/register/",
-            "/users/login",
-            "/users/signup",
-            "/users/logout",
-            "/api/sync/get-pending/",
-            "/api/sync/push/",
-            "/api/sync/acknowledge/",
-            "/api/users/register/",
-            "/api/users/login",
-            "/api/users/signup",
-            "/api/users/logout",
-            settings.STATIC_URL,
-            settings.MEDIA_URL,
-        ]
-
-        path_is_exempt = any(
-            request.path.startswith(path) for path in exempt_paths if path
+        self.skipped_prefixes = tuple(
+            prefix
+            for prefix in (*SKIPPED_PREFIXES, settings.STATIC_URL, settings.MEDIA_URL)
+            if prefix
         )
+        self.logger = logging.getLogger("security.blacklist")
 
-        url_name_is_exempt = False
-        resolved_url_name = None
-        try:
-            resolved_url_name = resolve(path=request.path).url_name
-            if resolved_url_name in [
-                "login",
-                "verify-email",
-                "signup",
-                "forget",
-                "truck-list",
-                "check-truck",
-                "weighbridgerecord-list",
-                "password_reset_confirm",
-                "check-logic",
-                "logout",
-                "schema-json",
-                "schema-swagger-ui",
-                "schema",
-                "swagger-ui",
-                "redoc",
-                "user-api-detail",
-                "user-api-list",
-                "trucks-list",
-                "without_truck_checkin",
-                "trucks-detail",
-                "revenue_trends_report",
-                "station-revenue-report",
-                "stats-overview",
-                "tax-rate-analysis",
-                "employee-revenue-report",
-                "tax-payer-revenue-trends",
-                "deleteTax",
-                "controller-today-report",
-                "controller-revenue-by-date-type",
-                "controller-combined-revenue-by-date-type",
-            ]:
-                url_name_is_exempt = True
-        except Resolver404:
-            pass
-
-        if path_is_exempt or url_name_is_exempt:
-            set_current_user(None)
+    def __call__(self, request):
+        set_current_user(None)
+        path = request.path
+        if path.startswith(self.skipped_prefixes):
             return self.get_response(request)
 
-        token = request.COOKIES.get("access")
-        refresh_token = request.COOKIES.get("refresh")
+        name = url_name(path)
+        access = request.COOKIES.get("access")
         session_token = request.COOKIES.get("session")
+        claims, error = decode_access(access) if access else (None, None)
 
-        if not token:
-            return JsonResponse(
-                {"error": "No access token provided"},
-                status=status.HTTP_401_UNAUTHORIZED,
+        if (
+            claims is not None
+            and not path.startswith(UNCHECKED_PREFIXES)
+            and token_is_revoked(claims.get(api_settings.JTI_CLAIM))
+        ):
+            self.logger.warning(
+                f"BLACKLISTED TOKEN DETECTED! JTI: {claims.get(api_settings.JTI_CLAIM)}, Path: {path}"
             )
-        if not refresh_token:
-            return JsonResponse(
-                {"error": "No refresh token provided"},
-                status=status.HTTP_401_UNAUTHORIZED,
+            return clear_auth_cookies(
+                JsonResponse(
+                    {
+                        "error": "Authentication credentials have been revoked",
+                        "detail": "This token has been blacklisted. Please log in again.",
+                        "code": "TOKEN_BLACKLISTED",
+                    },
+                    status=status.HTTP_401_UNAUTHORIZED,
+                )
             )
 
-        # ============================================================
-        # FIXED: Validate and refresh token BEFORE processing request
-        # ============================================================
-        token_was_refreshed = False
-        new_access_token = None
-        new_refresh_token = None  # Track new refresh token for rotation
-        
-        try:
-            # Try to decode the access token
-            payload = jwt.decode(
-                token,
-                settings.SIMPLE_JWT["SIGNING_KEY"],
-                algorithms=[api_settings.ALGORITHM],
-            )
-            exp = payload["exp"]
-            user_id = payload.get("user_id")
-            
-            # Validate session
-            if user_id:
+        user = None
+        refreshed = None
+        if not (path.startswith(EXEMPT_PREFIXES) or name in EXEMPT_URL_NAMES):
+            if not access:
+                return JsonResponse(
+                    {"error": "No access token provided"},
+                    status=status.HTTP_401_UNAUTHORIZED,
+                )
+            refresh_token = request.COOKIES.get("refresh")
+            if not refresh_token:
+                return JsonResponse(
+                    {"error": "No refresh token provided"},
+                    status=status.HTTP_401_UNAUTHORIZED,
+                )
+            if error == EXPIRED:
                 try:
-                    user = User.objects.get(id=user_id)
-                    if not self.validate_session(user, session_token):
-                        new_response = JsonResponse(
+                    refresh = RefreshToken(refresh_token)
+                    new_access = refresh.access_token
+                except TokenError:
+                    return clear_auth_cookies(
+                        JsonResponse(
+                            {"error": "Invalid refresh token"},
+                            status=status.HTTP_401_UNAUTHORIZED,
+                        )
+                    )
+                access, claims = str(new_access), new_access.payload
+                refreshed = (access, str(refresh))
+            elif error == INVALID:
+                return clear_auth_cookies(
+                    JsonResponse(
+                        {"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED
+                    )
+                )
+
+            user = load_user(claims, session_token)
+            if user is not None:
+                if not session_is_valid(user, session_token):
+                    return clear_auth_cookies(
+                        JsonResponse(
                             {
                                 "error": "Session invalidated. You have been logged out from this device.",
-                                "session_invalidated": True
+                                "session_invalidated": True,
                             },
                             status=status.HTTP_401_UNAUTHORIZED,
                         )
-                        new_response.delete_cookie("access")
-                        new_response.delete_cookie("refresh")
-                        new_response.delete_cookie("session")
-                        new_response.delete_cookie("csrftoken")
-                        return new_response
-                except User.DoesNotExist:
-                    pass
-            
-            if datetime.fromtimestamp(exp, timezone.utc) < datetime.now(timezone.utc):
-                try:
-                    refresh = RefreshToken(refresh_token)
-                    new_access_token = str(refresh.access_token)
-                    # IMPORTANT: Get the NEW rotated refresh token (ROTATE_REFRESH_TOKENS=True)
-                    new_refresh_token = str(refresh)
-                    token_was_refreshed = True
-                    
-                    # Update request authorization header for the view
-                    request.META["HTTP_AUTHORIZATION"] = f"Bearer {new_access_token}"
-                    
-                    user = get_user_from_token(new_access_token)
-                    status_response = self.check_user_status(user)
-                    if status_response:
-                        return status_response
-                        
-                except TokenError as e:
-                    new_response = JsonResponse(
-                        {"error": "Invalid refresh token"},
-                        status=status.HTTP_401_UNAUTHORIZED,
                     )
-                    new_response.delete_cookie("access")
-                    new_response.delete_cookie("refresh")
-                    new_response.delete_cookie("session")
-                    new_response.delete_cookie("csrftoken")
-                    return new_response
-                        
-        except jwt.ExpiredSignatureError:
-            # Token is expired - refresh it BEFORE processing the request
-            try:
-                refresh = RefreshToken(refresh_token)
-                new_access_token = str(refresh.access_token)
-                # IMPORTANT: Get the NEW rotated refresh token (ROTATE_REFRESH_TOKENS=True)
-                new_refresh_token = str(refresh)
-                token_was_refreshed = True
-                
-                # Update request authorization header for the view
-                request.META["HTTP_AUTHORIZATION"] = f"Bearer {new_access_token}"
-                
-                user = get_user_from_token(new_access_token)
-                
-                # Validate session with the refreshed token's user
-                if user and not self.validate_session(user, session_token):
-                    new_response = JsonResponse(
-                        {
-                            "error": "Session invalidated. You have been logged out from this device.",
-                            "session_invalidated": True
-                        },
+                if is_inactive(user):
+                    return JsonResponse(
+                        {"error": "Your Account is InActive please Contact the Admin"},
                         status=status.HTTP_401_UNAUTHORIZED,
                     )
-                    new_response.delete_cookie("access")
-                    new_response.delete_cookie("refresh")
-                    new_response.delete_cookie("session")
-                    new_response.delete_cookie("csrftoken")
-                    return new_response
-                
-                status_response = self.check_user_status(user)
-                if status_response:
-                    return status_response
-                    
-            except TokenError as e:
-                new_response = JsonResponse(
-                    {"error": "Invalid refresh token"},
-                    status=status.HTTP_401_UNAUTHORIZED,
-                )
-                new_response.delete_cookie("access")
-                new_response.delete_cookie("refresh")
-                new_response.delete_cookie("session")
-                new_response.delete_cookie("csrftoken")
-                return new_response
-                
-        except jwt.InvalidTokenError as e:
-            new_response = JsonResponse(
-                {"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED
-            )
-            new_response.delete_cookie("access")
-            new_response.delete_cookie("refresh")
-            new_response.delete_cookie("session")
-            new_response.delete_cookie("csrftoken")
-            return new_response
 
-        # ============================================================
-        # NOW process the request (token is valid or was just refreshed)
-        # ============================================================
+        # The user of the request: that of a refreshed token, of the access
+        # cookie on the routes acting as it, or of a bearer token the client
+        # sent itself.
+        if refreshed is None and name in COOKIE_USER_URL_NAMES:
+            csrf_token = request.COOKIES.get("csrftoken")
+            if csrf_token:
+                request.META["HTTP_X_CSRFTOKEN"] = csrf_token
+        elif refreshed is None:
+            bearer = bearer_token(request)
+            if bearer != access:
+                access, user = bearer, None
+                claims, _ = decode_access(bearer) if bearer else (None, None)
+        if claims is not None:
+            if user is None:
+                user = load_user(claims, session_token)
+            if user is not None and user.is_active:
+                request.META["HTTP_AUTHORIZATION"] = f"Bearer {access}"
+                request.user = user
+                request.jwt_auth = (user, claims)
+                set_current_user(user)
+
         response = self.get_response(request)
 
-        # If token was refreshed, set the new access AND refresh token cookies on the response
-        if token_was_refreshed and new_access_token:
-            # IMPORTANT: Cookie expiration should match refresh token lifetime (days, not minutes)
-            # so the cookie persists for future token refreshes
-            cookie_expiration_days = settings.TOKEN_CONFIG['COOKIE_EXPIRATION_DAYS']
-            cookie_expires = datetime.now(timezone.utc) + timedelta(days=cookie_expiration_days)
-            
-            response.set_cookie(
-                "access",
-                new_access_token,
-                httponly=True,
-                secure=True,
-                samesite="Strict",
-                expires=cookie_expires,
-            )
-            
-            # CRITICAL: Also set the NEW rotated refresh token!
-            # Without this, the old (now blacklisted) refresh token stays in the cookie
-            if new_refresh_token:
+        if refreshed is not None:
+            # The cookies outlive the access token so that an expired one can
+            # still be refreshed, as set at login.
+            max_age = settings.TOKEN_CONFIG["COOKIE_MAX_AGE_SECONDS"]
+            for key, value in zip(("access", "refresh"), refreshed):
                 response.set_cookie(
-                    "refresh",
-                    new_refresh_token,
+                    key,
+                    value,
+                    max_age=max_age,
                     httponly=True,
                     secure=True,
                     samesite="Strict",
-                    expires=cookie_expires,
                 )
-
         return response
 
 
-class DisplayCurrentUserMiddleware(MiddlewareMixin):
-    def process_request(self, request):
-        if (
-            request.path.startswith(settings.STATIC_URL)
-            or request.path.startswith(settings.MEDIA_URL)
-            or request.path.startswith("/admin/")
-        ):
-            set_current_user(None)
-            return None
+def bearer_token(request):
+    scheme, _, token = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    if scheme in api_settings.AUTH_HEADER_TYPES and token:
+        return token
+    return None
 
-        jwt_authenticator = JWTAuthentication()
-        try:
-            user, token = jwt_authenticator.authenticate(request)
-            if user:
-                request.user = user
-                set_current_user(user)
-            else:
-                set_current_user(None)
-        except Exception:
-            set_current_user(None)
-        return None
+
+def clear_auth_cookies(response):
+    for key in ("access", "refresh", "session", "csrftoken"):
+        response.delete_cookie(key)
+    return response
 
 
 class DisableCSRFForAPIMiddleware(MiddlewareMixin):
@@ -611,9 +264,11 @@ class InputValidationMiddleware:
     def _validate_request_data(self, request):
         """
         Validate all data in the request (POST, PUT, PATCH).
+        
+        A JSON body is parsed once; once it has passed validation it is kept
+        on the request as `validated_json` for ValidatedJSONParser.
         """
-        import json
-        from django.core.exceptions import ValidationError
+        from common.parsers import load_json
         
         # Get validation settings
         validation_config = getattr(settings, 'INPUT_VALIDATION', {})
@@ -626,12 +281,13 @@ class InputValidationMiddleware:
         data_to_validate = {}
         
         # Handle JSON data (most API requests)
-        if request.content_type and 'application/json' in request.content_type:
+        is_json = bool(request.content_type and 'application/json' in request.content_type)
+        if is_json:
             try:
                 # Read body before it's consumed
                 if request.body:
-                    data_to_validate = json.loads(request.body.decode('utf-8'))
-            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                    data_to_validate = load_json(request.body)
+            except ValueError:
                 # Invalid JSON - let Django handle the error
                 return
         # Handle form data
@@ -644,6 +300,9 @@ class InputValidationMiddleware:
         
         # Validate each field recursively
         self._validate_dict(data_to_validate, field_limits, max_string_length, strict_mode)
+        
+        if is_json:
+            request.validated_json = data_to_validate
     
     def _validate_dict(self, data, field_limits, max_string_length, strict_mode, parent_key=''):
         """
@@ -670,9 +329,6 @@ class InputValidationMiddleware:
         """
         Validate a single field value.
         """
-        from django.core.exceptions import ValidationError
-        from common.validators import validate_input
-        
         # Determine max length for this field
         max_length = field_limits.get(field_name, max_string_length)
         
@@ -683,7 +339,7 @@ class InputValidationMiddleware:
         # Use the comprehensive validate_input function from validators.py
         # This includes field character validation + XSS/SQL detection
         try:
-            validate_input(value, field_name, max_length, strict_mode=True)
+            self.validate_input(value, field_name, max_length, strict_mode=True)
         except ValidationError as e:
             # Log the violation
             import logging
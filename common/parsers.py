@@ -0,0 +1,32 @@
+"""
+Request parsing shared between InputValidationMiddleware and DRF.
+
+The middleware has to parse a JSON body to validate it, before DRF would.
+It keeps the result on the request as `validated_json`, and
+ValidatedJSONParser hands that to DRF instead of parsing the body again.
+"""
+
+from rest_framework.parsers import JSONParser
+from rest_framework.settings import api_settings
+from rest_framework.utils import json
+
+
+def load_json(body, encoding="utf-8"):
+    """
+    Parses a JSON request body the way JSONParser does.
+    """
+    parse_constant = json.strict_constant if api_settings.STRICT_JSON else None
+    return json.loads(body.decode(encoding), parse_constant=parse_constant)
+
+
+class ValidatedJSONParser(JSONParser):
+    """
+    JSONParser that reuses the body InputValidationMiddleware parsed.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get("request")
+        data = getattr(getattr(request, "_request", None), "validated_json", None)
+        if data is not None:
+            return data
+        return super().parse(stream, media_type, parser_context)
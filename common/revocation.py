@@ -0,0 +1,203 @@
+"""
+Index of revoked token ids (JTIs) for the access token check.
+
+Every BlacklistedToken is also written to Redis under `<prefix>:jti:<jti>`,
+expiring when the token would have expired anyway, and bumps a generation
+counter. Each process keeps a bloom filter of the revoked JTIs, rebuilt from
+the blacklist whenever the generation has moved, so checking a token that
+was never revoked, which is almost every request, costs one Redis GET and no
+database query. A token the filter matches is looked up in Redis, and in
+the blacklist tables if Redis does not have it, since the filter has false
+positives and Redis may have lost its data.
+
+Without Redis (an empty REVOKED_TOKENS_REDIS_URL, or Redis failing, after
+which it is left alone for REVOKED_TOKENS_RETRY seconds) every check queries
+the blacklist tables.
+
+A revocation that could not be written to Redis is kept and written, with
+its generation bump, the next time the process reaches Redis. Until then
+the other processes do not know about it, so each one also rebuilds its
+filter once it is REVOKED_TOKENS_FILTER_TTL seconds old.
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    A set of strings with no false negatives and about `error_rate` false
+    positives while it holds at most `capacity` items.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(
+            64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        step = int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(item)
+        )
+
+
+def revoked_in_database(jti):
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def unexpired_revoked_jtis():
+    return BlacklistedToken.objects.filter(
+        token__expires_at__gt=timezone.now()
+    ).values_list("token__jti", flat=True)
+
+
+class RevokedTokenIndex:
+    """
+    The Redis index and this process's bloom filter in front of it.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._down_until = 0
+        self._generation = None
+        self._filter = None
+        self._built_at = 0
+        self._unwritten = {}
+        self._lock = threading.Lock()
+
+    @property
+    def prefix(self):
+        return settings.REVOKED_TOKENS_KEY_PREFIX
+
+    @property
+    def generation_key(self):
+        return f"{self.prefix}:generation"
+
+    def jti_key(self, jti):
+        return f"{self.prefix}:jti:{jti}"
+
+    def client(self):
+        """
+        The Redis client, or None while Redis is disabled or failing.
+        """
+        if not settings.REVOKED_TOKENS_REDIS_URL:
+            return None
+        if time.monotonic() < self._down_until:
+            return None
+        if self._client is None:
+            self._client = redis.Redis.from_url(
+                settings.REVOKED_TOKENS_REDIS_URL,
+                socket_timeout=settings.REVOKED_TOKENS_TIMEOUT,
+                socket_connect_timeout=settings.REVOKED_TOKENS_TIMEOUT,
+            )
+        return self._client
+
+    def failed(self, exc):
+        logger.warning("Revoked token index unavailable: %s", exc)
+        self._down_until = time.monotonic() + settings.REVOKED_TOKENS_RETRY
+
+    def revoke(self, jti, expires_at):
+        """
+        Adds a JTI to the index until `expires_at`.
+        """
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+            if settings.REVOKED_TOKENS_REDIS_URL:
+                self._unwritten[jti] = expires_at
+        client = self.client()
+        if client is None:
+            return
+        try:
+            self.write_unwritten(client)
+        except redis.RedisError as exc:
+            self.failed(exc)
+
+    def write_unwritten(self, client):
+        """
+        Writes the revocations Redis does not have yet and bumps the
+        generation, so every process rebuilds its filter.
+        """
+        with self._lock:
+            unwritten = dict(self._unwritten)
+        if not unwritten:
+            return
+        pipeline = client.pipeline()
+        for jti, expires_at in unwritten.items():
+            ttl = math.ceil((expires_at - timezone.now()).total_seconds())
+            if ttl > 0:
+                pipeline.set(self.jti_key(jti), 1, ex=ttl)
+        pipeline.incr(self.generation_key)
+        pipeline.execute()
+        with self._lock:
+            for jti in unwritten:
+                self._unwritten.pop(jti, None)
+
+    def bloom_filter(self, generation):
+        with self._lock:
+            now = time.monotonic()
+            if (
+                self._filter is None
+                or generation != self._generation
+                or now >= self._built_at + settings.REVOKED_TOKENS_FILTER_TTL
+            ):
+                jtis = list(unexpired_revoked_jtis())
+                self._filter = BloomFilter(max(2 * len(jtis), 1024))
+                for jti in jtis:
+                    self._filter.add(jti)
+                self._generation = generation
+                self._built_at = now
+            return self._filter
+
+    def is_revoked(self, jti):
+        if not jti:
+            return False
+        client = self.client()
+        if client is None:
+            return revoked_in_database(jti)
+        try:
+            self.write_unwritten(client)
+            generation = client.get(self.generation_key)
+            if jti not in self.bloom_filter(generation):
+                return False
+            if client.exists(self.jti_key(jti)):
+                return True
+        except redis.RedisError as exc:
+            self.failed(exc)
+        return revoked_in_database(jti)
+
+    def reset(self):
+        with self._lock:
+            self._client = None
+            self._down_until = 0
+            self._generation = None
+            self._filter = None
+            self._built_at = 0
+            self._unwritten.clear()
+
+
+revoked_tokens = RevokedTokenIndex()
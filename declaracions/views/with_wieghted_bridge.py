@@ -5,11 +5,11 @@ from rest_framework import status
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_api_key.permissions import HasAPIKey
 
 from path.models import PathStation
 from trucks.models import Truck
 from users.models import CustomUser
+from utils.api_keys import CachedHasAPIKey
 from workstations.models import WorkStation
 
 from ..models import Checkin, Declaracion
@@ -23,7 +23,7 @@ class CheckTheTruck(APIView):
     and check-in records with weight measurements.
     """
     
-    permission_classes = [AllowAny, HasAPIKey]
+    permission_classes = [AllowAny, CachedHasAPIKey]
 
     def get_workstation(self, machine_number):
         try:
@@ -4,12 +4,12 @@ from drf_spectacular.utils import extend_schema, OpenApiExample
 from rest_framework import status, views
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from rest_framework_api_key.permissions import HasAPIKey
 
 from declaracions.models import Checkin
 from exporters.models import Exporter
 from path.models import PathStation
 from users.models import CustomUser
+from utils.api_keys import CachedHasAPIKey
 from workstations.models import WorkStation
 
 from ..models import JourneyWithoutTruck
@@ -23,7 +23,7 @@ class CheckinWithoutTruckView(views.APIView):
     are transported without truck registration.
     """
     
-    permission_classes = [AllowAny, HasAPIKey]
+    permission_classes = [AllowAny, CachedHasAPIKey]
 
     def get_workstation(self, machine_number):
         try:
@@ -1,8 +1,52 @@
 from django.contrib import admin
 
+from orcSync.dead_letters import replay
+
 # Register your models here.
-from orcSync.models import ChangeEvent, StationCredential, SyncAcknowledgement
+from orcSync.models import (
+    AppliedChange,
+    ChangeEvent,
+    DeadLetter,
+    DeliveryConfirmation,
+    DeliveryException,
+    OutboxEntry,
+    RowVersion,
+    StationCredential,
+    StationCursor,
+    SyncBlob,
+    SyncBlobName,
+)
 
+admin.site.register(AppliedChange)
 admin.site.register(ChangeEvent)
-admin.site.register(SyncAcknowledgement)
+admin.site.register(DeliveryConfirmation)
+admin.site.register(DeliveryException)
+admin.site.register(OutboxEntry)
+admin.site.register(RowVersion)
 admin.site.register(StationCredential)
+admin.site.register(StationCursor)
+admin.site.register(SyncBlob)
+admin.site.register(SyncBlobName)
+
+
+@admin.register(DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = (
+        "model",
+        "object_id",
+        "action",
+        "source_workstation",
+        "attempts",
+        "last_failed_at",
+        "resolved_at",
+    )
+    list_filter = ("model", "source_workstation")
+    actions = ["replay_letters"]
+
+    @admin.action(description="Replay selected dead letters")
+    def replay_letters(self, request, queryset):
+        results = replay(queryset.select_related("source_workstation"))
+        applied = sum(result["status"] == "applied" for result in results)
+        self.message_user(
+            request, f"Replayed {applied} of {len(results)} dead letters."
+        )
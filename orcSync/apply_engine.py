@@ -0,0 +1,679 @@
+"""
+Applies a batch of changes pushed by a workstation.
+
+Changes are grouped by model and the models are written in foreign key
+dependency order. Every model costs one `pk__in` query to load the rows that
+already exist, one `bulk_create` and one `bulk_update`; all resulting
+ChangeEvents are inserted with a single statement at the end. Models that
+override save() are saved one instance at a time instead, so their own
+logic still runs.
+
+Pushes are idempotent: every change carries the `event_uuid` the station
+generated, and changes already listed in AppliedChange for that station are
+reported as "skipped" without being applied or fanned out again. So are
+changes that would leave the row as it is: when the last change to an object
+hashes to the row's RowVersion (see orcSync.row_versions), nothing is
+written and no ChangeEvent is recorded.
+
+The batch is written under a savepoint. If it fails, the engine falls back
+to applying the changes one by one, each under its own savepoint, so a
+single bad change fails alone and is recorded in DeadLetter. Foreign keys are
+checked by the engine, as the database defers its own check to the commit.
+"""
+
+import base64
+import copy
+import logging
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile, File
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from orcSync.blobs import (
+    MissingBlobs,
+    is_blob_reference,
+    register_file,
+    register_name,
+)
+from orcSync.codec import codec_for
+from orcSync.dispatch import schedule_notification
+from orcSync.merkle import row_hash
+from orcSync.models import (
+    AppliedChange,
+    ChangeEvent,
+    DeadLetter,
+    SyncBlob,
+    SyncBlobName,
+)
+from orcSync.routing import BROADCAST, route_keys, rule_for
+from orcSync.row_versions import current_versions, forget_versions, record_versions
+from orcSync.signals import applying_sync_changes, changes_applied
+
+logger = logging.getLogger(__name__)
+
+FAILED_STATUSES = ("failed", "dead_lettered")
+
+
+class DecodedChange:
+    """
+    A single inbound change with its payload split by how it has to be written.
+    """
+
+    def __init__(self, index, change):
+        self.index = index
+        self.change = change
+        self.model_label = change["model"]
+        self.Model = apps.get_model(self.model_label)
+        self.object_id = change["object_id"]
+        self.action = change["action"]
+        self.data_fields = {}
+        self.fk_fields = {}
+        self.m2m_fields = {}
+        self.file_fields = {}
+        if self.action != "D":
+            (
+                self.data_fields,
+                self.fk_fields,
+                self.m2m_fields,
+                self.file_fields,
+            ) = codec_for(self.Model).decode(change["data_payload"])
+
+
+def dependency_order(model_list):
+    """
+    Orders models so that a model comes after the models its foreign keys
+    point to. Models in a cycle keep the order they arrived in.
+    """
+    present = set(model_list)
+    depends_on = {
+        Model: {
+            field.related_model
+            for field in Model._meta.concrete_fields
+            if field.is_relation
+            and field.related_model in present
+            and field.related_model is not Model
+        }
+        for Model in model_list
+    }
+
+    ordered = []
+    remaining = list(model_list)
+    while remaining:
+        ready = [M for M in remaining if not depends_on[M] - set(ordered)]
+        if not ready:
+            ready = remaining[:1]
+        for Model in ready:
+            ordered.append(Model)
+            remaining.remove(Model)
+    return ordered
+
+
+def saves_itself(Model):
+    """
+    Whether Model overrides save(), whose validation and derived fields a
+    bulk write would skip. Such models are written one instance at a time.
+    """
+    return Model.save is not models.Model.save
+
+
+class ApplyEngine:
+    """
+    Applies inbound changes for one push request. `apply()` returns one result
+    per change, in the order the changes arrived:
+
+        {"event_uuid", "model", "object_id", "status", "operation", "reason"}
+
+    `status` is "applied", "skipped", "failed" or "dead_lettered";
+    `operation` is "created", "updated" or "deleted" for applied changes.
+    """
+
+    def __init__(self, source_workstation):
+        self.source_workstation = source_workstation
+
+    def apply(self, validated_changes):
+        self.results = [
+            {
+                "event_uuid": str(change["event_uuid"]),
+                "model": change["model"],
+                "object_id": change["object_id"],
+                "status": "skipped",
+                "operation": None,
+                "reason": None,
+            }
+            for change in validated_changes
+        ]
+        decoded = []
+        failures = []
+        for index, change in self._unseen_changes(validated_changes):
+            try:
+                decoded.append(DecodedChange(index, change))
+            except Exception as exc:
+                failures.append((index, change, exc))
+        decoded = self._drop_unchanged(decoded)
+        self.blobs = self._referenced_blobs(decoded)
+        self.routes = {}
+
+        with transaction.atomic(), applying_sync_changes():
+            for index, change, exc in failures:
+                self._fail(index, change, exc)
+            try:
+                with transaction.atomic():
+                    self._apply_batch(decoded)
+            except Exception:
+                logger.warning(
+                    "Batch of %s changes from %s failed, applying one by one",
+                    len(decoded),
+                    self.source_workstation,
+                    exc_info=True,
+                )
+                self._apply_each(decoded)
+            schedule_notification(
+                [
+                    self.routes.get((item.Model, str(item.object_id)), BROADCAST)
+                    for item in decoded
+                    if self.results[item.index]["status"] == "applied"
+                ],
+                exclude=self.source_workstation.pk,
+            )
+
+        return self.results
+
+    def _apply_batch(self, decoded):
+        by_model = defaultdict(list)
+        for item in decoded:
+            by_model[item.Model].append(item)
+        order = dependency_order(list(by_model))
+
+        self._register(decoded)
+        written = {}
+        for Model in order:
+            written.update(self._upsert(Model, by_model[Model]))
+        for Model in reversed(order):
+            self._delete(Model, by_model[Model])
+        self._check_foreign_keys(written)
+        self._resolve_relations(decoded, written)
+        self._record_versions(decoded, written)
+        self._route(written)
+        self._record_events(decoded)
+        for Model in order:
+            instances = [
+                instance
+                for (written_model, _), (_, instance) in written.items()
+                if written_model is Model
+            ]
+            if instances:
+                changes_applied.send(sender=Model, instances=instances)
+
+    def _apply_each(self, decoded):
+        """
+        Applies the changes one at a time, each under its own savepoint:
+        writes in dependency order first, then deletes in reverse order.
+        """
+        order = {
+            Model: position
+            for position, Model in enumerate(
+                dependency_order(list(dict.fromkeys(item.Model for item in decoded)))
+            )
+        }
+        writes = sorted(
+            (item for item in decoded if item.action != "D"),
+            key=lambda item: (order[item.Model], item.index),
+        )
+        deletes = sorted(
+            (item for item in decoded if item.action == "D"),
+            key=lambda item: (-order[item.Model], item.index),
+        )
+        for item in decoded:
+            self.results[item.index].update(status="skipped", operation=None)
+        for item in writes + deletes:
+            try:
+                with transaction.atomic():
+                    self._apply_batch([item])
+            except Exception as exc:
+                if self._registered_elsewhere(item):
+                    continue
+                self._fail(item.index, item.change, exc)
+
+    def _registered_elsewhere(self, item):
+        """
+        Whether a concurrent retry of the same push applied the change first.
+        """
+        return AppliedChange.objects.filter(
+            source_workstation=self.source_workstation,
+            event_uuid=item.change["event_uuid"],
+        ).exists()
+
+    def _fail(self, index, change, exc):
+        """
+        Reports a change as failed and records it as a dead letter. After
+        SYNC_DEAD_LETTER_ATTEMPTS failures it is registered as applied so
+        the station stops resending it.
+        """
+        reason = f"{exc.__class__.__name__}: {exc}"
+        letter, _ = DeadLetter.objects.get_or_create(
+            source_workstation=self.source_workstation,
+            event_uuid=change["event_uuid"],
+            defaults={
+                "model": change["model"],
+                "object_id": change["object_id"],
+                "action": change["action"],
+                "data_payload": change["data_payload"],
+                "error": reason,
+            },
+        )
+        DeadLetter.objects.filter(pk=letter.pk).update(
+            attempts=F("attempts") + 1,
+            error=reason,
+            data_payload=change["data_payload"],
+            last_failed_at=timezone.now(),
+            resolved_at=None,
+        )
+        letter.refresh_from_db(fields=["attempts"])
+
+        status = "failed"
+        if letter.attempts >= settings.SYNC_DEAD_LETTER_ATTEMPTS:
+            AppliedChange.objects.get_or_create(
+                source_workstation=self.source_workstation,
+                event_uuid=change["event_uuid"],
+            )
+            status = "dead_lettered"
+        self.results[index].update(status=status, operation=None, reason=reason)
+
+    def _drop_unchanged(self, decoded):
+        """
+        Skips the objects whose changes in the batch end in a create or update
+        that hashes to the row's stored version. Objects that are deleted or
+        have many-to-many values in the batch are always applied.
+        """
+        if not decoded:
+            return decoded
+        content_types = ContentType.objects.get_for_models(
+            *{item.Model for item in decoded}
+        )
+        by_object = defaultdict(list)
+        for item in decoded:
+            key = (content_types[item.Model].pk, str(item.object_id))
+            by_object[key].append(item)
+        versions = current_versions(by_object)
+
+        unchanged = set()
+        for key, items in by_object.items():
+            if key not in versions or any(
+                item.action == "D" or item.m2m_fields for item in items
+            ):
+                continue
+            if row_hash(items[-1].change["data_payload"]) == versions[key]:
+                unchanged.update(item.index for item in items)
+
+        for index in unchanged:
+            self.results[index]["reason"] = "unchanged"
+        return [item for item in decoded if item.index not in unchanged]
+
+    def _record_versions(self, decoded, written):
+        """
+        Keeps RowVersion in step with the rows the batch wrote or deleted.
+        """
+        if not decoded:
+            return
+        content_types = ContentType.objects.get_for_models(
+            *{item.Model for item in decoded}
+        )
+        forget_versions(
+            (content_types[item.Model].pk, str(item.object_id))
+            for item in decoded
+            if item.action == "D"
+        )
+        record_versions(
+            {
+                (content_types[Model].pk, key): row_hash(
+                    codec_for(Model).encode(instance)
+                )
+                for (Model, key), (item, instance) in written.items()
+            }
+        )
+
+    def _referenced_blobs(self, decoded):
+        """
+        Loads every blob the batch references. Raises MissingBlobs before
+        anything is written if the station has not uploaded some of them.
+        """
+        hashes = {
+            value["sha256"]
+            for item in decoded
+            for value in item.file_fields.values()
+            if is_blob_reference(value)
+        }
+        if not hashes:
+            return {}
+        blobs = SyncBlob.objects.in_bulk(list(hashes))
+        missing = hashes - set(blobs)
+        if missing:
+            raise MissingBlobs(missing)
+        return blobs
+
+    def _unseen_changes(self, validated_changes):
+        """
+        Returns `(index, change)` pairs for changes this station has not pushed
+        before, using one registry query for the whole batch.
+        """
+        seen = set(
+            AppliedChange.objects.filter(
+                source_workstation=self.source_workstation,
+                event_uuid__in=[change["event_uuid"] for change in validated_changes],
+            ).values_list("event_uuid", flat=True)
+        )
+        fresh = []
+        for index, change in enumerate(validated_changes):
+            if change["event_uuid"] in seen:
+                continue
+            seen.add(change["event_uuid"])
+            fresh.append((index, change))
+        return fresh
+
+    def _register(self, decoded):
+        """
+        Records the batch in the registry before applying it. A concurrent
+        retry of the same push fails on the unique constraint and rolls back.
+        """
+        AppliedChange.objects.bulk_create(
+            [
+                AppliedChange(
+                    source_workstation=self.source_workstation,
+                    event_uuid=item.change["event_uuid"],
+                )
+                for item in decoded
+            ]
+        )
+
+    def _final_changes(self, items):
+        """
+        Collapses several changes to one object in the batch into the last one,
+        merging the payloads of consecutive creates and updates into a copy.
+        The items themselves are left as they are, so that a failed batch can
+        be retried one change at a time.
+        """
+        final = {}
+        for item in items:
+            key = str(item.object_id)
+            previous = final.get(key)
+            if previous is not None and item.action != "D" and previous.action != "D":
+                merged_item = copy.copy(item)
+                for attr in ("data_fields", "fk_fields", "m2m_fields", "file_fields"):
+                    merged = dict(getattr(previous, attr))
+                    merged.update(getattr(item, attr))
+                    setattr(merged_item, attr, merged)
+                item = merged_item
+            final[key] = item
+        return final
+
+    def _upsert(self, Model, items):
+        final = self._final_changes(items)
+        upserts = {key: item for key, item in final.items() if item.action != "D"}
+        if not upserts:
+            return {}
+
+        pk_name = Model._meta.pk.name
+        pk_attname = Model._meta.pk.attname
+        existing = {
+            str(pk): instance
+            for pk, instance in Model.objects.in_bulk(list(upserts)).items()
+        }
+
+        unique_matches = self._match_unique_fields(
+            Model, [item for key, item in upserts.items() if key not in existing]
+        )
+
+        changes_by_key = defaultdict(list)
+        for change in items:
+            changes_by_key[str(change.object_id)].append(change)
+
+        to_create, to_update, update_fields = [], [], set()
+        instances = {}
+        for key, item in upserts.items():
+            instance = existing.get(key) or unique_matches.get(key)
+            if instance is None:
+                data = {
+                    name: value
+                    for name, value in item.data_fields.items()
+                    if name not in (pk_name, pk_attname)
+                }
+                instance = Model(**data)
+                instance.pk = item.object_id
+                to_create.append(instance)
+                operation = "created"
+            else:
+                for name, value in item.data_fields.items():
+                    if name in (pk_name, pk_attname):
+                        continue
+                    setattr(instance, name, value)
+                    update_fields.add(codec_for(Model).fields[name].name)
+                to_update.append(instance)
+                operation = "updated"
+            instances[key] = instance
+            for change in changes_by_key[key]:
+                self.results[change.index].update(status="applied", operation=operation)
+
+        if saves_itself(Model):
+            for instance in to_create:
+                instance.save(force_insert=True)
+            for instance in to_update:
+                instance.save()
+        else:
+            if to_create:
+                Model.objects.bulk_create(to_create)
+            if to_update and update_fields:
+                Model.objects.bulk_update(to_update, sorted(update_fields))
+
+        self._save_files(Model, upserts, instances)
+        return {(Model, key): (upserts[key], instances[key]) for key in upserts}
+
+    def _match_unique_fields(self, Model, items):
+        """
+        Finds existing rows for changes whose primary key is unknown but whose
+        unique fields match, with one query per unique field.
+        """
+        matches = {}
+        unique_fields = [
+            f for f in Model._meta.fields if f.unique and not f.primary_key
+        ]
+        for field in unique_fields:
+            wanted = {
+                item.data_fields[field.attname]: str(item.object_id)
+                for item in items
+                if str(item.object_id) not in matches
+                and item.data_fields.get(field.attname) is not None
+            }
+            if not wanted:
+                continue
+            for instance in Model.objects.filter(
+                **{f"{field.attname}__in": list(wanted)}
+            ):
+                key = wanted.get(getattr(instance, field.attname))
+                if key is not None:
+                    matches.setdefault(key, instance)
+        return matches
+
+    def _save_files(self, Model, upserts, instances):
+        pending = [
+            (instances[key], item) for key, item in upserts.items() if item.file_fields
+        ]
+        if not pending:
+            return
+
+        current_names = {
+            getattr(instance, field_name).name
+            for instance, item in pending
+            for field_name in item.file_fields
+            if getattr(instance, field_name)
+        }
+        current_hashes = dict(
+            SyncBlobName.objects.filter(name__in=current_names).values_list(
+                "name", "blob_id"
+            )
+        )
+
+        changed = []
+        file_field_names = set()
+        for instance, item in pending:
+            for field_name, file_data in item.file_fields.items():
+                field_file = getattr(instance, field_name)
+                if is_blob_reference(file_data):
+                    if current_hashes.get(field_file.name) == file_data["sha256"]:
+                        continue
+                    blob = self.blobs[file_data["sha256"]]
+                    with blob.file.open("rb") as content:
+                        field_file.save(
+                            file_data.get("filename") or blob.sha256,
+                            File(content),
+                            save=False,
+                        )
+                    register_name(field_file.name, blob)
+                elif "filename" in file_data and file_data["content"]:
+                    field_file.save(
+                        file_data["filename"],
+                        ContentFile(base64.b64decode(file_data["content"])),
+                        save=False,
+                    )
+                    register_file(field_file)
+                elif field_file:
+                    field_file.delete(save=False)
+                file_field_names.add(field_name)
+            changed.append(instance)
+        if file_field_names:
+            Model.objects.bulk_update(changed, sorted(file_field_names))
+
+    def _delete(self, Model, items):
+        final = self._final_changes(items)
+        deletes = [key for key, item in final.items() if item.action == "D"]
+        if deletes:
+            doomed = Model.objects.filter(pk__in=deletes)
+            if rule_for(Model) is not None:
+                instances = list(doomed)
+                for instance, route in zip(instances, route_keys(instances)):
+                    self.routes[(Model, str(instance.pk))] = route
+            doomed.delete()
+        for item in items:
+            if item.action == "D":
+                self.results[item.index].update(status="applied", operation="deleted")
+
+    def _check_foreign_keys(self, written):
+        """
+        Raises IntegrityError when a foreign key sent by attname points to a
+        row that does not exist, with one existence query per related model.
+        Foreign key constraints are deferred to the end of the transaction,
+        past the savepoint a bad change would have to fail under.
+        """
+        wanted = defaultdict(set)
+        for (Model, _), (item, _) in written.items():
+            fields = codec_for(Model).fields
+            for name, value in item.data_fields.items():
+                field = fields.get(name)
+                if (
+                    isinstance(field, models.ForeignKey)
+                    and name == field.attname
+                    and value is not None
+                ):
+                    target = field.target_field
+                    wanted[field.related_model, target.attname].add(
+                        str(target.to_python(value))
+                    )
+
+        for (RelatedModel, attname), values in wanted.items():
+            found = {
+                str(value)
+                for value in RelatedModel._base_manager.filter(
+                    **{f"{attname}__in": list(values)}
+                ).values_list(attname, flat=True)
+            }
+            missing = values - found
+            if missing:
+                raise IntegrityError(
+                    f"{RelatedModel._meta.label} {', '.join(sorted(missing))} "
+                    "does not exist"
+                )
+
+    def _resolve_relations(self, decoded, written):
+        """
+        Sets foreign keys sent by related object id and many-to-many values,
+        with one existence query per related model.
+        """
+        wanted = defaultdict(set)
+        for item in decoded:
+            if (item.Model, str(item.object_id)) not in written:
+                continue
+            for field, related_id in item.fk_fields.values():
+                wanted[field.related_model].add(related_id)
+            for field_name, related_ids in item.m2m_fields.items():
+                field = item.Model._meta.get_field(field_name)
+                wanted[field.related_model].update(related_ids)
+
+        known = {
+            RelatedModel: {
+                str(pk)
+                for pk in RelatedModel.objects.filter(pk__in=ids).values_list(
+                    "pk", flat=True
+                )
+            }
+            for RelatedModel, ids in wanted.items()
+        }
+
+        fk_updates = defaultdict(lambda: ([], set()))
+        for (Model, key), (item, instance) in written.items():
+            if item.fk_fields:
+                for attname, (field, related_id) in item.fk_fields.items():
+                    if str(related_id) in known.get(field.related_model, ()):
+                        setattr(instance, attname, related_id)
+                        fk_updates[Model][1].add(field.name)
+                fk_updates[Model][0].append(instance)
+            for field_name, related_ids in item.m2m_fields.items():
+                field = Model._meta.get_field(field_name)
+                existing_ids = known.get(field.related_model, set())
+                getattr(instance, field_name).set(
+                    [pk for pk in related_ids if str(pk) in existing_ids]
+                )
+
+        for Model, (instances, fields) in fk_updates.items():
+            if fields:
+                Model.objects.bulk_update(instances, sorted(fields))
+
+    def _route(self, written):
+        """
+        Computes the route key of every written object, per model.
+        """
+        by_model = defaultdict(list)
+        for (Model, key), (_, instance) in written.items():
+            if rule_for(Model) is not None:
+                by_model[Model].append((key, instance))
+        for Model, pairs in by_model.items():
+            routes = route_keys([instance for _, instance in pairs])
+            for (key, _), route in zip(pairs, routes):
+                self.routes[(Model, key)] = route
+
+    def _record_events(self, decoded):
+        if not decoded:
+            return
+        content_types = ContentType.objects.get_for_models(
+            *{item.Model for item in decoded}
+        )
+        first_sequence = ChangeEvent.objects.allocate_sequences(len(decoded))
+        ChangeEvent.objects.bulk_create(
+            [
+                ChangeEvent(
+                    sequence=first_sequence + offset,
+                    object_id=str(item.object_id),
+                    content_type=content_types[item.Model],
+                    action=item.action,
+                    route_key=self.routes.get(
+                        (item.Model, str(item.object_id)), BROADCAST
+                    ),
+                    data_payload=item.change["data_payload"],
+                    source_workstation=self.source_workstation,
+                )
+                for offset, item in enumerate(decoded)
+            ]
+        )
@@ -1,6 +1,10 @@
+import logging
+
 from django.apps import AppConfig
 from django.conf import settings
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+logger = logging.getLogger(__name__)
 
 
 class OrcsyncConfig(AppConfig):
@@ -10,12 +14,43 @@ class OrcsyncConfig(AppConfig):
     def ready(self):
         from django.apps import apps
 
-        from .signals import handle_delete, handle_save
+        from workstations.models import WorkStation
+
+        from .codec import compile_codecs
+        from .models import StationCredential
+        from .signals import (
+            handle_credential_changed,
+            handle_delete,
+            handle_pre_save,
+            handle_save,
+            handle_workstation_created,
+        )
+
+        post_save.connect(
+            handle_workstation_created,
+            sender=WorkStation,
+            dispatch_uid="central_sync_workstation_cursor",
+        )
+        post_save.connect(
+            handle_credential_changed,
+            sender=StationCredential,
+            dispatch_uid="central_sync_credential_save",
+        )
+        post_delete.connect(
+            handle_credential_changed,
+            sender=StationCredential,
+            dispatch_uid="central_sync_credential_delete",
+        )
 
         model_strings = getattr(settings, "SYNCHRONIZABLE_MODELS", [])
         for model_string in model_strings:
             try:
                 model = apps.get_model(model_string)
+                pre_save.connect(
+                    handle_pre_save,
+                    sender=model,
+                    dispatch_uid=f"central_sync_pre_save_{model._meta.label}",
+                )
                 post_save.connect(
                     handle_save,
                     sender=model,
@@ -28,5 +63,6 @@ class OrcsyncConfig(AppConfig):
                 )
                 print(f"SYNC_SERVER: Signals connected for model {model_string}")
             except LookupError:
-                print(f"SYNC_SERVER WARNING: Model '{model_string}' not found.")
-                print(f"SYNC_SERVER WARNING: Model '{model_string}' not found.")
\ No newline at end of file
+                logger.warning("SYNC_SERVER: Model '%s' not found.", model_string)
+
+        compile_codecs()
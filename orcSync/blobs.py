@@ -0,0 +1,199 @@
+"""
+Content-addressed store for files that travel through sync.
+
+File fields are synced as a reference `{"sha256", "filename", "size"}` instead
+of inline base64. The bytes themselves move through the blob endpoint, in
+resumable chunks, and a blob with a known hash is never transferred twice.
+
+Files are hashed when a change is captured or written by sync, and every
+storage name is recorded in SyncBlobName. Reading references only looks up
+those names.
+"""
+
+import hashlib
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models
+
+from orcSync.models import SyncBlob, SyncBlobName
+
+CHUNK_SIZE = 64 * 1024
+PARTIAL_DIR = "sync_blobs/partial"
+
+# Instance attribute holding the blobs prefetched for its file fields.
+BLOBS_ATTR = "_sync_blobs"
+
+
+class BlobUploadError(Exception):
+    """
+    Raised when an uploaded chunk does not continue the partial blob, or the
+    finished upload does not match its hash.
+    """
+
+    def __init__(self, message, received=0):
+        super().__init__(message)
+        self.received = received
+
+
+class MissingBlobs(Exception):
+    """
+    Raised when pushed changes reference blobs that were not uploaded yet.
+    """
+
+    def __init__(self, hashes):
+        super().__init__(f"{len(hashes)} referenced blobs have not been uploaded.")
+        self.hashes = sorted(hashes)
+
+
+def is_blob_reference(value):
+    return isinstance(value, dict) and "sha256" in value
+
+
+def hash_stream(stream):
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def register_file(field_file):
+    """
+    Records the blob behind the current storage file of a FieldFile and
+    returns it, or None when there is no readable file. The file is only read
+    the first time its name is seen.
+    """
+    if not field_file:
+        return None
+
+    known = SyncBlobName.objects.filter(name=field_file.name).select_related("blob")
+    if known:
+        return known[0].blob
+
+    blob = SyncBlob.objects.filter(file=field_file.name).first()
+    if blob is None:
+        try:
+            with field_file.open("rb") as f:
+                sha256, size = hash_stream(f)
+        except (IOError, FileNotFoundError):
+            return None
+        blob, _ = SyncBlob.objects.get_or_create(
+            sha256=sha256, defaults={"file": field_file.name, "size": size}
+        )
+    register_name(field_file.name, blob)
+    return blob
+
+
+def register_name(name, blob):
+    """
+    Records that the storage file `name` holds the content of `blob`.
+    """
+    SyncBlobName.objects.update_or_create(name=name, defaults={"blob": blob})
+
+
+def prefetch_blobs(instances):
+    """
+    Looks up the blobs of the file fields of `instances` with one query and
+    keeps them on each instance for blob_reference. None items are skipped.
+    """
+    instances = [instance for instance in instances if instance is not None]
+    names = {
+        field_file.name
+        for instance in instances
+        for field_file in _field_files(instance)
+        if field_file
+    }
+    if not names:
+        return
+    found = {
+        known.name: known.blob
+        for known in SyncBlobName.objects.filter(name__in=names).select_related("blob")
+    }
+    blobs = {name: found.get(name) for name in names}
+    for instance in instances:
+        instance.__dict__[BLOBS_ATTR] = blobs
+
+
+def _field_files(instance):
+    return [
+        getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+        if isinstance(field, models.FileField) and field.attname in instance.__dict__
+    ]
+
+
+def blob_reference(field_file):
+    """
+    Returns the sync reference of a FieldFile, or None when its file has not
+    been registered (see register_file). Files are never read here; blobs
+    prefetched with prefetch_blobs save the query.
+    """
+    if not field_file:
+        return None
+
+    blobs = field_file.instance.__dict__.get(BLOBS_ATTR, {})
+    if field_file.name in blobs:
+        blob = blobs[field_file.name]
+    else:
+        known = SyncBlobName.objects.filter(name=field_file.name).select_related("blob")
+        blob = known[0].blob if known else None
+    if blob is None:
+        return None
+
+    return {
+        "sha256": blob.sha256,
+        "filename": os.path.basename(field_file.name),
+        "size": blob.size,
+    }
+
+
+def partial_name(sha256):
+    return f"{PARTIAL_DIR}/{sha256}"
+
+
+def received_size(sha256):
+    name = partial_name(sha256)
+    return default_storage.size(name) if default_storage.exists(name) else 0
+
+
+def store_chunk(sha256, stream, start, total):
+    """
+    Appends a chunk to the partial upload of `sha256` and returns the blob
+    once all `total` bytes have arrived, otherwise the number received.
+    """
+    received = received_size(sha256)
+    if start != received:
+        raise BlobUploadError(
+            f"Chunk starts at {start}, expected {received}.", received
+        )
+
+    name = partial_name(sha256)
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(b""))
+    with open(default_storage.path(name), "ab") as partial:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            partial.write(chunk)
+            received += len(chunk)
+            if received > total:
+                break
+
+    if received < total:
+        return received
+
+    with default_storage.open(name, "rb") as partial:
+        digest, size = hash_stream(partial)
+    if digest != sha256 or size != total:
+        default_storage.delete(name)
+        raise BlobUploadError("Uploaded content does not match its hash.")
+
+    final_name = f"sync_blobs/{sha256[:2]}/{sha256}"
+    with default_storage.open(name, "rb") as partial:
+        final_name = default_storage.save(final_name, partial)
+    default_storage.delete(name)
+    blob, _ = SyncBlob.objects.get_or_create(
+        sha256=sha256, defaults={"file": final_name, "size": size}
+    )
+    return blob
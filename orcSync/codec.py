@@ -0,0 +1,245 @@
+"""
+Compiled per-model payload codecs shared by every sync code path.
+
+A ModelCodec inspects a model's fields once and keeps, for encoding, a list
+of `(payload key, attname, converter)` steps and, for decoding, a map of
+payload key to how the value is written. Capturing central changes,
+formatting outbound changes and applying pushed changes all go through the
+same codec instead of walking `_meta.get_fields()` per object.
+"""
+
+import copy
+import decimal
+import uuid
+from datetime import datetime
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+
+from orcSync.blobs import BLOBS_ATTR, blob_reference, is_blob_reference, register_file
+
+# How a decoded payload value has to be written.
+DATA, RELATION, MANY_TO_MANY, FILE = "data", "relation", "m2m", "file"
+
+PLAIN_TYPES = (str, int, float, bool, list, dict)
+
+# Instance attribute holding the stored field values an update is a delta of.
+LOADED_STATE_ATTR = "_sync_loaded_state"
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def _json_value(value):
+    """
+    Converter for fields without a dedicated one: passes JSON types through
+    and stringifies the few Python types that are not.
+    """
+    if isinstance(value, PLAIN_TYPES):
+        return value
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def _parse_datetime(value):
+    if not isinstance(value, str):
+        return value
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+def _file_name(value):
+    return getattr(value, "name", value) or ""
+
+
+def _is_file_value(value):
+    return is_blob_reference(value) or (isinstance(value, dict) and "content" in value)
+
+
+class ModelCodec:
+    """
+    Encoder and decoder plan for one model, built once.
+    """
+
+    def __init__(self, Model):
+        self.Model = Model
+        self.encoders = []
+        self.file_fields = []
+        # payload key -> (kind, target key, field, converter)
+        self.decoders = {}
+        # payload key -> field, for callers that need the field behind a key
+        self.fields = {}
+
+        excluded = set(
+            getattr(settings, "SYNC_EXCLUDED_FIELDS", {}).get(Model._meta.label, ())
+        )
+        for field in Model._meta.concrete_fields:
+            if field.name in excluded:
+                continue
+            self.fields[field.name] = field
+            self.fields[field.attname] = field
+            if isinstance(field, models.FileField):
+                self.file_fields.append(field)
+                self.decoders[field.name] = (FILE, field.name, field, None)
+            elif isinstance(field, models.ForeignKey):
+                self.encoders.append((field.attname, field.attname, str))
+                self.decoders[field.attname] = (DATA, field.attname, field, None)
+                self.decoders[field.name] = (RELATION, field.attname, field, None)
+            elif isinstance(field, (models.DateTimeField, models.DateField)):
+                self.encoders.append((field.name, field.attname, _isoformat))
+                self.decoders[field.name] = (
+                    DATA,
+                    field.attname,
+                    field,
+                    _parse_datetime,
+                )
+            elif isinstance(field, models.TimeField):
+                self.encoders.append((field.name, field.attname, _isoformat))
+                self.decoders[field.name] = (DATA, field.attname, field, None)
+            elif isinstance(field, (models.DecimalField, models.UUIDField)):
+                self.encoders.append((field.name, field.attname, str))
+                self.decoders[field.name] = (DATA, field.attname, field, None)
+            else:
+                self.encoders.append((field.name, field.attname, _json_value))
+                self.decoders[field.name] = (DATA, field.attname, field, None)
+
+        for field in Model._meta.local_many_to_many:
+            self.fields[field.name] = field
+            self.decoders[field.name] = (MANY_TO_MANY, field.name, field, None)
+
+        self.attnames = [attname for _, attname, _ in self.encoders] + [
+            field.attname for field in self.file_fields
+        ]
+
+    def encode(self, instance, blob_url=None):
+        """
+        Returns the sync payload of `instance`. File fields become blob
+        references; `blob_url`, when given, maps a hash to a download URL
+        that is added to each reference.
+        """
+        payload = {}
+        for key, attname, converter in self.encoders:
+            value = getattr(instance, attname)
+            payload[key] = None if value is None else converter(value)
+        for field in self.file_fields:
+            reference = blob_reference(getattr(instance, field.attname))
+            if reference and blob_url is not None:
+                reference["url"] = blob_url(reference["sha256"])
+            payload[field.name] = reference
+        return payload
+
+    def register_files(self, instance):
+        """
+        Registers the current files of `instance` as blobs, so that encoding
+        it finds them (see orcSync.blobs.register_file).
+        """
+        blobs = {}
+        for field in self.file_fields:
+            field_file = getattr(instance, field.attname)
+            if field_file:
+                blobs[field_file.name] = register_file(field_file)
+        instance.__dict__[BLOBS_ATTR] = blobs
+
+    def state(self, instance):
+        """
+        Copies the raw field values of `instance`, leaving deferred fields out.
+        """
+        values = instance.__dict__
+        state = {}
+        for attname in self.attnames:
+            if attname in values:
+                value = values[attname]
+                if isinstance(value, (dict, list)):
+                    value = copy.deepcopy(value)
+                state[attname] = value
+        return state
+
+    def stored_state(self, instance):
+        """
+        Reads the raw field values stored in the row of `instance`, or None
+        when it has no row.
+        """
+        return (
+            self.Model._base_manager.filter(pk=instance.pk)
+            .values(*self.attnames)
+            .first()
+        )
+
+    def encode_loaded(self, instance, payload):
+        """
+        Encodes the stored state `instance` is updated from, given `payload`,
+        its current encoding. Returns None when that state is unknown, or when
+        a file changed since only the current file can be referenced.
+        """
+        state = instance.__dict__.get(LOADED_STATE_ATTR)
+        if state is None:
+            return None
+        loaded = {}
+        for key, attname, converter in self.encoders:
+            if attname not in state:
+                return None
+            value = state[attname]
+            loaded[key] = None if value is None else converter(value)
+        for field in self.file_fields:
+            if field.attname not in state or _file_name(
+                state[field.attname]
+            ) != _file_name(getattr(instance, field.attname)):
+                return None
+            loaded[field.name] = payload[field.name]
+        return loaded
+
+    def decode(self, payload):
+        """
+        Splits a payload into `(data, relations, many_to_many, files)`.
+
+        `data` maps attnames to values ready to assign, `relations` maps the
+        attname of foreign keys sent by field name to `(field, value)` so the
+        caller can check the target exists. Unknown keys and None values are
+        dropped.
+        """
+        data, relations, many_to_many, files = {}, {}, {}, {}
+        decoders = self.decoders
+        for key, value in payload.items():
+            decoder = decoders.get(key)
+            if decoder is None or value is None:
+                continue
+            kind, target, field, converter = decoder
+            if kind == DATA:
+                data[target] = value if converter is None else converter(value)
+            elif kind == RELATION:
+                relations[target] = (field, value)
+            elif kind == MANY_TO_MANY:
+                many_to_many[target] = value
+            elif _is_file_value(value):
+                files[target] = value
+        return data, relations, many_to_many, files
+
+
+_codecs = {}
+
+
+def codec_for(Model):
+    """
+    Returns the compiled codec of `Model`, compiling it on first use.
+    """
+    codec = _codecs.get(Model)
+    if codec is None:
+        codec = _codecs[Model] = ModelCodec(Model)
+    return codec
+
+
+def compile_codecs():
+    """
+    Compiles the codecs of every model in SYNCHRONIZABLE_MODELS up front.
+    """
+    for model_string in getattr(settings, "SYNCHRONIZABLE_MODELS", []):
+        try:
+            codec_for(apps.get_model(model_string))
+        except LookupError:
+            continue
@@ -0,0 +1,29 @@
+"""
+Replaying inbound changes that were parked as dead letters.
+"""
+
+from django.utils import timezone
+
+from orcSync.apply_engine import ApplyEngine
+from orcSync.models import AppliedChange, DeadLetter
+
+
+def replay(letters):
+    """
+    Applies each unresolved letter again as if its station had pushed it.
+    Letters that apply are marked resolved; the others record another
+    failed attempt. Returns the ApplyEngine result of every letter.
+    """
+    results = []
+    for letter in letters:
+        if letter.resolved_at is not None:
+            continue
+        AppliedChange.objects.filter(
+            source_workstation=letter.source_workstation,
+            event_uuid=letter.event_uuid,
+        ).delete()
+        [result] = ApplyEngine(letter.source_workstation).apply([letter.as_change()])
+        if result["status"] == "applied":
+            DeadLetter.objects.filter(pk=letter.pk).update(resolved_at=timezone.now())
+        results.append(result)
+    return results
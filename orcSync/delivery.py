@@ -0,0 +1,467 @@
+"""
+Watermark based delivery of ChangeEvents to workstations.
+
+Instead of one acknowledgement row per event and station, every station has
+a StationCursor per priority lane (orcSync.lanes) holding the highest
+sequence of that lane it has applied. Events below a watermark which the
+station could not apply are kept in the small DeliveryException set and are
+sent again until they are acknowledged.
+
+Pending events are coalesced per object: an event is only sent when no later
+event exists for the same `(content_type, object_id)`. The outbound payload is
+read from the live object anyway, so the latest event carries the final state,
+and a delete supersedes earlier creates and updates. Acknowledging the latest
+event therefore settles the superseded ones as well. An update that has
+pending events coalesced into it is annotated with `coalesces_pending`, since
+the station misses those and cannot be sent just its delta.
+
+A station learns which of its own events have reached every other station
+through its confirmation queue (DeliveryConfirmation). Events are moved into
+the queue once as they become fully acknowledged, and read from it a page at
+a time, so a pull never has to look at the station's whole history.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, Min, OuterRef, Q
+from django.utils import timezone
+
+from orcSync.blobs import prefetch_blobs
+from orcSync.lanes import lane_filter, lane_names, lane_of_content_type, lane_shares
+from orcSync.models import (
+    ChangeEvent,
+    DeliveryConfirmation,
+    DeliveryException,
+    StationCursor,
+)
+from orcSync.routing import BROADCAST, subscriptions
+from path.models import PathStation
+
+CONFIRMATION_BATCH = 5000
+
+
+def outbound_events(workstation, lane=None):
+    """
+    All events a workstation should receive: everything routed to it that it
+    did not send itself, optionally restricted to one priority lane.
+    """
+    events = ChangeEvent.objects.filter(
+        route_key__in=subscriptions(workstation)
+    ).exclude(source_workstation=workstation)
+    if lane is not None:
+        events = events.filter(lane_filter(lane))
+    return events
+
+
+def superseding_events(through=None):
+    """
+    Later events for the same object and route as the outer ChangeEvent, for
+    use in Exists(). With `through`, only events up to that sequence are
+    considered. An event moved to another route is not superseded for the
+    stations that only follow the old one.
+    """
+    later = ChangeEvent.objects.filter(
+        content_type=OuterRef("content_type"),
+        object_id=OuterRef("object_id"),
+        route_key=OuterRef("route_key"),
+        sequence__gt=OuterRef("sequence"),
+    )
+    if through is not None:
+        later = later.filter(sequence__lte=through)
+    return later
+
+
+def coalesced_events(after):
+    """
+    Earlier events above `after` for the same object and route as the outer
+    ChangeEvent, for use in Exists().
+    """
+    return ChangeEvent.objects.filter(
+        content_type=OuterRef("content_type"),
+        object_id=OuterRef("object_id"),
+        route_key=OuterRef("route_key"),
+        sequence__gt=after,
+        sequence__lt=OuterRef("sequence"),
+    )
+
+
+def latest_only(queryset):
+    """
+    Drops events that have been superseded by a later event for the same object.
+    """
+    return queryset.exclude(Exists(superseding_events()))
+
+
+class PendingPage:
+    """
+    The next page of events for a workstation.
+
+    Events waiting for redelivery come first. The rest of the page is shared
+    between the priority lanes: each lane with a backlog gets its weighted
+    share of the page (orcSync.lanes.lane_shares) above its own `after`, and
+    what the lanes leave unused goes to the highest lanes that have more.
+    The events are then sent in sequence order, so a change still comes
+    after the changes it depends on when both are in the page. The lanes
+    share the page and it is sorted, so it is read into memory, at most
+    `limit` events, before the first event is yielded.
+
+    `after` defaults to each lane's acknowledged watermark; a single `after`
+    applies to every lane and `lane_after` overrides it per lane.
+    `next_after` and `has_more` are known once the page has been iterated,
+    both per lane (`lanes`) and overall: `next_after` is the lowest lane
+    position and `has_more` is set when any lane has more. Iterating also
+    moves the station's delivered watermarks. A lane read to its end moves
+    its `next_after` to the head, past events routed elsewhere.
+    """
+
+    def __init__(self, workstation, after=None, limit=500, lane_after=None):
+        self.workstation = workstation
+        self.cursors = StationCursor.for_lanes(workstation)
+        lane_after = lane_after or {}
+        self.after = {
+            lane: lane_after.get(
+                lane, cursor.acknowledged_sequence if after is None else after
+            )
+            for lane, cursor in self.cursors.items()
+        }
+        self.limit = limit
+        self.lanes = {
+            lane: {"next_after": position, "has_more": False}
+            for lane, position in self.after.items()
+        }
+
+    @property
+    def next_after(self):
+        return min(lane["next_after"] for lane in self.lanes.values())
+
+    @property
+    def has_more(self):
+        return any(lane["has_more"] for lane in self.lanes.values())
+
+    def __iter__(self):
+        redeliveries = list(
+            latest_only(
+                ChangeEvent.objects.filter(
+                    delivery_exceptions__destination_workstation=self.workstation
+                )
+            )
+            .select_related("content_type")
+            .prefetch_related("changed_object")
+            .order_by("sequence")[: self.limit]
+        )
+        prefetch_blobs(event.changed_object for event in redeliveries)
+        yield from redeliveries
+        redelivered_ids = {event.id for event in redeliveries}
+        remaining = self.limit - len(redeliveries)
+
+        head = ChangeEvent.objects.head()
+        events = []
+        for lane, share in lane_shares(remaining).items():
+            events.extend(self.read_lane(lane, share))
+        for lane in self.lanes:
+            unused = remaining - len(events)
+            if unused > 0 and self.lanes[lane]["has_more"]:
+                events.extend(self.read_lane(lane, unused))
+
+        events.sort(key=lambda event: event.sequence)
+        prefetch_blobs(event.changed_object for event in events)
+        for event in events:
+            if event.id not in redelivered_ids:
+                yield event
+
+        now = timezone.now()
+        for lane, progress in self.lanes.items():
+            if not progress["has_more"]:
+                progress["next_after"] = max(progress["next_after"], head)
+            if progress["next_after"] > self.after[lane]:
+                StationCursor.objects.filter(pk=self.cursors[lane].pk).update(
+                    delivered_sequence=progress["next_after"], delivered_at=now
+                )
+
+    def read_lane(self, lane, count):
+        """
+        Reads up to `count` more events of `lane` and moves its position.
+        """
+        progress = self.lanes[lane]
+        rows = list(
+            latest_only(
+                outbound_events(self.workstation, lane).filter(
+                    sequence__gt=progress["next_after"]
+                )
+            )
+            .annotate(coalesces_pending=Exists(coalesced_events(self.after[lane])))
+            .select_related("content_type")
+            .prefetch_related("changed_object")
+            .order_by("sequence")[: count + 1]
+        )
+        progress["has_more"] = len(rows) > count
+        rows = rows[:count]
+        if rows:
+            progress["next_after"] = rows[-1].sequence
+        return rows
+
+
+def pending_events(workstation, after=None, limit=500):
+    """
+    Returns `(events, next_after, has_more)` for the next page of a workstation.
+    """
+    page = PendingPage(workstation, after=after, limit=limit)
+    events = list(page)
+    return events, page.next_after, page.has_more
+
+
+def event_lanes(event_ids):
+    """
+    Maps event ids to `(lane, sequence)`.
+    """
+    return {
+        event.id: (lane_of_content_type(event.content_type), event.sequence)
+        for event in ChangeEvent.objects.filter(id__in=event_ids).select_related(
+            "content_type"
+        )
+    }
+
+
+def acknowledge(
+    workstation, event_ids=(), through=None, failed_ids=(), lane_through=None
+):
+    """
+    Moves the acknowledged watermarks of a workstation and returns them by
+    lane.
+
+    With an explicit `through` the station states that it applied every event
+    up to that sequence, in every lane, except `failed_ids`; `lane_through`
+    states it per lane, as the `lanes` of get-pending report positions. A lane
+    never moves past what it has been delivered, since the lanes are paged
+    independently and one number cannot stand for all of them. A lane without
+    an explicit position moves to the highest acknowledged event of the lane,
+    and events of the lane in the newly covered range that were not
+    acknowledged are kept for redelivery.
+    """
+    cursors = StationCursor.for_lanes(workstation)
+    event_ids = set(event_ids)
+    failed_ids = set(failed_ids)
+    lane_through = lane_through or {}
+    head = ChangeEvent.objects.head()
+
+    acknowledged = {lane: [] for lane in cursors}
+    for lane, sequence in event_lanes(event_ids).values():
+        if lane in acknowledged and sequence is not None:
+            acknowledged[lane].append(sequence)
+
+    targets, covered = {}, {}
+    for lane, cursor in cursors.items():
+        watermark = cursor.acknowledged_sequence
+        through_lane = lane_through.get(lane, through)
+        if through_lane is not None:
+            through_lane = min(through_lane, cursor.delivered_sequence)
+        else:
+            through_lane = max(acknowledged[lane], default=watermark)
+            if through_lane > watermark:
+                failed_ids.update(
+                    latest_only(
+                        outbound_events(workstation, lane).filter(
+                            sequence__gt=watermark, sequence__lte=through_lane
+                        )
+                    )
+                    .exclude(id__in=event_ids)
+                    .values_list("id", flat=True)
+                )
+        targets[lane] = min(through_lane, head)
+        covered[lane] = max(targets[lane], watermark)
+
+    with transaction.atomic():
+        if event_ids:
+            DeliveryException.objects.filter(
+                destination_workstation=workstation, change_event_id__in=event_ids
+            ).delete()
+
+        failed_ids -= event_ids
+        if failed_ids:
+            within = Q()
+            for lane, position in covered.items():
+                within |= lane_filter(lane) & Q(sequence__lte=position)
+            redeliver = (
+                ChangeEvent.objects.filter(id__in=failed_ids)
+                .filter(within)
+                .values_list("id", flat=True)
+            )
+            DeliveryException.objects.bulk_create(
+                [
+                    DeliveryException(
+                        change_event_id=event_id,
+                        destination_workstation=workstation,
+                    )
+                    for event_id in redeliver
+                ],
+                ignore_conflicts=True,
+            )
+
+        now = timezone.now()
+        for lane, cursor in cursors.items():
+            # Events replaced by a later, now delivered event need no redelivery.
+            DeliveryException.objects.filter(
+                destination_workstation=workstation,
+                change_event__in=ChangeEvent.objects.filter(
+                    lane_filter(lane),
+                    Exists(superseding_events(through=covered[lane])),
+                ),
+            ).delete()
+
+            if targets[lane] > cursor.acknowledged_sequence:
+                StationCursor.objects.filter(
+                    pk=cursor.pk, acknowledged_sequence__lt=targets[lane]
+                ).update(acknowledged_sequence=targets[lane], acknowledged_at=now)
+
+    return covered
+
+
+def acknowledged_floors(exclude=None):
+    """
+    Maps each route key received by a station other than `exclude` to
+    `{lane: floor}`, the highest sequence of the lane every station receiving
+    the route has acknowledged. Returns None when there is no such station.
+    A station without a cursor for a lane yet counts with its lowest cursor.
+    """
+    positions = defaultdict(dict)
+    cursors = StationCursor.objects.all()
+    if exclude is not None:
+        cursors = cursors.exclude(workstation=exclude)
+    for station_id, lane, sequence in cursors.values_list(
+        "workstation_id", "lane", "acknowledged_sequence"
+    ):
+        positions[station_id][lane] = sequence
+    if not positions:
+        return None
+
+    routes = {
+        station_id: {BROADCAST, f"station:{station_id}"} for station_id in positions
+    }
+    for station_id, path_id in PathStation.objects.filter(
+        station_id__in=positions
+    ).values_list("station_id", "path_id"):
+        routes[station_id].add(f"path:{path_id}")
+
+    floors = {}
+    for station_id, lanes in positions.items():
+        station_floors = {
+            lane: lanes.get(lane, min(lanes.values())) for lane in lane_names()
+        }
+        for key in routes[station_id]:
+            route_floors = floors.setdefault(key, station_floors)
+            floors[key] = {
+                lane: min(floor, station_floors[lane])
+                for lane, floor in route_floors.items()
+            }
+    return floors
+
+
+def below_floors(floors):
+    """
+    A Q object selecting the events at or below the floor of their route and
+    lane, and the events of routes no station in `floors` receives.
+    """
+    by_floors = defaultdict(list)
+    for key, route_floors in floors.items():
+        by_floors[tuple(sorted(route_floors.items()))].append(key)
+    within = ~Q(route_key__in=list(floors))
+    for route_floors, keys in by_floors.items():
+        lanes = Q()
+        for lane, floor in route_floors:
+            lanes |= lane_filter(lane) & Q(sequence__lte=floor)
+        within |= Q(route_key__in=keys) & lanes
+    return within
+
+
+def fully_acknowledged_events(workstation):
+    """
+    Ids of events sent by `workstation` that every other station receiving
+    them has applied.
+    """
+    events = ChangeEvent.objects.filter(source_workstation=workstation)
+    floors = acknowledged_floors(exclude=workstation)
+    if floors is not None:
+        events = events.filter(below_floors(floors))
+    return events.filter(delivery_exceptions__isnull=True).values_list("id", flat=True)
+
+
+def record_confirmations(workstation, limit=CONFIRMATION_BATCH):
+    """
+    Queues up to `limit` events sent by `workstation` that have become fully
+    acknowledged and have not been queued yet. Returns how many were queued.
+    """
+    with transaction.atomic():
+        # Keeps concurrent pulls of the same station from queueing twice.
+        list(StationCursor.objects.select_for_update().filter(workstation=workstation))
+        event_ids = list(
+            fully_acknowledged_events(workstation)
+            .filter(confirmed_at__isnull=True)
+            .order_by("sequence")[:limit]
+        )
+        if event_ids:
+            DeliveryConfirmation.objects.bulk_create(
+                [
+                    DeliveryConfirmation(workstation=workstation, event_id=event_id)
+                    for event_id in event_ids
+                ]
+            )
+            ChangeEvent.objects.filter(id__in=event_ids).update(
+                confirmed_at=timezone.now()
+            )
+    return len(event_ids)
+
+
+def read_confirmations(workstation, after=None, limit=None):
+    """
+    Returns `(event_ids, confirmed_after, has_more)` for the next page of the
+    confirmation queue of a workstation.
+
+    The entries up to `after` have been read and are drained. Without
+    `after` nothing is drained, so a station whose response was lost is
+    served the same entries again.
+    """
+    limit = limit or settings.SYNC_CONFIRMATION_LIMIT
+    queue = DeliveryConfirmation.objects.filter(workstation=workstation)
+    if after is not None:
+        queue.filter(id__lte=after).delete()
+    rows = list(queue.order_by("id").values_list("id", "event_id")[: limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        after = rows[-1][0]
+    return [event_id for _, event_id in rows], after, has_more
+
+
+def backlog(workstation):
+    """
+    Per lane, the events waiting above the workstation's acknowledged
+    watermark, the events waiting for redelivery and when the oldest waiting
+    event was created.
+    """
+    metrics = {}
+    for lane, cursor in StationCursor.for_lanes(workstation).items():
+        waiting = outbound_events(workstation, lane).filter(
+            sequence__gt=cursor.acknowledged_sequence
+        )
+        stats = waiting.aggregate(pending=Count("id"), oldest=Min("timestamp"))
+        redeliveries = ChangeEvent.objects.filter(
+            lane_filter(lane),
+            delivery_exceptions__destination_workstation=workstation,
+        )
+        redelivery_stats = redeliveries.aggregate(
+            redeliveries=Count("id"), oldest=Min("timestamp")
+        )
+        oldest = [
+            value
+            for value in (stats["oldest"], redelivery_stats["oldest"])
+            if value is not None
+        ]
+        metrics[lane] = {
+            "acknowledged_sequence": cursor.acknowledged_sequence,
+            "pending": stats["pending"],
+            "redeliveries": redelivery_stats["redeliveries"],
+            "oldest": min(oldest, default=None),
+        }
+    return metrics
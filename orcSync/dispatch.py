@@ -0,0 +1,206 @@
+"""
+Notifying stations of new changes through `StationCredential.base_url`.
+
+When changes are recorded for some route keys, the stations that receive
+them get a small POST on `<base_url><SYNC_NOTIFY_PATH>` carrying the current
+head of the ChangeEvent sequence, and pull get-pending in response. Stations
+then only need to poll as a fallback.
+
+Notifications are sent by an asyncio dispatcher with at most
+SYNC_NOTIFY_CONCURRENCY requests in flight. A station that fails is retried
+with exponential backoff, and after SYNC_NOTIFY_BREAKER_THRESHOLD failed
+notifications in a row its circuit opens: it is skipped for
+SYNC_NOTIFY_BREAKER_COOLDOWN seconds, after which one notification is let
+through to probe it. Breaker state is kept per process.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from orcSync.models import ChangeEvent, StationCredential
+from orcSync.routing import BROADCAST
+from path.models import PathStation
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Consecutive failure counts and open circuits of the stations, by id.
+    """
+
+    def __init__(self):
+        self._failures = {}
+        self._open_until = {}
+        self._lock = threading.Lock()
+
+    def allows(self, station_id):
+        with self._lock:
+            open_until = self._open_until.get(station_id)
+            if open_until is None:
+                return True
+            if time.monotonic() < open_until:
+                return False
+            # Half open: let one notification through to probe the station.
+            del self._open_until[station_id]
+            self._failures[station_id] = settings.SYNC_NOTIFY_BREAKER_THRESHOLD - 1
+            return True
+
+    def succeeded(self, station_id):
+        with self._lock:
+            self._failures.pop(station_id, None)
+            self._open_until.pop(station_id, None)
+
+    def failed(self, station_id):
+        with self._lock:
+            failures = self._failures.get(station_id, 0) + 1
+            self._failures[station_id] = failures
+            if failures >= settings.SYNC_NOTIFY_BREAKER_THRESHOLD:
+                self._open_until[station_id] = (
+                    time.monotonic() + settings.SYNC_NOTIFY_BREAKER_COOLDOWN
+                )
+
+    def is_open(self, station_id):
+        return station_id in self._open_until
+
+    def reset(self):
+        with self._lock:
+            self._failures.clear()
+            self._open_until.clear()
+
+
+breaker = CircuitBreaker()
+
+
+def notification_targets(route_keys, exclude=None):
+    """
+    `(workstation id, notify URL)` of the stations with a base_url that
+    receive events with the given route keys, except `exclude`.
+    """
+    credentials = StationCredential.objects.exclude(base_url="")
+    if BROADCAST not in route_keys:
+        station_ids, path_ids = set(), set()
+        for key in route_keys:
+            kind, _, value = key.partition(":")
+            if kind == "station":
+                station_ids.add(value)
+            elif kind == "path":
+                path_ids.add(value)
+        credentials = credentials.filter(
+            Q(location_id__in=station_ids)
+            | Q(
+                location_id__in=PathStation.objects.filter(path_id__in=path_ids).values(
+                    "station_id"
+                )
+            )
+        )
+    if exclude is not None:
+        credentials = credentials.exclude(location_id=exclude)
+    path = settings.SYNC_NOTIFY_PATH
+    return [
+        (credential.location_id, credential.base_url.rstrip("/") + path)
+        for credential in credentials
+    ]
+
+
+class StationNotifier:
+    """
+    Sends one notification to each target, concurrently.
+    """
+
+    def __init__(self, circuit_breaker=breaker):
+        self.breaker = circuit_breaker
+        self.concurrency = settings.SYNC_NOTIFY_CONCURRENCY
+        self.attempts = settings.SYNC_NOTIFY_ATTEMPTS
+        self.backoff = settings.SYNC_NOTIFY_BACKOFF
+        self.timeout = settings.SYNC_NOTIFY_TIMEOUT
+        self.headers = {}
+        if settings.SYNC_NOTIFY_TOKEN:
+            self.headers["Authorization"] = f"Bearer {settings.SYNC_NOTIFY_TOKEN}"
+
+    def run(self, targets, payload):
+        """
+        Notifies the targets and returns the outcome per workstation id:
+        "sent", "failed" or "skipped" for an open circuit.
+        """
+        if not targets:
+            return {}
+        return asyncio.run(self.notify_all(targets, payload))
+
+    async def notify_all(self, targets, payload):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(station_id, url):
+            async with semaphore:
+                return station_id, await self.notify(station_id, url, payload)
+
+        results = await asyncio.gather(
+            *(bounded(station_id, url) for station_id, url in targets)
+        )
+        return dict(results)
+
+    async def notify(self, station_id, url, payload):
+        if not self.breaker.allows(station_id):
+            return "skipped"
+        for attempt in range(self.attempts):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+            try:
+                response = await asyncio.to_thread(
+                    requests.post,
+                    url,
+                    json=payload,
+                    headers=self.headers,
+                    timeout=self.timeout,
+                )
+            except requests.RequestException as exc:
+                logger.info("Notifying %s at %s failed: %s", station_id, url, exc)
+                continue
+            if response.status_code < 500:
+                if response.status_code >= 400:
+                    # The station is up but refuses; retrying will not help.
+                    logger.warning(
+                        "Station %s refused notification with %s",
+                        station_id,
+                        response.status_code,
+                    )
+                    break
+                self.breaker.succeeded(station_id)
+                return "sent"
+        self.breaker.failed(station_id)
+        return "failed"
+
+
+def notify_stations(route_keys, exclude=None):
+    """
+    Notifies the stations receiving `route_keys` that new changes are ready.
+    """
+    targets = notification_targets(route_keys, exclude=exclude)
+    payload = {"head": ChangeEvent.objects.head()}
+    return StationNotifier().run(targets, payload)
+
+
+def schedule_notification(route_keys, exclude=None):
+    """
+    Queues a notification for when the current transaction commits. Does
+    nothing unless SYNC_NOTIFY_ENABLED is set.
+    """
+    route_keys = sorted(set(route_keys))
+    if not settings.SYNC_NOTIFY_ENABLED or not route_keys:
+        return
+
+    def queue():
+        from orcSync.tasks.task import notify_stations_task
+
+        notify_stations_task.delay(route_keys, exclude)
+
+    transaction.on_commit(queue, robust=True)
@@ -0,0 +1,120 @@
+"""
+Priority lanes for delivering ChangeEvents.
+
+SYNC_LANES lists the lanes from highest to lowest priority with the share of
+a get-pending page each of them is guaranteed while it has a backlog, and
+SYNC_MODEL_LANES puts a model in a lane by its label. Models not listed go to
+DEFAULT_LANE. A lane is a set of content types, so moving a model to another
+lane also moves the events it already has.
+
+Every station keeps one StationCursor per lane, so a backlog of master data
+in a low lane does not hold back the watermark of transactional data.
+"""
+
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import setting_changed
+from django.db.models import Q
+from django.dispatch import receiver
+
+DEFAULT_LANE = "default"
+
+
+class LaneConfigError(ValueError):
+    """
+    Raised for a SYNC_MODEL_LANES entry naming a lane SYNC_LANES lacks.
+    """
+
+
+@lru_cache(maxsize=None)
+def lane_weights():
+    """
+    `(lane, weight)` pairs from highest to lowest priority. DEFAULT_LANE is
+    always present.
+    """
+    weights = dict(getattr(settings, "SYNC_LANES", {}))
+    weights.setdefault(DEFAULT_LANE, 1)
+    return tuple(weights.items())
+
+
+def lane_names():
+    return [lane for lane, _ in lane_weights()]
+
+
+@lru_cache(maxsize=None)
+def lane_models():
+    """
+    Maps every lane but DEFAULT_LANE to the labels of the models in it.
+    """
+    names = set(lane_names())
+    models = {}
+    for label, lane in getattr(settings, "SYNC_MODEL_LANES", {}).items():
+        if lane not in names:
+            raise LaneConfigError(
+                f"Model {label} is put in lane '{lane}', which is not one of "
+                f"SYNC_LANES {sorted(names)}."
+            )
+        if lane != DEFAULT_LANE:
+            models.setdefault(lane, []).append(label)
+    return models
+
+
+def lane_of(Model):
+    lane = getattr(settings, "SYNC_MODEL_LANES", {}).get(Model._meta.label)
+    return lane or DEFAULT_LANE
+
+
+def lane_of_content_type(content_type):
+    Model = content_type.model_class()
+    return DEFAULT_LANE if Model is None else lane_of(Model)
+
+
+def _content_type_ids(labels):
+    models = []
+    for label in labels:
+        try:
+            models.append(apps.get_model(label))
+        except LookupError:
+            continue
+    return [
+        content_type.pk
+        for content_type in ContentType.objects.get_for_models(*models).values()
+    ]
+
+
+def lane_filter(lane):
+    """
+    A Q object selecting the ChangeEvents of `lane`.
+    """
+    lanes = lane_models()
+    if lane == DEFAULT_LANE:
+        others = [label for labels in lanes.values() for label in labels]
+        return ~Q(content_type_id__in=_content_type_ids(others))
+    return Q(content_type_id__in=_content_type_ids(lanes.get(lane, [])))
+
+
+def lane_shares(limit):
+    """
+    Splits a page of `limit` events between the lanes by weight. The
+    rounding remainder goes to the highest lanes.
+    """
+    weights = lane_weights()
+    total = sum(weight for _, weight in weights) or 1
+    shares = {lane: limit * weight // total for lane, weight in weights}
+    spare = limit - sum(shares.values())
+    for lane in shares:
+        if spare <= 0:
+            break
+        shares[lane] += 1
+        spare -= 1
+    return shares
+
+
+@receiver(setting_changed)
+def reset_lanes(setting, **kwargs):
+    if setting in ("SYNC_LANES", "SYNC_MODEL_LANES"):
+        lane_weights.cache_clear()
+        lane_models.cache_clear()
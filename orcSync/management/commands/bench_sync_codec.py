@@ -0,0 +1,53 @@
+import timeit
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orcSync.codec import codec_for
+
+
+class Command(BaseCommand):
+    help = "Measures the per-object cost of encoding and decoding sync payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "models",
+            nargs="*",
+            help="Models to measure (app_label.Model); defaults to SYNCHRONIZABLE_MODELS",
+        )
+        parser.add_argument(
+            "--objects", type=int, default=200, help="Rows loaded per model"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="Passes over the loaded rows"
+        )
+
+    def handle(self, *args, **options):
+        model_strings = options["models"] or settings.SYNCHRONIZABLE_MODELS
+
+        self.stdout.write(f"{'model':<32}{'rows':>6}{'encode µs':>12}{'decode µs':>12}")
+        for model_string in model_strings:
+            Model = apps.get_model(model_string)
+            codec = codec_for(Model)
+            instances = list(Model.objects.all()[: options["objects"]])
+            if not instances:
+                self.stdout.write(f"{model_string:<32}{0:>6}{'-':>12}{'-':>12}")
+                continue
+
+            # Files are hashed on first encode; keep that out of the timing.
+            payloads = [codec.encode(instance) for instance in instances]
+            passes = options["repeat"] * len(instances)
+
+            encode = timeit.timeit(
+                lambda: [codec.encode(instance) for instance in instances],
+                number=options["repeat"],
+            )
+            decode = timeit.timeit(
+                lambda: [codec.decode(payload) for payload in payloads],
+                number=options["repeat"],
+            )
+            self.stdout.write(
+                f"{model_string:<32}{len(instances):>6}"
+                f"{encode / passes * 1e6:>12.1f}{decode / passes * 1e6:>12.1f}"
+            )
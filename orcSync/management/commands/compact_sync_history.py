@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orcSync.retention import compact, expired_events, retention_cutoff
+
+
+class Command(BaseCommand):
+    help = "Deletes sync history every workstation has received"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            help="Keep history younger than this; defaults to SYNC_RETENTION_DAYS",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Events deleted per transaction; defaults to SYNC_RETENTION_BATCH",
+        )
+        parser.add_argument(
+            "--archive-dir",
+            default=settings.SYNC_ARCHIVE_DIR,
+            help="Write deleted events to a gzipped NDJSON file in this directory",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the events that would be deleted",
+        )
+
+    def handle(self, *args, **options):
+        if options["dry_run"]:
+            count = expired_events(retention_cutoff(options["days"])).count()
+            self.stdout.write(f"{count} change events would be deleted.")
+            return
+
+        deleted = compact(
+            days=options["days"],
+            batch_size=options["batch_size"],
+            archive_dir=options["archive_dir"] or None,
+        )
+        for model, count in deleted.items():
+            self.stdout.write(f"Deleted {count} {model.replace('_', ' ')}.")
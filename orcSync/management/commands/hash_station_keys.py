@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from orcSync.models import StationCredential
+
+
+class Command(BaseCommand):
+    help = "Hashes station API keys saved in plaintext before keys were hashed"
+
+    def handle(self, *args, **options):
+        hashed = 0
+        with transaction.atomic():
+            credentials = (
+                StationCredential.objects.select_for_update()
+                .exclude(api_key="")
+                .exclude(api_key__startswith=StationCredential.KEY_HASH_PREFIX)
+            )
+            for credential in credentials:
+                credential.save(update_fields=["api_key"])
+                hashed += 1
+        self.stdout.write(f"Hashed {hashed} station keys.")
@@ -0,0 +1,49 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+
+from orcSync.blobs import prefetch_blobs
+from orcSync.codec import codec_for
+from orcSync.merkle import row_hash
+from orcSync.row_versions import record_versions
+from orcSync.snapshot import snapshot_models
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Hashes every synchronizable row into RowVersion, for rows written "
+        "before versions were kept or changed by queryset updates"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "models", nargs="*", help="Model labels; defaults to every synced model"
+        )
+
+    def handle(self, *args, **options):
+        labels = set(options["models"])
+        recorded = 0
+        for Model in snapshot_models():
+            if labels and Model._meta.label not in labels:
+                continue
+            codec = codec_for(Model)
+            content_type_id = ContentType.objects.get_for_model(Model).pk
+            batch = []
+            for instance in Model._base_manager.iterator(chunk_size=BATCH_SIZE):
+                batch.append(instance)
+                if len(batch) == BATCH_SIZE:
+                    recorded += self.record(codec, content_type_id, batch)
+                    batch = []
+            recorded += self.record(codec, content_type_id, batch)
+        self.stdout.write(f"Recorded {recorded} row versions.")
+
+    def record(self, codec, content_type_id, instances):
+        prefetch_blobs(instances)
+        record_versions(
+            {
+                (content_type_id, instance.pk): row_hash(codec.encode(instance))
+                for instance in instances
+            }
+        )
+        return len(instances)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from orcSync.blobs import register_file
+from orcSync.codec import codec_for
+from orcSync.models import SyncBlobName
+from orcSync.snapshot import snapshot_models
+
+
+class Command(BaseCommand):
+    help = "Registers files saved before sync recorded their blobs"
+
+    def handle(self, *args, **options):
+        registered = 0
+        for Model in snapshot_models():
+            file_fields = codec_for(Model).file_fields
+            if not file_fields:
+                continue
+            with_files = Q()
+            for field in file_fields:
+                with_files |= Q(**{f"{field.attname}__gt": ""})
+            for instance in Model._base_manager.filter(with_files).iterator():
+                for field in file_fields:
+                    field_file = getattr(instance, field.attname)
+                    if (
+                        field_file
+                        and not SyncBlobName.objects.filter(
+                            name=field_file.name
+                        ).exists()
+                        and register_file(field_file) is not None
+                    ):
+                        registered += 1
+        self.stdout.write(f"Registered {registered} files.")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from orcSync.dead_letters import replay
+from orcSync.models import DeadLetter
+
+
+class Command(BaseCommand):
+    help = "Applies unresolved dead-lettered sync changes again"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "ids",
+            nargs="*",
+            type=int,
+            help="DeadLetter ids; defaults to all unresolved",
+        )
+        parser.add_argument(
+            "--workstation", type=int, help="Only letters pushed by this workstation"
+        )
+
+    def handle(self, *args, **options):
+        letters = DeadLetter.objects.filter(resolved_at__isnull=True).select_related(
+            "source_workstation"
+        )
+        if options["ids"]:
+            letters = letters.filter(pk__in=options["ids"])
+        if options["workstation"]:
+            letters = letters.filter(source_workstation_id=options["workstation"])
+
+        results = replay(letters.order_by("first_failed_at"))
+        applied = sum(result["status"] == "applied" for result in results)
+        for result in results:
+            if result["status"] != "applied":
+                self.stdout.write(
+                    f"{result['model']} {result['object_id']}: {result['reason']}"
+                )
+        self.stdout.write(f"Replayed {applied} of {len(results)} dead letters.")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orcSync.delivery import backlog
+from orcSync.models import StationCredential
+
+
+class Command(BaseCommand):
+    help = "Shows the sync backlog of every workstation per priority lane"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workstation", type=int, help="Only show this workstation"
+        )
+
+    def handle(self, *args, **options):
+        credentials = StationCredential.objects.select_related("location")
+        if options["workstation"]:
+            credentials = credentials.filter(location_id=options["workstation"])
+
+        now = timezone.now()
+        self.stdout.write(
+            f"{'workstation':<32}{'lane':<12}{'acked':>10}"
+            f"{'pending':>10}{'redeliver':>11}{'oldest s':>10}"
+        )
+        for credential in credentials:
+            for lane, metrics in backlog(credential.location).items():
+                oldest = metrics["oldest"]
+                age = f"{(now - oldest).total_seconds():.0f}" if oldest else "-"
+                self.stdout.write(
+                    f"{str(credential.location)[:31]:<32}{lane:<12}"
+                    f"{metrics['acknowledged_sequence']:>10}{metrics['pending']:>10}"
+                    f"{metrics['redeliveries']:>11}{age:>10}"
+                )
@@ -0,0 +1,183 @@
+"""
+Hashed range trees for detecting drift between central and a station.
+
+Rows of a model are placed in buckets by the hex digest of their primary
+key: the root covers every row, and each node has one child per next hex
+digit, so `"a"` covers the rows whose key digest starts with `a`, `"a3"`
+those starting with `a3`, and so on. A node's hash is the SHA-256 of the
+sorted `object_id:row hash` lines of its rows, and a row hash is the
+SHA-256 of the row's canonical sync payload.
+
+Row hashes are not computed per request: nodes are built from the versions
+kept in RowVersion (see orcSync.row_versions), reading only the versions
+whose bucket starts with the node's prefix. A repair records fresh versions
+of the rows it sends.
+
+A station computes the same tree over its own copy, compares it with the
+central one top-down, and only descends into the children whose hashes
+differ. At the leaves it fetches the row hashes of a bucket and asks for a
+repair of the rows that differ, which enqueues ChangeEvents routed to that
+station only.
+"""
+
+import hashlib
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from orcSync.blobs import prefetch_blobs
+from orcSync.codec import codec_for
+from orcSync.models import ChangeEvent, RowVersion
+from orcSync.routing import routed_rows, rule_for, station_route
+from orcSync.row_versions import forget_versions, pk_digest, record_versions
+
+HEX_DIGITS = "0123456789abcdef"
+PK_BATCH_SIZE = 1000
+
+
+def row_hash(payload):
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def bucket_hash(row_hashes):
+    digest = hashlib.sha256()
+    for object_id in sorted(row_hashes):
+        digest.update(f"{object_id}:{row_hashes[object_id]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RangeTree:
+    """
+    One node of the hashed range tree of a model, as seen by a workstation.
+    """
+
+    def __init__(self, Model, workstation, prefix=""):
+        self.Model = Model
+        self.workstation = workstation
+        self.prefix = prefix
+
+    def row_hashes(self):
+        """
+        Maps the object id of every row in the bucket to its row hash, read
+        from RowVersion by bucket prefix. Rows of routed models are narrowed
+        down to the workstation's with one primary key query per batch.
+        """
+        versions = RowVersion.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.Model)
+        )
+        if self.prefix:
+            versions = versions.filter(bucket__startswith=self.prefix)
+        hashes = dict(
+            versions.values_list("object_id", "version").iterator(
+                chunk_size=PK_BATCH_SIZE
+            )
+        )
+        if rule_for(self.Model) is None:
+            return hashes
+
+        object_ids = list(hashes)
+        routed = set()
+        for start in range(0, len(object_ids), PK_BATCH_SIZE):
+            rows = self.Model._default_manager.filter(
+                pk__in=object_ids[start : start + PK_BATCH_SIZE]
+            )
+            routed.update(
+                str(pk)
+                for pk in routed_rows(rows, self.workstation).values_list(
+                    "pk", flat=True
+                )
+            )
+        return {
+            object_id: hashed
+            for object_id, hashed in hashes.items()
+            if object_id in routed
+        }
+
+    def node(self):
+        """
+        Returns the node's hash, row count and the hash of each child bucket.
+        """
+        children = {digit: {} for digit in HEX_DIGITS}
+        depth = len(self.prefix)
+        hashes = self.row_hashes()
+        for object_id, hashed in hashes.items():
+            children[pk_digest(object_id)[depth]][object_id] = hashed
+        return {
+            "model": self.Model._meta.label,
+            "prefix": self.prefix,
+            "hash": bucket_hash(hashes),
+            "rows": len(hashes),
+            "children": {
+                self.prefix + digit: bucket_hash(rows)
+                for digit, rows in children.items()
+            },
+        }
+
+
+def repair(Model, workstation, object_ids):
+    """
+    Enqueues ChangeEvents routed to `workstation` only, carrying the current
+    state of the listed rows, or a delete for rows central does not have.
+    Returns the number of events created.
+    """
+    lookup_ids = []
+    for object_id in object_ids:
+        try:
+            lookup_ids.append(Model._meta.pk.to_python(object_id))
+        except ValidationError:
+            continue
+    object_ids = list(dict.fromkeys(str(object_id) for object_id in lookup_ids))
+    if not object_ids:
+        return 0
+
+    codec = codec_for(Model)
+    existing = {
+        str(instance.pk): instance
+        for instance in routed_rows(
+            Model._default_manager.filter(pk__in=lookup_ids), workstation
+        )
+    }
+    prefetch_blobs(existing.values())
+    payloads = {
+        object_id: codec.encode(instance) for object_id, instance in existing.items()
+    }
+    stored = {
+        str(pk)
+        for pk in Model._default_manager.filter(pk__in=lookup_ids).values_list(
+            "pk", flat=True
+        )
+    }
+    content_type = ContentType.objects.get_for_model(Model)
+    route_key = station_route(workstation)
+
+    with transaction.atomic():
+        # Repaired rows get a fresh version, so the tree agrees from now on.
+        record_versions(
+            {
+                (content_type.pk, object_id): row_hash(payload)
+                for object_id, payload in payloads.items()
+            }
+        )
+        forget_versions(
+            (content_type.pk, object_id)
+            for object_id in object_ids
+            if object_id not in stored
+        )
+        first_sequence = ChangeEvent.objects.allocate_sequences(len(object_ids))
+        ChangeEvent.objects.bulk_create(
+            [
+                ChangeEvent(
+                    sequence=first_sequence + offset,
+                    content_type=content_type,
+                    object_id=object_id,
+                    action="U" if object_id in payloads else "D",
+                    route_key=route_key,
+                    data_payload=payloads.get(object_id, {}),
+                )
+                for offset, object_id in enumerate(object_ids)
+            ]
+        )
+    return len(object_ids)
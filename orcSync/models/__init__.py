@@ -1 +1,14 @@
-from .orc_sync import ChangeEvent, StationCredential, SyncAcknowledgement
+from .orc_sync import (
+    AppliedChange,
+    ChangeEvent,
+    DeadLetter,
+    DeliveryConfirmation,
+    DeliveryException,
+    OutboxEntry,
+    RowVersion,
+    StationCredential,
+    StationCursor,
+    SyncBlob,
+    SyncBlobName,
+    SyncSequence,
+)
@@ -1,10 +1,12 @@
+import hashlib
 import uuid
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
 
 from base.models import BaseModel
+from orcSync.lanes import DEFAULT_LANE, lane_names
 from workstations.models import WorkStation
 
 
@@ -12,8 +14,13 @@ class StationCredential(BaseModel):
     """
     Stores the connection details and API key for each remote workstation.
     This links a known WorkStation to its network address and secret key.
+
+    Only the SHA-256 of the key is stored; a plaintext key assigned to
+    `api_key` is hashed on save.
     """
 
+    KEY_HASH_PREFIX = "sha256$"
+
     location = models.OneToOneField(
         WorkStation, related_name="sync_credential", on_delete=models.CASCADE
     )
@@ -25,26 +32,103 @@ class StationCredential(BaseModel):
         unique=True,
     )
 
+    @classmethod
+    def hash_key(cls, key):
+        return cls.KEY_HASH_PREFIX + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def save(self, *args, **kwargs):
+        if self.api_key and not self.api_key.startswith(self.KEY_HASH_PREFIX):
+            self.api_key = self.hash_key(self.api_key)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Sync Credentials for {self.location}"
 
 
+class SyncSequence(models.Model):
+    """
+    A named counter that hands out monotonically increasing sequence numbers.
+    The row stays locked until the allocating transaction commits, so sequence
+    numbers become visible to readers in the order they were handed out.
+    """
+
+    name = models.CharField(max_length=50, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+
+    @classmethod
+    def allocate(cls, name, count=1):
+        """
+        Reserves `count` consecutive numbers and returns the first one.
+        """
+        with transaction.atomic():
+            counter, _ = cls.objects.select_for_update().get_or_create(name=name)
+            first = counter.last_value + 1
+            counter.last_value += count
+            counter.save(update_fields=["last_value"])
+        return first
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_value}"
+
+
+class ChangeEventManager(models.Manager):
+    def allocate_sequences(self, count):
+        """
+        Reserves `count` consecutive ChangeEvent sequence numbers.
+        """
+        return SyncSequence.allocate(ChangeEvent.SEQUENCE_NAME, count)
+
+    def head(self):
+        """
+        Returns the highest sequence number handed out so far.
+        """
+        last_value = (
+            SyncSequence.objects.filter(name=ChangeEvent.SEQUENCE_NAME)
+            .values_list("last_value", flat=True)
+            .first()
+        )
+        return last_value or 0
+
+
 class ChangeEvent(models.Model):
+    SEQUENCE_NAME = "change_event"
+
     class Action(models.TextChoices):
         CREATED = "C", "Created"
         UPDATED = "U", "Updated"
         DELETED = "D", "Deleted"
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    sequence = models.BigIntegerField(unique=True, null=True, editable=False)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
 
     object_id = models.CharField(max_length=255)
 
     changed_object = GenericForeignKey("content_type", "object_id")
     action = models.CharField(max_length=1, choices=Action.choices)
+    route_key = models.CharField(
+        max_length=64,
+        default="*",
+        help_text="Which stations receive the event, see orcSync.routing.",
+    )
     timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
     data_payload = models.JSONField(
-        help_text="A JSON snapshot of the model's data at the time of the change."
+        help_text=(
+            "A JSON snapshot of the model's data at the time of the change, "
+            "or only the changed fields when base_version is set."
+        )
+    )
+    base_version = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        help_text="For a delta update, the row hash the changed fields apply to.",
+    )
+    version = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        help_text="The row hash after the change, when known.",
     )
     source_workstation = models.ForeignKey(
         WorkStation,
@@ -53,42 +137,279 @@ class ChangeEvent(models.Model):
         blank=True,
         related_name="initiated_changes",
     )
+    confirmed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="When the event was queued as a DeliveryConfirmation.",
+    )
+
+    objects = ChangeEventManager()
 
     class Meta:
-        ordering = ["timestamp"]
+        ordering = ["sequence"]
+        indexes = [
+            models.Index(
+                fields=["content_type", "object_id", "sequence"],
+                name="changeevent_object_seq_idx",
+            ),
+            models.Index(
+                fields=["route_key", "sequence"],
+                name="changeevent_route_seq_idx",
+            ),
+            models.Index(
+                fields=["source_workstation", "sequence"],
+                name="changeevent_unconfirmed_idx",
+                condition=models.Q(confirmed_at__isnull=True),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.sequence is None:
+            with transaction.atomic():
+                self.sequence = ChangeEvent.objects.allocate_sequences(1)
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.get_action_display()} on {self.content_type.model} at {self.timestamp}"
 
 
-class SyncAcknowledgement(models.Model):
+class StationCursor(models.Model):
     """
-    Acts as a checklist, tracking the delivery status of each ChangeEvent
-    to every workstation that needs to receive it.
+    Tracks delivery to a workstation with two high-water marks over the
+    ChangeEvent sequence: how far it has pulled and how far it has applied.
+    A workstation has one cursor per priority lane (see orcSync.lanes), and
+    each cursor only covers the events of its lane. Every event of the lane
+    at or below `acknowledged_sequence` counts as delivered unless it is
+    listed in DeliveryException.
     """
 
-    class Status(models.TextChoices):
-        PENDING = "P", "Pending"
-        ACKNOWLEDGED = "A", "Acknowledged"
+    workstation = models.ForeignKey(
+        WorkStation, on_delete=models.CASCADE, related_name="sync_cursors"
+    )
+    lane = models.CharField(max_length=32, default=DEFAULT_LANE)
+    delivered_sequence = models.BigIntegerField(default=0)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    acknowledged_sequence = models.BigIntegerField(default=0, db_index=True)
+    acknowledged_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ("workstation", "lane")
+
+    @classmethod
+    def for_workstation(cls, workstation, lane=DEFAULT_LANE):
+        """
+        Returns the cursor of a workstation for one lane.
+        """
+        return cls.for_lanes(workstation)[lane]
+
+    @classmethod
+    def for_lanes(cls, workstation):
+        """
+        Returns the cursors of a workstation by lane, in priority order. A
+        station without cursors starts at the current head, matching the old
+        behaviour where a station only received events created after it was
+        registered. A lane added later starts where the station's slowest
+        lane is, so no event already queued for it is skipped.
+        """
+        cursors = {
+            cursor.lane: cursor
+            for cursor in cls.objects.filter(workstation=workstation)
+        }
+        missing = [lane for lane in lane_names() if lane not in cursors]
+        if missing:
+            if cursors:
+                start = min(c.acknowledged_sequence for c in cursors.values())
+            else:
+                start = ChangeEvent.objects.head()
+            for lane in missing:
+                cursors[lane], _ = cls.objects.get_or_create(
+                    workstation=workstation,
+                    lane=lane,
+                    defaults={
+                        "delivered_sequence": start,
+                        "acknowledged_sequence": start,
+                    },
+                )
+        return {lane: cursors[lane] for lane in lane_names()}
+
+    def __str__(self):
+        return f"{self.workstation} {self.lane} acknowledged through #{self.acknowledged_sequence}"
+
+
+class DeliveryException(models.Model):
+    """
+    Events below a workstation's acknowledged watermark that it has not
+    applied yet. They are sent again on every pull until acknowledged.
+    """
 
-    id = models.BigAutoField(primary_key=True)
     change_event = models.ForeignKey(
-        ChangeEvent, on_delete=models.CASCADE, related_name="acknowledgements"
+        ChangeEvent, on_delete=models.CASCADE, related_name="delivery_exceptions"
     )
-
     destination_workstation = models.ForeignKey(
-        WorkStation, on_delete=models.CASCADE, related_name="pending_acknowledgements"
-    )
-
-    status = models.CharField(
-        max_length=1, choices=Status.choices, default=Status.PENDING, db_index=True
+        WorkStation, on_delete=models.CASCADE, related_name="delivery_exceptions"
     )
     created_at = models.DateTimeField(auto_now_add=True)
-    acknowledged_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ("change_event", "destination_workstation")
         ordering = ["created_at"]
 
     def __str__(self):
-        return f"Event {str(self.change_event.id)[:8]} for {self.destination_workstation} -> {self.get_status_display()}"
+        return f"Event {str(self.change_event_id)[:8]} not applied by {self.destination_workstation}"
+
+
+class DeliveryConfirmation(models.Model):
+    """
+    An event sent by a workstation that every other station has applied,
+    queued until the workstation has read it. The id is the queue's cursor:
+    the workstation passes the last one it has read as `confirmed_after`,
+    which drains the queue up to there.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    workstation = models.ForeignKey(
+        WorkStation, on_delete=models.CASCADE, related_name="delivery_confirmations"
+    )
+    event_id = models.UUIDField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["workstation", "id"], name="confirmation_station_idx"),
+        ]
+
+    def __str__(self):
+        return f"Event {str(self.event_id)[:8]} confirmed to {self.workstation}"
+
+
+class AppliedChange(models.Model):
+    """
+    Registry of inbound changes that have already been applied, keyed by the
+    event UUID the workstation generated. A retried push finds its changes
+    here and skips them instead of applying and fanning them out again.
+    """
+
+    source_workstation = models.ForeignKey(
+        WorkStation, on_delete=models.CASCADE, related_name="applied_changes"
+    )
+    event_uuid = models.UUIDField()
+    applied_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("source_workstation", "event_uuid")
+
+    def __str__(self):
+        return f"{self.event_uuid} from {self.source_workstation}"
+
+
+class RowVersion(models.Model):
+    """
+    The row hash (orcSync.merkle.row_hash) of the current state of a
+    synchronized row, kept as changes are captured and applied. A pushed
+    payload with the same hash would not change the row.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=255)
+    version = models.CharField(max_length=64)
+    # orcSync.row_versions.pk_digest of object_id, the row's range tree bucket
+    bucket = models.CharField(max_length=64, default="", db_index=True)
+
+    class Meta:
+        unique_together = ("content_type", "object_id")
+
+    def __str__(self):
+        return f"{self.content_type.model} {self.object_id} at {self.version[:12]}"
+
+
+class SyncBlob(models.Model):
+    """
+    A file known to the sync layer, addressed by the SHA-256 of its content.
+    """
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    file = models.FileField(upload_to="sync_blobs/", max_length=255, db_index=True)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
+
+
+class SyncBlobName(models.Model):
+    """
+    A storage file name whose content is a known SyncBlob, recorded when a
+    file is captured or written by sync so that it is never hashed again.
+    """
+
+    name = models.CharField(max_length=255, primary_key=True)
+    blob = models.ForeignKey(SyncBlob, on_delete=models.CASCADE, related_name="names")
+
+    def __str__(self):
+        return f"{self.name} -> {self.blob_id[:12]}"
+
+
+class OutboxEntry(models.Model):
+    """
+    A change captured on the central server, written in the same transaction
+    as the change itself. Entries are turned into ChangeEvents in batches
+    once the transaction has committed; a rolled back change leaves nothing.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=255)
+    action = models.CharField(max_length=1, choices=ChangeEvent.Action.choices)
+    route_key = models.CharField(max_length=64, default="*")
+    data_payload = models.JSONField()
+    base_version = models.CharField(max_length=64, blank=True, default="")
+    version = models.CharField(max_length=64, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name_plural = "outbox entries"
+
+    def __str__(self):
+        return f"{self.get_action_display()} on {self.content_type.model} {self.object_id}"
+
+
+class DeadLetter(models.Model):
+    """
+    An inbound change that failed to apply. After SYNC_DEAD_LETTER_ATTEMPTS
+    failures it is registered as applied, so it no longer blocks the
+    station's queue, and waits here to be inspected and replayed.
+    """
+
+    source_workstation = models.ForeignKey(
+        WorkStation, on_delete=models.CASCADE, related_name="dead_letters"
+    )
+    event_uuid = models.UUIDField()
+    model = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=255)
+    action = models.CharField(max_length=1, choices=ChangeEvent.Action.choices)
+    data_payload = models.JSONField()
+    error = models.TextField()
+    attempts = models.PositiveIntegerField(default=0)
+    first_failed_at = models.DateTimeField(auto_now_add=True)
+    last_failed_at = models.DateTimeField(auto_now=True)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ("source_workstation", "event_uuid")
+        ordering = ["-last_failed_at"]
+
+    def as_change(self):
+        return {
+            "event_uuid": self.event_uuid,
+            "model": self.model,
+            "action": self.action,
+            "object_id": self.object_id,
+            "data_payload": self.data_payload,
+        }
+
+    def __str__(self):
+        return f"{self.get_action_display()} {self.model} {self.object_id} ({self.attempts} attempts)"
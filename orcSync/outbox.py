@@ -0,0 +1,143 @@
+"""
+Transactional outbox for changes made on the central server.
+
+Model signals only write an OutboxEntry, inside the transaction that made the
+change, so a rolled back change is never published. After commit a single
+flush per transaction (and a periodic flush as a safety net) moves pending
+entries into ChangeEvents with one sequence allocation and one bulk insert.
+
+Updates of stored rows are captured as deltas: the payload only holds the
+fields that differ from the row as stored before the update (read at
+pre_save), `base_version` is the row hash of that stored state and
+`version` the row hash after the change (see orcSync.merkle.row_hash),
+which flushing also keeps in RowVersion.
+Applying the delta on top of a row whose hash is `base_version` gives the
+row at `version`; a receiver holding anything else needs a full snapshot.
+"""
+
+import logging
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from orcSync.codec import LOADED_STATE_ATTR, codec_for
+from orcSync.dispatch import schedule_notification
+from orcSync.merkle import row_hash
+from orcSync.models import ChangeEvent, OutboxEntry
+from orcSync.routing import route_key
+from orcSync.row_versions import forget_versions, record_versions
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 500
+
+
+def capture(instance, action):
+    """
+    Records a change of `instance` in the outbox of the current transaction.
+    """
+    codec = codec_for(instance.__class__)
+    if action != "D":
+        codec.register_files(instance)
+    payload = codec.encode(instance)
+    base_version = version = ""
+    if action != "D":
+        version = row_hash(payload)
+    if action == "U":
+        loaded = codec.encode_loaded(instance, payload)
+        if loaded is not None:
+            base_version = row_hash(loaded)
+            payload = {
+                key: value for key, value in payload.items() if loaded[key] != value
+            }
+
+    OutboxEntry.objects.create(
+        content_type=ContentType.objects.get_for_model(instance),
+        object_id=str(instance.pk),
+        action=action,
+        route_key=route_key(instance),
+        data_payload=payload,
+        base_version=base_version,
+        version=version,
+    )
+    # The next save of the same instance is a delta against this one.
+    instance.__dict__[LOADED_STATE_ATTR] = codec.state(instance)
+    schedule_flush()
+
+
+def schedule_flush():
+    """
+    Queues a flush for when the current transaction commits, once per
+    transaction no matter how many changes it captured.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and any(
+        callback[1] is _queue_flush for callback in connection.run_on_commit
+    ):
+        return
+    transaction.on_commit(_queue_flush, robust=True)
+
+
+def _queue_flush():
+    from orcSync.tasks.task import flush_outbox_task
+
+    flush_outbox_task.delay()
+
+
+def flush_outbox(batch_size=FLUSH_BATCH_SIZE):
+    """
+    Turns pending outbox entries into ChangeEvents and returns how many were
+    flushed. Entries are locked while they are flushed, so concurrent flushes
+    take turns and sequences follow the order the entries were captured in.
+    """
+    flushed = 0
+    routes = set()
+    while True:
+        with transaction.atomic():
+            entries = list(
+                OutboxEntry.objects.select_for_update().order_by("id")[:batch_size]
+            )
+            if not entries:
+                break
+
+            first_sequence = ChangeEvent.objects.allocate_sequences(len(entries))
+            ChangeEvent.objects.bulk_create(
+                [
+                    ChangeEvent(
+                        sequence=first_sequence + offset,
+                        content_type_id=entry.content_type_id,
+                        object_id=entry.object_id,
+                        action=entry.action,
+                        route_key=entry.route_key,
+                        data_payload=entry.data_payload,
+                        base_version=entry.base_version,
+                        version=entry.version,
+                        source_workstation=None,
+                    )
+                    for offset, entry in enumerate(entries)
+                ]
+            )
+            # Only the last entry of an object decides its version, so a
+            # row deleted and created again in one batch keeps one.
+            last = {
+                (entry.content_type_id, entry.object_id): entry for entry in entries
+            }
+            forget_versions(key for key, entry in last.items() if entry.action == "D")
+            record_versions(
+                {
+                    key: entry.version
+                    for key, entry in last.items()
+                    if entry.action != "D" and entry.version
+                }
+            )
+            OutboxEntry.objects.filter(pk__in=[entry.pk for entry in entries]).delete()
+
+        routes.update(entry.route_key for entry in entries)
+        flushed += len(entries)
+        if len(entries) < batch_size:
+            break
+
+    if flushed:
+        logger.info("Flushed %s outbox entries into change events", flushed)
+        schedule_notification(routes)
+    return flushed
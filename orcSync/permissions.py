@@ -1,37 +1,57 @@
+import copy
+
 from rest_framework.permissions import BasePermission
+from rest_framework_api_key.permissions import KeyParser
+
+from utils.api_keys import TTLCache, key_digest
 
 from .models import StationCredential
 
+_station_keys = TTLCache()
+
+
+def authenticate_station(key):
+    """
+    Returns the workstation a station API key belongs to, or None. Known keys
+    are cached for API_KEY_CACHE_TTL seconds; unknown keys are not, so a
+    credential created in another process is accepted right away.
+    """
+    digest = key_digest(key)
+    workstation = _station_keys.get(digest)
+    if workstation is None:
+        credential = (
+            StationCredential.objects.select_related("location")
+            .filter(api_key=StationCredential.hash_key(key))
+            .first()
+        )
+        if credential is None:
+            return None
+        workstation = credential.location
+        _station_keys.set(digest, workstation)
+    return copy.copy(workstation)
+
+
+def invalidate_station_keys():
+    _station_keys.clear()
+
 
 class WorkstationHasAPIKey(BasePermission):
     """
     A single, custom permission class that validates the API Key
-    by looking it up directly in the StationCredential model.
+    against the hashed keys in the StationCredential model.
     """
 
     message = "Invalid or missing API Key."
+    key_parser = KeyParser()
 
     def has_permission(self, request, view):
-        header = request.META.get("HTTP_AUTHORIZATION")
-        print(header, " it is header")
-        if not header or not header.lower().startswith("api-key"):
+        key = self.key_parser.get_from_authorization(request)
+        if not key:
             return False
 
-        try:
-            key = header.split(" ")[1]
-            print(key, " it is key")
-        except ValueError:
+        workstation = authenticate_station(key)
+        if workstation is None:
             return False
 
-        try:
-            credential = StationCredential.objects.select_related("location").get(
-                api_key=key
-            )
-            print(credential, " it is credential")
-            workstation = credential.location
-            request._request.workstation = workstation
-
-            return True
-        except StationCredential.DoesNotExist:
-            print("SYNC_SERVER WARNING: API Key not found.")
-            return False
\ No newline at end of file
+        request._request.workstation = workstation
+        return True
@@ -0,0 +1,131 @@
+"""
+Retention of sync history.
+
+Delivery only reads events above the stations' acknowledged watermarks, so
+an event every station receiving it has acknowledged is history once its
+source station has been told (DeliveryConfirmation). `compact` deletes such
+events when they are older than SYNC_RETENTION_DAYS, together with the
+AppliedChange registry and resolved DeadLetters of the same age.
+
+Events are deleted in sequence order, SYNC_RETENTION_BATCH at a time, each
+batch in its own short transaction. Since the sequence grows with time,
+every batch is a contiguous time range at the old end of the table, so the
+live end that get-pending and acknowledge read stays small. With an archive
+directory the deleted events are first written to a gzipped NDJSON file.
+"""
+
+import gzip
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from orcSync.delivery import acknowledged_floors, below_floors
+from orcSync.models import AppliedChange, ChangeEvent, DeadLetter
+
+ARCHIVE_FIELDS = (
+    "id",
+    "sequence",
+    "content_type__app_label",
+    "content_type__model",
+    "object_id",
+    "action",
+    "route_key",
+    "timestamp",
+    "data_payload",
+    "base_version",
+    "version",
+    "source_workstation_id",
+)
+
+
+def retention_cutoff(days=None):
+    if days is None:
+        days = settings.SYNC_RETENTION_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def expired_events(cutoff):
+    """
+    Events older than `cutoff` that no station waits to have redelivered and
+    that every station receiving them has acknowledged. For an event sent by
+    a station that is the case once its source has it in its confirmation
+    queue, so the source's own watermarks do not hold its events back.
+    """
+    floors = acknowledged_floors()
+    if floors is None:
+        return ChangeEvent.objects.none()
+    return ChangeEvent.objects.filter(
+        (Q(source_workstation__isnull=True) & below_floors(floors))
+        | Q(confirmed_at__isnull=False),
+        timestamp__lt=cutoff,
+        delivery_exceptions__isnull=True,
+    )
+
+
+class EventArchive:
+    """
+    A gzipped NDJSON file in `directory`, opened on the first write.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(
+            directory, f"change_events-{timezone.now():%Y%m%dT%H%M%S}.ndjson.gz"
+        )
+        self.file = None
+
+    def write(self, events):
+        if self.file is None:
+            self.file = gzip.open(self.path, "wt", encoding="utf-8")
+        for row in events.order_by("sequence").values(*ARCHIVE_FIELDS):
+            self.file.write(json.dumps(row, cls=DjangoJSONEncoder) + "\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def compact(days=None, batch_size=None, archive_dir=None):
+    """
+    Deletes the sync history older than `days` and returns the number of
+    rows deleted per model. Events are archived to `archive_dir` first when
+    it is given.
+    """
+    cutoff = retention_cutoff(days)
+    batch_size = batch_size or settings.SYNC_RETENTION_BATCH
+    archive = EventArchive(archive_dir) if archive_dir else None
+
+    deleted = 0
+    try:
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    expired_events(cutoff)
+                    .order_by("sequence")
+                    .values_list("pk", flat=True)[:batch_size]
+                )
+                if not batch:
+                    break
+                events = ChangeEvent.objects.filter(pk__in=batch)
+                if archive is not None:
+                    archive.write(events)
+                events.delete()
+            deleted += len(batch)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    applied, _ = AppliedChange.objects.filter(applied_at__lt=cutoff).delete()
+    letters, _ = DeadLetter.objects.filter(
+        resolved_at__isnull=False, resolved_at__lt=cutoff
+    ).delete()
+    return {
+        "change_events": deleted,
+        "applied_changes": applied,
+        "dead_letters": letters,
+    }
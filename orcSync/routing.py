@@ -0,0 +1,126 @@
+"""
+Declarative routing of ChangeEvents to the stations that need them.
+
+Every ChangeEvent carries a `route_key`:
+
+* `"*"`            broadcast, delivered to every station;
+* `"path:<id>"`    delivered to the stations on that path (path.PathStation);
+* `"station:<id>"` delivered to that station only.
+
+SYNC_ROUTING_RULES maps a model label to a rule `"<kind>:<attribute path>"`,
+for example `"path:declaracion.path_id"`, which is followed on the changed
+instance to find the path or station id. Models without a rule, and
+instances whose attribute path ends in None, are broadcast.
+"""
+
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models import Q, prefetch_related_objects
+from django.dispatch import receiver
+
+from path.models import PathStation
+
+BROADCAST = "*"
+ROUTE_KINDS = ("path", "station")
+
+
+class RoutingRuleError(ValueError):
+    """
+    Raised for a SYNC_ROUTING_RULES entry that cannot be parsed.
+    """
+
+
+@lru_cache(maxsize=None)
+def rule_for(Model):
+    """
+    Returns `(kind, hops)` for `Model`, or None when it is broadcast.
+    """
+    rule = getattr(settings, "SYNC_ROUTING_RULES", {}).get(Model._meta.label)
+    if not rule or rule == BROADCAST:
+        return None
+    kind, _, attribute_path = rule.partition(":")
+    if kind not in ROUTE_KINDS or not attribute_path:
+        raise RoutingRuleError(
+            f"Invalid routing rule '{rule}' for {Model._meta.label}; "
+            f"expected one of {ROUTE_KINDS} followed by ':<attribute path>'."
+        )
+    return kind, tuple(attribute_path.split("."))
+
+
+def route_key(instance):
+    """
+    Computes the route key of a changed instance from its model's rule.
+    """
+    rule = rule_for(instance.__class__)
+    if rule is None:
+        return BROADCAST
+    kind, hops = rule
+    value = instance
+    for hop in hops:
+        value = getattr(value, hop, None)
+        if value is None:
+            return BROADCAST
+    return f"{kind}:{value}"
+
+
+def route_keys(instances):
+    """
+    Route keys for many instances of one model, loading the related objects
+    the rule passes through with one query per hop.
+    """
+    instances = list(instances)
+    if not instances:
+        return []
+    rule = rule_for(instances[0].__class__)
+    if rule is not None and len(rule[1]) > 1:
+        prefetch_related_objects(instances, "__".join(rule[1][:-1]))
+    return [route_key(instance) for instance in instances]
+
+
+def station_route(workstation):
+    return f"station:{workstation.pk}"
+
+
+def station_path_ids(workstation):
+    return list(
+        PathStation.objects.filter(station=workstation).values_list(
+            "path_id", flat=True
+        )
+    )
+
+
+def subscriptions(workstation):
+    """
+    The route keys a workstation receives: broadcasts, its own station key
+    and the paths it is on.
+    """
+    return [BROADCAST, station_route(workstation)] + [
+        f"path:{path_id}" for path_id in station_path_ids(workstation)
+    ]
+
+
+def routed_rows(queryset, workstation):
+    """
+    Restricts a queryset to the rows whose changes are routed to
+    `workstation`, using the model's rule as a lookup.
+    """
+    rule = rule_for(queryset.model)
+    if rule is None:
+        return queryset
+    kind, hops = rule
+    lookup = "__".join(hops)
+    if kind == "station":
+        wanted = [workstation.pk]
+    else:
+        wanted = station_path_ids(workstation)
+    return queryset.filter(
+        Q(**{f"{lookup}__in": wanted}) | Q(**{f"{lookup}__isnull": True})
+    )
+
+
+@receiver(setting_changed)
+def reset_routing_rules(setting, **kwargs):
+    if setting == "SYNC_ROUTING_RULES":
+        rule_for.cache_clear()
@@ -0,0 +1,82 @@
+"""
+Row content hashes used to recognize pushed changes that would not change
+anything.
+
+RowVersion holds the row hash of every synchronized row whose last change
+went through the outbox or the ApplyEngine. A pushed create or update whose
+payload hashes to the stored version is the row as it already is, and is
+skipped without being written or fanned out again. The range trees in
+orcSync.merkle are built from these versions, bucketed by `pk_digest`.
+
+Rows changed by queryset updates, which bypass both, keep a stale version
+until their next captured change; `manage.py record_row_versions` hashes
+the stored rows again.
+"""
+
+import hashlib
+
+from django.db.models import Q
+
+from orcSync.models import RowVersion
+
+
+def pk_digest(pk):
+    return hashlib.sha256(str(pk).encode("utf-8")).hexdigest()
+
+
+def current_versions(keys):
+    """
+    Maps `(content_type_id, object_id)` keys to their stored row hash, with
+    one query for all of them.
+    """
+    by_type = {}
+    for content_type_id, object_id in keys:
+        by_type.setdefault(content_type_id, set()).add(str(object_id))
+    if not by_type:
+        return {}
+
+    condition = Q()
+    for content_type_id, object_ids in by_type.items():
+        condition |= Q(content_type_id=content_type_id, object_id__in=object_ids)
+    return {
+        (content_type_id, object_id): version
+        for content_type_id, object_id, version in RowVersion.objects.filter(
+            condition
+        ).values_list("content_type_id", "object_id", "version")
+    }
+
+
+def record_versions(versions):
+    """
+    Stores row hashes given as `{(content_type_id, object_id): version}`.
+    """
+    if not versions:
+        return
+    RowVersion.objects.bulk_create(
+        [
+            RowVersion(
+                content_type_id=content_type_id,
+                object_id=str(object_id),
+                version=version,
+                bucket=pk_digest(object_id),
+            )
+            for (content_type_id, object_id), version in versions.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["content_type", "object_id"],
+        update_fields=["version", "bucket"],
+    )
+
+
+def forget_versions(keys):
+    """
+    Drops the row hashes of deleted rows, given as `(content_type_id,
+    object_id)` keys.
+    """
+    by_type = {}
+    for content_type_id, object_id in keys:
+        by_type.setdefault(content_type_id, set()).add(str(object_id))
+    for content_type_id, object_ids in by_type.items():
+        RowVersion.objects.filter(
+            content_type_id=content_type_id, object_id__in=object_ids
+        ).delete()
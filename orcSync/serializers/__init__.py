@@ -1,6 +1,8 @@
 from .acknowledge import AcknowledgeEventsSerializer
 from .generic import CentralGenericModelSerializer
-from .get_pending import PendingDataSerializer
+from .get_pending import PendingChangesQuerySerializer, PendingDataSerializer
+from .merkle import RangeTreeQuerySerializer, RepairRequestSerializer
 from .outbound_change import OutboundChangeSerializer
 from .push import InboundChangeSerializer
+from .snapshot import SnapshotChunkQuerySerializer, SnapshotFinishSerializer
 from .sync_address import StationCredentialSerializer, WorkStationSerializer
@@ -1,11 +1,47 @@
 from rest_framework import serializers
 
+from orcSync.lanes import lane_names
+
 
 class AcknowledgeEventsSerializer(serializers.Serializer):
     """
-    Validates the list of event IDs sent by a workstation to acknowledge receipt.
+    Validates an acknowledgement sent by a workstation.
+
+    A workstation either lists the event IDs it applied, or reports the
+    sequence it has applied everything through: per priority lane with
+    `acknowledged_through_<lane>`, as returned in the `lanes` of a page, or
+    for every lane with `acknowledged_through`.
+    Events it could not apply go in `failed_events` and are sent again.
     """
 
     acknowledged_events = serializers.ListField(
-        child=serializers.UUIDField(), allow_empty=False
+        child=serializers.UUIDField(), required=False, default=list
+    )
+    acknowledged_through = serializers.IntegerField(min_value=0, required=False)
+    failed_events = serializers.ListField(
+        child=serializers.UUIDField(), required=False, default=list
     )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for lane in lane_names():
+            fields[f"acknowledged_through_{lane}"] = serializers.IntegerField(
+                min_value=0, required=False
+            )
+        return fields
+
+    def validate(self, attrs):
+        attrs["lane_through"] = {
+            lane: attrs.pop(f"acknowledged_through_{lane}")
+            for lane in lane_names()
+            if f"acknowledged_through_{lane}" in attrs
+        }
+        if (
+            not attrs["acknowledged_events"]
+            and "acknowledged_through" not in attrs
+            and not attrs["lane_through"]
+        ):
+            raise serializers.ValidationError(
+                "Provide acknowledged_events or acknowledged_through."
+            )
+        return attrs
@@ -0,0 +1,18 @@
+from django.apps import apps
+from django.conf import settings
+from rest_framework import serializers
+
+
+class SynchronizableModelField(serializers.CharField):
+    """
+    Accepts an `app_label.Model` listed in SYNCHRONIZABLE_MODELS and returns
+    the model class.
+    """
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if value not in getattr(settings, "SYNCHRONIZABLE_MODELS", []):
+            raise serializers.ValidationError(
+                f"Model '{value}' not found or is not allowed to be synchronized."
+            )
+        return apps.get_model(value)
@@ -1,8 +1,10 @@
 from django.apps import apps
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
 from rest_framework import serializers
 
+from orcSync.lanes import lane_names
 from orcSync.models import ChangeEvent
 
 
@@ -25,3 +27,39 @@ class PendingDataSerializer(serializers.Serializer):
 
     pending_changes = OutboundChangeSerializer(many=True)
     acknowledged_events = serializers.ListField(child=serializers.UUIDField())
+    confirmed_after = serializers.IntegerField(allow_null=True)
+    has_more_confirmations = serializers.BooleanField()
+
+
+class PendingChangesQuerySerializer(serializers.Serializer):
+    """
+    Validates the paging parameters of the get-pending endpoint.
+    `after` is the last sequence number the workstation has already received;
+    it defaults to the workstation's acknowledged watermarks. `after_<lane>`
+    sets it for one priority lane, as returned in the `lanes` of a page.
+    `confirmed_after` is the confirmation queue cursor of the previous page.
+    """
+
+    after = serializers.IntegerField(min_value=0, required=False)
+    confirmed_after = serializers.IntegerField(min_value=0, required=False)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for lane in lane_names():
+            fields[f"after_{lane}"] = serializers.IntegerField(
+                min_value=0, required=False
+            )
+        return fields
+
+    def validate_limit(self, value):
+        return min(value, settings.SYNC_PULL_MAX_LIMIT)
+
+    def validate(self, attrs):
+        attrs.setdefault("limit", settings.SYNC_PULL_DEFAULT_LIMIT)
+        attrs["lane_after"] = {
+            lane: attrs.pop(f"after_{lane}")
+            for lane in lane_names()
+            if f"after_{lane}" in attrs
+        }
+        return attrs
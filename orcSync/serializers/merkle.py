@@ -0,0 +1,37 @@
+import re
+
+from rest_framework import serializers
+
+from orcSync.serializers.fields import SynchronizableModelField
+
+PREFIX_RE = re.compile(r"^[0-9a-f]{0,8}$")
+
+
+class RangeTreeQuerySerializer(serializers.Serializer):
+    """
+    Selects a node of a model's hashed range tree. With `rows` the row
+    hashes of the node's bucket are returned instead of its children.
+    """
+
+    model = SynchronizableModelField()
+    prefix = serializers.CharField(required=False, allow_blank=True, default="")
+    rows = serializers.BooleanField(required=False, default=False)
+
+    def validate_prefix(self, value):
+        value = value.lower()
+        if not PREFIX_RE.match(value):
+            raise serializers.ValidationError(
+                "Prefix must be at most 8 hexadecimal digits."
+            )
+        return value
+
+
+class RepairRequestSerializer(serializers.Serializer):
+    """
+    The rows of a model a workstation found to differ from central.
+    """
+
+    model = SynchronizableModelField()
+    object_ids = serializers.ListField(
+        child=serializers.CharField(max_length=255), allow_empty=False, max_length=1000
+    )
@@ -1,25 +1,42 @@
-import decimal
-import uuid
-
-from django.db import models
-from django.db.models.fields.related import ManyToManyField
+from django.urls import reverse
 from rest_framework import serializers
 
+from orcSync.codec import codec_for
+from orcSync.merkle import row_hash
 from orcSync.models import ChangeEvent
 
 
 class OutboundChangeSerializer(serializers.ModelSerializer):
     """
     Formats a ChangeEvent record to be sent down to a workstation.
-    This version is compatible with older Django versions and correctly skips ManyToManyFields.
+    The current state of the object is encoded with its compiled sync codec.
+
+    An update captured as a delta is sent as the current values of its
+    changed fields, with `base_version` and `version`, when the object is
+    still at the event's version and no pending event was coalesced into it.
+    Every other change is sent as a full snapshot without versions. A station
+    whose row hash is not `base_version` asks for the row through
+    /api/sync/merkle/repair/.
     """
 
     model = serializers.SerializerMethodField()
     data_payload = serializers.SerializerMethodField()
+    base_version = serializers.SerializerMethodField()
+    version = serializers.SerializerMethodField()
 
     class Meta:
         model = ChangeEvent
-        fields = ("id", "model", "action", "object_id", "data_payload", "timestamp")
+        fields = (
+            "id",
+            "sequence",
+            "model",
+            "action",
+            "object_id",
+            "data_payload",
+            "base_version",
+            "version",
+            "timestamp",
+        )
 
     def get_model(self, obj):
         model_class = obj.content_type.model_class()
@@ -28,40 +45,43 @@ class OutboundChangeSerializer(serializers.ModelSerializer):
         return f"{obj.content_type.app_label}.{model_class.__name__}"
 
     def get_data_payload(self, obj):
+        return self.outbound(obj)[0]
+
+    def get_base_version(self, obj):
+        return self.outbound(obj)[1]
+
+    def get_version(self, obj):
+        return self.outbound(obj)[2]
+
+    def outbound(self, obj):
+        """
+        Returns `(payload, base_version, version)` for the event, encoding
+        the object once per event.
+        """
+        if not hasattr(obj, "_outbound"):
+            obj._outbound = self.encode(obj)
+        return obj._outbound
+
+    def encode(self, obj):
         if obj.action == "D" or not obj.changed_object:
-            return obj.data_payload
+            return obj.data_payload, None, None
 
-        instance = obj.changed_object
-        payload = {}
-        for field in instance._meta.get_fields():
-            if isinstance(
-                field,
-                (
-                    models.ManyToOneRel,
-                    models.ManyToManyRel,
-                    models.OneToOneRel,
-                    ManyToManyField,
-                ),
-            ):
-                continue
+        codec = codec_for(obj.changed_object.__class__)
+        if (
+            obj.action == "U"
+            and obj.base_version
+            and not getattr(obj, "coalesces_pending", True)
+        ):
+            payload = codec.encode(obj.changed_object)
+            if row_hash(payload) == obj.version:
+                delta = {key: payload[key] for key in obj.data_payload}
+                return delta, obj.base_version, obj.version
 
-            if isinstance(field, models.FileField):
-                file_val = getattr(instance, field.name)
-                if file_val and hasattr(file_val, "url"):
-                    payload[field.name] = self.context["request"].build_absolute_uri(
-                        file_val.url
-                    )
-                else:
-                    payload[field.name] = None
-            elif isinstance(field, models.ForeignKey):
-                related_obj = getattr(instance, field.name)
-                payload[field.attname] = str(related_obj.pk) if related_obj else None
-            else:
-                value = getattr(instance, field.name)
-                if isinstance(value, (decimal.Decimal, uuid.UUID)):
-                    payload[field.name] = str(value)
-                elif hasattr(value, "isoformat"):
-                    payload[field.name] = value.isoformat()
-                else:
-                    payload[field.name] = value
-        return payload
+        request = self.context["request"]
+        payload = codec.encode(
+            obj.changed_object,
+            blob_url=lambda sha256: request.build_absolute_uri(
+                reverse("sync_blob", args=[sha256])
+            ),
+        )
+        return payload, None, None
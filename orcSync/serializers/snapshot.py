@@ -0,0 +1,30 @@
+from django.conf import settings
+from rest_framework import serializers
+
+from orcSync.serializers.fields import SynchronizableModelField
+
+
+class SnapshotChunkQuerySerializer(serializers.Serializer):
+    """
+    Validates the parameters of a snapshot chunk request. `after` is the
+    primary key of the last row of the previous chunk of the same model.
+    """
+
+    model = SynchronizableModelField()
+    after = serializers.CharField(required=False, max_length=255)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_limit(self, value):
+        return min(value, settings.SYNC_SNAPSHOT_MAX_CHUNK)
+
+    def validate(self, attrs):
+        attrs.setdefault("limit", settings.SYNC_SNAPSHOT_DEFAULT_CHUNK)
+        return attrs
+
+
+class SnapshotFinishSerializer(serializers.Serializer):
+    """
+    The sequence point of the snapshot a workstation finished importing.
+    """
+
+    as_of = serializers.IntegerField(min_value=0)
@@ -29,3 +29,15 @@ class StationCredentialSerializer(serializers.ModelSerializer):
             "updated_at",
         ]
         extra_kwargs = {"api_key": {"write_only": True}}
+
+    def validate_api_key(self, value):
+        others = StationCredential.objects.filter(
+            api_key=StationCredential.hash_key(value)
+        )
+        if self.instance is not None:
+            others = others.exclude(pk=self.instance.pk)
+        if others.exists():
+            raise serializers.ValidationError(
+                "A station credential with this API key already exists."
+            )
+        return value
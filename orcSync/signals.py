@@ -60,40 +60,67 @@
 
 
 
-from orcSync.serializers import CentralGenericModelSerializer
+import threading
+from contextlib import contextmanager
+
+from django.dispatch import Signal
+
+from orcSync.codec import LOADED_STATE_ATTR, codec_for
+from orcSync.models import StationCursor
+from orcSync.outbox import capture
+from orcSync.permissions import invalidate_station_keys
+
+_sync_state = threading.local()
+
+# Sent by the ApplyEngine with the `instances` of a model it has written in
+# bulk, which sends no post_save.
+changes_applied = Signal()
+
+
+@contextmanager
+def applying_sync_changes():
+    """
+    Marks the current thread as applying changes received from a workstation,
+    so writes made inside (including cascades) are not captured again.
+    """
+    previous = getattr(_sync_state, "applying", False)
+    _sync_state.applying = True
+    try:
+        yield
+    finally:
+        _sync_state.applying = previous
 
 
 def create_server_change_event(instance, action):
     """
-    Queues a ChangeEvent creation task for async processing.
-    This prevents blocking the API request thread.
+    Captures a change made on the central server into the sync outbox. The
+    entry commits or rolls back together with the change itself.
     """
-    if hasattr(instance, "_is_sync_operation"):
+    if hasattr(instance, "_is_sync_operation") or getattr(
+        _sync_state, "applying", False
+    ):
         return
 
-    # Import the async task
-    from orcSync.tasks.task import create_change_event_async
+    capture(instance, action)
 
-    # Serialize the instance data before queuing
-    class DynamicSerializer(CentralGenericModelSerializer):
-        class Meta:
-            model = instance.__class__
-            fields = "__all__"
 
-    serializer = DynamicSerializer(instance)
-
-    # Queue the async task instead of processing synchronously
-    create_change_event_async.delay(
-        app_label=instance._meta.app_label,
-        model_name=instance._meta.model_name,
-        object_id=instance.pk,
-        action=action,
-        data_payload=serializer.data,
-    )
+def handle_pre_save(sender, instance, **kwargs):
+    """
+    Reads the stored row of a synchronizable instance about to be updated, so
+    that the update can be captured as a delta of the fields that changed.
+    Instances saved before already carry the state of their last capture.
+    """
+    if (
+        instance._state.adding
+        or LOADED_STATE_ATTR in instance.__dict__
+        or hasattr(instance, "_is_sync_operation")
+        or getattr(_sync_state, "applying", False)
+    ):
+        return
 
-    print(
-        f"SYNC_SERVER: Queued '{action}' event for {instance.__class__.__name__} {instance.pk}"
-    )
+    state = codec_for(sender).stored_state(instance)
+    if state is not None:
+        instance.__dict__[LOADED_STATE_ATTR] = state
 
 
 def handle_save(sender, instance, created, **kwargs):
@@ -103,3 +130,19 @@ def handle_save(sender, instance, created, **kwargs):
 
 def handle_delete(sender, instance, **kwargs):
     create_server_change_event(instance, "D")
+
+
+def handle_workstation_created(sender, instance, created, **kwargs):
+    """
+    Starts a new workstation's delivery watermarks at the current head, so it
+    receives every change made from now on.
+    """
+    if created:
+        StationCursor.for_lanes(instance)
+
+
+def handle_credential_changed(sender, instance, **kwargs):
+    """
+    Drops cached station key lookups when a credential is saved or deleted.
+    """
+    invalidate_station_keys()
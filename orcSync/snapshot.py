@@ -0,0 +1,127 @@
+"""
+Bootstrap snapshots for new or rebuilt stations.
+
+A snapshot is taken as of the current head of the ChangeEvent sequence
+(`as_of`). The station then downloads every synchronizable model routed to
+it, one chunk of rows at a time in primary key order. Each chunk is
+addressed by `(model, after)`, so an interrupted download resumes at the
+last chunk it completed.
+
+Rows are read as they are when each chunk is served, not as they were at
+`as_of`. Once the station has imported everything it calls `finish` and
+continues incremental sync from `as_of`. The events after that point are
+applied as upserts and deletes over the imported rows, so the station
+converges on the same state as if the rows had been read at `as_of`.
+"""
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from orcSync.apply_engine import dependency_order
+from orcSync.blobs import prefetch_blobs
+from orcSync.models import ChangeEvent, DeliveryException, StationCursor
+from orcSync.routing import routed_rows
+
+
+def snapshot_models():
+    """
+    The synchronizable models in foreign key dependency order.
+    """
+    models = []
+    for model_string in getattr(settings, "SYNCHRONIZABLE_MODELS", []):
+        try:
+            models.append(apps.get_model(model_string))
+        except LookupError:
+            continue
+    return dependency_order(models)
+
+
+def snapshot_rows(Model, workstation):
+    return routed_rows(Model._default_manager.all(), workstation).order_by("pk")
+
+
+def manifest(workstation):
+    """
+    Starts a snapshot: the sequence point it is taken at and, in import
+    order, the models and row counts the workstation will download.
+    """
+    as_of = ChangeEvent.objects.head()
+    return {
+        "as_of": as_of,
+        "models": [
+            {
+                "model": Model._meta.label,
+                "rows": snapshot_rows(Model, workstation).count(),
+            }
+            for Model in snapshot_models()
+        ],
+    }
+
+
+class SnapshotChunk:
+    """
+    Up to `limit` rows of a model above primary key `after`, read lazily
+    through a server-side cursor, CHUNK_SIZE rows at a time with their blobs
+    looked up together. `next_after` and `has_more` are known once the chunk
+    has been iterated.
+    """
+
+    CHUNK_SIZE = 500
+
+    def __init__(self, workstation, Model, after=None, limit=5000):
+        self.workstation = workstation
+        self.Model = Model
+        self.after = after
+        self.limit = limit
+        self.next_after = after
+        self.has_more = False
+
+    def __iter__(self):
+        rows = snapshot_rows(self.Model, self.workstation)
+        if self.after is not None:
+            rows = rows.filter(pk__gt=self.after)
+
+        read = 0
+        for batch in self.batches(rows[: self.limit + 1]):
+            prefetch_blobs(batch)
+            for instance in batch:
+                if read == self.limit:
+                    self.has_more = True
+                    return
+                read += 1
+                self.next_after = str(instance.pk)
+                yield instance
+
+    def batches(self, rows):
+        batch = []
+        for instance in rows.iterator(chunk_size=self.CHUNK_SIZE):
+            batch.append(instance)
+            if len(batch) == self.CHUNK_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def finish(workstation, as_of):
+    """
+    Continues incremental sync of `workstation` right after a snapshot taken
+    at `as_of`: the watermarks of all its lanes move there and older
+    redeliveries are dropped.
+    """
+    as_of = min(as_of, ChangeEvent.objects.head())
+    StationCursor.for_lanes(workstation)
+    now = timezone.now()
+    with transaction.atomic():
+        DeliveryException.objects.filter(
+            destination_workstation=workstation, change_event__sequence__lte=as_of
+        ).delete()
+        StationCursor.objects.filter(workstation=workstation).update(
+            acknowledged_sequence=as_of,
+            acknowledged_at=now,
+            delivered_sequence=as_of,
+            delivered_at=now,
+        )
+    return as_of
@@ -2,6 +2,7 @@ import logging
 
 from celery import shared_task
 from django.apps import apps
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 
 logging.basicConfig(
@@ -14,8 +15,11 @@ logging.basicConfig(
 @shared_task(bind=True, max_retries=3)
 def create_change_event_async(self, app_label, model_name, object_id, action, data_payload):
     """
-    Async task to create ChangeEvent and SyncAcknowledgements in background.
-    This prevents blocking the main API request thread.
+    Async task to create a ChangeEvent in background. Workstations pick it up
+    through their delivery watermark, so no per-station rows are written.
+    This prevents blocking the main API request thread. Central changes now
+    go through the outbox (see flush_outbox_task); this task stays to drain
+    tasks queued before that.
     
     Args:
         app_label: App label of the model (e.g., 'drivers')
@@ -25,8 +29,7 @@ def create_change_event_async(self, app_label, model_name, object_id, action, da
         data_payload: Serialized data of the object
     """
     try:
-        from orcSync.models import ChangeEvent, SyncAcknowledgement
-        from workstations.models import WorkStation
+        from orcSync.models import ChangeEvent
         
         logging.info(f"Creating ChangeEvent for {app_label}.{model_name} {object_id} - {action}")
         
@@ -41,18 +44,52 @@ def create_change_event_async(self, app_label, model_name, object_id, action, da
             source_workstation=None,  
         )
         
-        all_workstations = WorkStation.objects.all()
-        acks_to_create = [
-            SyncAcknowledgement(change_event=event, destination_workstation=ws)
-            for ws in all_workstations
-        ]
-        
-        if acks_to_create:
-            SyncAcknowledgement.objects.bulk_create(acks_to_create)
-            logging.info(f"Created {len(acks_to_create)} SyncAcknowledgements for event {event.id}")
-        
         logging.info(f"Successfully created ChangeEvent {event.id}")
         
     except Exception as exc:
         logging.error(f"Error creating ChangeEvent: {exc}", exc_info=True)
-        raise self.retry(exc=exc, countdown=5 * (self.request.retries + 1))
\ No newline at end of file
+        raise self.retry(exc=exc, countdown=5 * (self.request.retries + 1))
+
+@shared_task(bind=True, max_retries=3)
+def flush_outbox_task(self):
+    """
+    Moves captured changes from the outbox into ChangeEvents. Queued once per
+    committed transaction that captured changes, and run periodically by beat
+    to pick up anything a lost task left behind.
+    """
+    try:
+        from orcSync.outbox import flush_outbox
+
+        flush_outbox()
+    except Exception as exc:
+        logging.error(f"Error flushing sync outbox: {exc}", exc_info=True)
+        raise self.retry(exc=exc, countdown=5 * (self.request.retries + 1))
+
+
+@shared_task(bind=True, max_retries=0)
+def notify_stations_task(self, route_keys, exclude=None):
+    """
+    Tells the stations receiving `route_keys` to pull. Retries and circuit
+    breaking are handled per station by the dispatcher; a lost notification
+    is covered by the stations' regular polling.
+    """
+    from orcSync.dispatch import notify_stations
+
+    results = notify_stations(route_keys, exclude=exclude)
+    failed = [station for station, result in results.items() if result != "sent"]
+    if failed:
+        logging.info(f"Stations not notified of new changes: {failed}")
+    return results
+
+
+@shared_task(bind=True, max_retries=0)
+def compact_sync_history_task(self):
+    """
+    Deletes sync history every station has received, see orcSync.retention.
+    Run daily by beat; a missed run is caught up by the next one.
+    """
+    from orcSync.retention import compact
+
+    deleted = compact(archive_dir=settings.SYNC_ARCHIVE_DIR or None)
+    logging.info(f"Compacted sync history: {deleted}")
+    return deleted
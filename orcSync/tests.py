@@ -1,3 +1,1548 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_api_key.models import APIKey
+
+from address.models import RegionOrCity, Woreda, ZoneOrSubcity
+from declaracions.models import Checkin
+from exporters.models import Exporter
+from orcSync.blobs import prefetch_blobs
+from orcSync.codec import LOADED_STATE_ATTR, ModelCodec, codec_for
+from orcSync.dead_letters import replay
+from orcSync.delivery import (
+    PendingPage,
+    acknowledge,
+    backlog,
+    fully_acknowledged_events,
+    record_confirmations,
+)
+from orcSync.dispatch import breaker, notify_stations
+from orcSync.merkle import RangeTree, bucket_hash, pk_digest, row_hash
+from orcSync.models import (
+    AppliedChange,
+    ChangeEvent,
+    DeadLetter,
+    DeliveryConfirmation,
+    DeliveryException,
+    OutboxEntry,
+    RowVersion,
+    StationCredential,
+    StationCursor,
+    SyncBlob,
+    SyncBlobName,
+)
+from orcSync.outbox import _queue_flush, flush_outbox
+from orcSync.permissions import authenticate_station
+from orcSync.retention import compact
+from orcSync.routing import BROADCAST, route_key, station_route
+from path.models import Path, PathStation
+from trucks.models import Truck, TruckOwner
+from users.models import CustomUser
+from utils.api_keys import verify_api_key
+from workstations.models import WorkStation
+
+
+class SyncFixtures:
+    """
+    Creates two workstations with credentials and keeps captured changes from
+    queueing Celery tasks while fixtures are built.
+    """
+
+    def setUp(self):
+        patcher = mock.patch("orcSync.tasks.task.flush_outbox_task.delay")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        region = RegionOrCity.objects.create(name="Oromia")
+        zone = ZoneOrSubcity.objects.create(name="East Shewa", region=region)
+        self.woreda = Woreda.objects.create(name="Adama", zone=zone)
+        self.station = self.create_station("Station A", "key-a")
+        self.other_station = self.create_station("Station B", "key-b")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Api-Key key-a")
+
+    def create_station(self, name, api_key):
+        station = WorkStation.objects.create(
+            name=name, machine_number=name, woreda=self.woreda, kebele="01"
+        )
+        StationCredential.objects.create(
+            location=station, base_url=f"http://{name}.local", api_key=api_key
+        )
+        return station
+
+    def create_event(
+        self, instance, action="U", source=None, object_id=None, route_key="*"
+    ):
+        return ChangeEvent.objects.create(
+            content_type=ContentType.objects.get_for_model(instance),
+            object_id=object_id or str(instance.pk),
+            action=action,
+            route_key=route_key,
+            data_payload={},
+            source_workstation=source,
+        )
+
+    def deliver(self, station):
+        """
+        Sends `station` everything pending, as a pull does.
+        """
+        list(PendingPage(station, limit=10_000))
+
+    def change(self, model, object_id, payload, action="C"):
+        return {
+            "event_uuid": str(uuid.uuid4()),
+            "model": model,
+            "action": action,
+            "object_id": str(object_id),
+            "data_payload": payload,
+        }
+
+
+class SyncTestCase(SyncFixtures, TestCase):
+    pass
+
+
+class ChangeEventSequenceTests(SyncTestCase):
+    def test_sequences_are_monotonic(self):
+        first = self.create_event(self.woreda)
+        second = self.create_event(self.woreda)
+        self.assertEqual(second.sequence, first.sequence + 1)
+
+    def test_allocate_sequences_reserves_a_range(self):
+        start = ChangeEvent.objects.allocate_sequences(10)
+        self.assertEqual(ChangeEvent.objects.allocate_sequences(1), start + 10)
+
+
+class StationKeyTests(SyncTestCase):
+    def test_keys_are_stored_hashed(self):
+        credential = StationCredential.objects.get(location=self.station)
+        self.assertEqual(credential.api_key, StationCredential.hash_key("key-a"))
+
+    def test_verified_keys_are_cached_until_credentials_change(self):
+        self.assertEqual(authenticate_station("key-a").pk, self.station.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(authenticate_station("key-a").pk, self.station.pk)
+
+        StationCredential.objects.filter(location=self.station).get().delete()
+        self.assertIsNone(authenticate_station("key-a"))
+
+    def test_unknown_keys_are_not_cached(self):
+        self.assertIsNone(authenticate_station("key-c"))
+        # Created by another process, which clears only its own cache.
+        StationCredential.objects.bulk_create(
+            [
+                StationCredential(
+                    location=WorkStation.objects.create(
+                        name="Station C",
+                        machine_number="Station C",
+                        woreda=self.woreda,
+                        kebele="01",
+                    ),
+                    api_key=StationCredential.hash_key("key-c"),
+                )
+            ]
+        )
+        self.assertEqual(authenticate_station("key-c").name, "Station C")
+
+    def test_stored_hash_is_not_a_key(self):
+        stored = StationCredential.objects.get(location=self.station).api_key
+        self.assertIsNone(authenticate_station(stored))
+
+    def test_plaintext_keys_are_hashed_by_command(self):
+        StationCredential.objects.filter(location=self.station).update(
+            api_key="legacy-key"
+        )
+        self.assertIsNone(authenticate_station("legacy-key"))
+
+        out = io.StringIO()
+        call_command("hash_station_keys", stdout=out)
+
+        self.assertIn("Hashed 1 station keys.", out.getvalue())
+        self.assertEqual(authenticate_station("legacy-key").pk, self.station.pk)
+
+    def test_revoking_an_api_key_clears_the_cache(self):
+        api_key, key = APIKey.objects.create_key(name="weighbridge")
+        self.assertTrue(verify_api_key(key))
+        with self.assertNumQueries(0):
+            self.assertTrue(verify_api_key(key))
+
+        api_key.revoked = True
+        api_key.save()
+        self.assertFalse(verify_api_key(key))
+
+    def test_invalid_api_keys_are_not_cached(self):
+        api_key, key = APIKey.objects.create_key(name="weighbridge", revoked=True)
+        self.assertFalse(verify_api_key(key))
+
+        # Restored by another process, which clears only its own cache.
+        APIKey.objects.filter(pk=api_key.pk).update(revoked=False)
+        self.assertTrue(verify_api_key(key))
+
+        for number in range(1100):
+            self.assertFalse(verify_api_key(f"bad.key-{number}"))
+        with self.assertNumQueries(0):
+            self.assertTrue(verify_api_key(key))
+
+
+class RoutingTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        user = CustomUser.objects.create(username="planner", email="p@example.com")
+        self.path = Path.objects.create(name="Adama - Djibouti", created_by=user)
+        PathStation.objects.create(path=self.path, station=self.station, order=1)
+
+    def pending_ids(self):
+        response = self.client.get("/api/sync/get-pending/")
+        return {change["id"] for change in response.data["pending_changes"]}
+
+    @override_settings(SYNC_ROUTING_RULES={"address.Woreda": "path:zone.region_id"})
+    def test_route_key_follows_the_rule(self):
+        self.assertEqual(route_key(self.woreda), f"path:{self.woreda.zone.region_id}")
+        self.assertEqual(route_key(self.woreda.zone), BROADCAST)
+
+    @override_settings(SYNC_ROUTING_RULES={"address.Woreda": "path:zone.region_id"})
+    def test_captured_changes_carry_their_route(self):
+        self.woreda.save()
+        entry = OutboxEntry.objects.filter(object_id=str(self.woreda.pk)).last()
+        self.assertEqual(entry.route_key, f"path:{self.woreda.zone.region_id}")
+
+    def test_stations_only_receive_their_routes(self):
+        on_path = self.create_event(
+            self.woreda, object_id=str(uuid.uuid4()), route_key=f"path:{self.path.pk}"
+        )
+        elsewhere = self.create_event(
+            self.woreda, object_id=str(uuid.uuid4()), route_key=f"path:{uuid.uuid4()}"
+        )
+        own = self.create_event(
+            self.woreda,
+            object_id=str(uuid.uuid4()),
+            route_key=station_route(self.station),
+        )
+        other = self.create_event(
+            self.woreda,
+            object_id=str(uuid.uuid4()),
+            route_key=station_route(self.other_station),
+        )
+        broadcast = self.create_event(self.woreda, object_id=str(uuid.uuid4()))
+
+        self.assertEqual(
+            self.pending_ids(), {str(on_path.id), str(own.id), str(broadcast.id)}
+        )
+        self.assertNotIn(str(elsewhere.id), self.pending_ids())
+        self.assertNotIn(str(other.id), self.pending_ids())
+
+    def test_stations_off_the_route_do_not_hold_back_its_events(self):
+        source = self.create_station("Station C", "key-c")
+        sent = self.create_event(
+            self.woreda, source=source, route_key=f"path:{self.path.pk}"
+        )
+        # Station B is not on the path and never acknowledges anything.
+        acknowledge(self.other_station, event_ids=[])
+        acknowledge(self.station, event_ids=[])
+        self.assertNotIn(sent.id, list(fully_acknowledged_events(source)))
+
+        acknowledge(self.station, event_ids=[sent.id])
+        self.assertIn(sent.id, list(fully_acknowledged_events(source)))
+
+        record_confirmations(source)
+        compact(days=-1)
+        self.assertFalse(ChangeEvent.objects.filter(pk=sent.pk).exists())
+
+    def test_complete_page_moves_past_unrouted_events(self):
+        self.create_event(self.woreda, route_key=station_route(self.other_station))
+        response = self.client.get("/api/sync/get-pending/")
+
+        self.assertEqual(response.data["pending_changes"], [])
+        self.assertEqual(response.data["next_after"], ChangeEvent.objects.head())
+
+
+class SnapshotTests(SyncTestCase):
+    def read_chunk(self, params):
+        response = self.client.get(
+            "/api/sync/snapshot/", params, HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response.status_code, 200)
+        body = gzip.decompress(b"".join(response.streaming_content))
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_manifest_lists_models_in_import_order(self):
+        self.create_event(self.woreda)
+        response = self.client.get("/api/sync/snapshot/")
+
+        self.assertEqual(response.data["as_of"], ChangeEvent.objects.head())
+        labels = [entry["model"] for entry in response.data["models"]]
+        self.assertLess(
+            labels.index("address.RegionOrCity"), labels.index("address.Woreda")
+        )
+        woredas = labels.index("address.Woreda")
+        self.assertEqual(response.data["models"][woredas]["rows"], 1)
+
+    def test_chunks_resume_after_the_last_row(self):
+        zone = ZoneOrSubcity.objects.get()
+        for name in ("Bishoftu", "Mojo", "Welenchiti"):
+            Woreda.objects.create(name=name, zone=zone)
+        expected = sorted(str(pk) for pk in Woreda.objects.values_list("pk", flat=True))
+
+        *rows, end = self.read_chunk({"model": "address.Woreda", "limit": 3})
+        self.assertTrue(end["has_more"])
+        *more, end = self.read_chunk(
+            {"model": "address.Woreda", "limit": 3, "after": end["next_after"]}
+        )
+        self.assertFalse(end["has_more"])
+
+        self.assertEqual([row["object_id"] for row in rows + more], expected)
+        self.assertEqual(rows[0]["data_payload"]["zone_id"], str(zone.pk))
+
+    @override_settings(SYNC_ROUTING_RULES={"address.Woreda": "station:zone_id"})
+    def test_chunks_only_contain_routed_rows(self):
+        rows = self.read_chunk({"model": "address.Woreda"})[:-1]
+        self.assertEqual(rows, [])
+
+    def test_rejects_models_that_are_not_synchronized(self):
+        response = self.client.get("/api/sync/snapshot/", {"model": "orcSync.SyncBlob"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_finish_moves_the_watermark_to_the_snapshot(self):
+        events = [
+            self.create_event(self.woreda, object_id=str(uuid.uuid4()))
+            for _ in range(2)
+        ]
+        DeliveryException.objects.create(
+            change_event=events[0], destination_workstation=self.station
+        )
+
+        response = self.client.post(
+            "/api/sync/snapshot/", {"as_of": events[1].sequence}, format="json"
+        )
+
+        self.assertEqual(response.data["acknowledged_through"], events[1].sequence)
+        for cursor in StationCursor.objects.filter(workstation=self.station):
+            self.assertEqual(cursor.acknowledged_sequence, events[1].sequence)
+        self.assertFalse(DeliveryException.objects.exists())
+
+
+class RangeTreeTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        zone = ZoneOrSubcity.objects.get()
+        for name in ("Bishoftu", "Mojo", "Welenchiti", "Dukem"):
+            Woreda.objects.create(name=name, zone=zone)
+        flush_outbox()
+
+    def get_node(self, **params):
+        response = self.client.get(
+            "/api/sync/merkle/", {"model": "address.Woreda", **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_children_partition_the_rows(self):
+        root = self.get_node()
+        self.assertEqual(root["rows"], 5)
+
+        rows = {}
+        for prefix, hashed in root["children"].items():
+            bucket = self.get_node(prefix=prefix, rows=True)["rows"]
+            self.assertEqual(bucket_hash(bucket), hashed)
+            rows.update(bucket)
+        self.assertEqual(bucket_hash(rows), root["hash"])
+
+    def test_changed_row_only_changes_its_branch(self):
+        before = self.get_node()
+        woreda = Woreda.objects.get(name="Mojo")
+        woreda.name = "Modjo"
+        woreda.save()
+        flush_outbox()
+        after = self.get_node()
+
+        changed = [
+            prefix
+            for prefix in before["children"]
+            if before["children"][prefix] != after["children"][prefix]
+        ]
+        self.assertEqual(changed, [pk_digest(woreda.pk)[0]])
+
+    def test_nodes_are_built_from_row_versions(self):
+        ContentType.objects.get_for_model(Woreda)
+        tree = RangeTree(Woreda, self.station, prefix="")
+        with mock.patch.object(
+            ModelCodec, "encode", side_effect=AssertionError
+        ), self.assertNumQueries(1):
+            root = tree.node()
+        self.assertEqual(root["rows"], 5)
+
+    def test_queryset_updates_are_found_once_versions_are_recorded(self):
+        before = self.get_node()
+        woreda = Woreda.objects.get(name="Mojo")
+        Woreda.objects.filter(pk=woreda.pk).update(name="Modjo")
+        self.assertEqual(self.get_node(), before)
+
+        call_command("record_row_versions", "address.Woreda", stdout=io.StringIO())
+
+        after = self.get_node()
+        self.assertNotEqual(after["hash"], before["hash"])
+        self.assertEqual(after["rows"], 5)
+
+    def test_rejects_non_hex_prefix(self):
+        response = self.client.get(
+            "/api/sync/merkle/", {"model": "address.Woreda", "prefix": "xyz"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_repair_queues_events_for_the_station_only(self):
+        woreda = Woreda.objects.get(name="Dukem")
+        missing = uuid.uuid4()
+        head = ChangeEvent.objects.head()
+        response = self.client.post(
+            "/api/sync/merkle/repair/",
+            {"model": "address.Woreda", "object_ids": [str(woreda.pk), str(missing)]},
+            format="json",
+        )
+
+        self.assertEqual(response.data["queued"], 2)
+        events = {
+            event.object_id: event
+            for event in ChangeEvent.objects.filter(sequence__gt=head)
+        }
+        self.assertEqual(events[str(woreda.pk)].action, "U")
+        self.assertEqual(events[str(missing)].action, "D")
+        self.assertEqual(
+            {event.route_key for event in events.values()},
+            {station_route(self.station)},
+        )
+
+
+class CodecTests(SyncTestCase):
+    def test_encodes_foreign_keys_by_attname_without_loading_them(self):
+        zone = ZoneOrSubcity.objects.get()
+        zone = ZoneOrSubcity.objects.get(pk=zone.pk)
+
+        with self.assertNumQueries(0):
+            payload = codec_for(ZoneOrSubcity).encode(zone)
+
+        self.assertEqual(payload["region_id"], str(zone.region_id))
+        self.assertNotIn("region", payload)
+        self.assertEqual(payload["id"], str(zone.pk))
+
+    def test_decode_splits_payload_by_write_kind(self):
+        region_id = uuid.uuid4()
+        data, relations, many_to_many, files = codec_for(ZoneOrSubcity).decode(
+            {
+                "name": "Arsi",
+                "region": str(region_id),
+                "created_at": "2024-01-01T10:00:00Z",
+                "unknown": 1,
+                "created_by": None,
+            }
+        )
+
+        self.assertEqual(data["name"], "Arsi")
+        self.assertEqual(data["created_at"].utcoffset().total_seconds(), 0)
+        self.assertEqual(relations["region_id"][1], str(region_id))
+        self.assertNotIn("unknown", data)
+        self.assertNotIn("created_by_id", relations)
+        self.assertEqual((many_to_many, files), ({}, {}))
+
+    def test_excluded_fields_are_not_synchronized(self):
+        user = CustomUser(username="clerk", current_status="inactive")
+
+        self.assertNotIn("current_status", codec_for(CustomUser).encode(user))
+        data, _, _, _ = codec_for(CustomUser).decode({"current_status": "active"})
+        self.assertNotIn("current_status", data)
+
+    def test_benchmark_command_reports_each_model(self):
+        out = io.StringIO()
+        call_command(
+            "bench_sync_codec", "address.Woreda", objects=5, repeat=1, stdout=out
+        )
+        self.assertIn("address.Woreda", out.getvalue())
+
+
+class OutboxTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        OutboxEntry.objects.all().delete()
+
+    def test_row_recreated_in_the_same_batch_keeps_its_version(self):
+        region = RegionOrCity.objects.create(name="Afar")
+        region_id = region.pk
+        region.delete()
+        region = RegionOrCity.objects.create(id=region_id, name="Afar")
+
+        flush_outbox()
+
+        self.assertEqual(
+            RowVersion.objects.get(object_id=str(region_id)).version,
+            row_hash(codec_for(RegionOrCity).encode(region)),
+        )
+
+    def test_changes_are_captured_in_the_outbox(self):
+        region = RegionOrCity.objects.create(name="Afar")
+        region.name = "Afar Region"
+        region.save()
+        region_id = region.pk
+        region.delete()
+
+        entries = OutboxEntry.objects.filter(object_id=str(region_id))
+        self.assertEqual([entry.action for entry in entries], ["C", "U", "D"])
+        self.assertEqual(entries[1].data_payload["name"], "Afar Region")
+        self.assertFalse(ChangeEvent.objects.exists())
+
+    def test_rolled_back_changes_leave_no_entries(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            RegionOrCity.objects.create(name="Somali")
+            raise RuntimeError
+        self.assertFalse(OutboxEntry.objects.exists())
+
+    def test_one_flush_is_queued_per_transaction(self):
+        with transaction.atomic():
+            for name in ("Amhara", "Tigray", "Harari"):
+                RegionOrCity.objects.create(name=name)
+
+        queued = [
+            callback
+            for callback in transaction.get_connection().run_on_commit
+            if callback[1] is _queue_flush
+        ]
+        self.assertEqual(len(queued), 1)
+
+    def test_flush_creates_events_in_capture_order(self):
+        regions = [RegionOrCity.objects.create(name=f"R{i}") for i in range(5)]
+
+        self.assertEqual(flush_outbox(batch_size=2), 5)
+
+        events = list(ChangeEvent.objects.all())
+        self.assertEqual(
+            [event.object_id for event in events],
+            [str(region.pk) for region in regions],
+        )
+        sequences = [event.sequence for event in events]
+        self.assertEqual(sequences, list(range(sequences[0], sequences[0] + 5)))
+        self.assertFalse(OutboxEntry.objects.exists())
+
+
+class DeltaUpdateTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        OutboxEntry.objects.all().delete()
+        self.after = ChangeEvent.objects.head()
+
+    def rename(self, woreda, name):
+        woreda.name = name
+        woreda.save()
+        flush_outbox()
+
+    def pull(self):
+        response = self.client.get("/api/sync/get-pending/", {"after": self.after})
+        [change] = response.data["pending_changes"]
+        return change
+
+    def test_update_is_captured_as_delta(self):
+        woreda = Woreda.objects.get(pk=self.woreda.pk)
+        loaded = codec_for(Woreda).encode(woreda)
+        self.rename(woreda, "Adama Town")
+
+        event = ChangeEvent.objects.get(action="U")
+        self.assertEqual(set(event.data_payload), {"name", "updated_at"})
+        self.assertEqual(event.data_payload["name"], "Adama Town")
+        self.assertEqual(event.base_version, row_hash(loaded))
+        self.assertEqual(event.version, row_hash(codec_for(Woreda).encode(woreda)))
+
+    def test_loading_rows_keeps_no_state(self):
+        woreda = Woreda.objects.get(pk=self.woreda.pk)
+
+        self.assertNotIn(LOADED_STATE_ATTR, woreda.__dict__)
+
+    def test_update_of_a_deferred_instance_is_a_delta(self):
+        loaded = codec_for(Woreda).encode(Woreda.objects.get(pk=self.woreda.pk))
+        woreda = Woreda.objects.only("name").get(pk=self.woreda.pk)
+        self.rename(woreda, "Adama Town")
+
+        event = ChangeEvent.objects.get(action="U")
+        self.assertEqual(set(event.data_payload), {"name"})
+        self.assertEqual(event.base_version, row_hash(loaded))
+
+    def test_created_rows_are_captured_in_full(self):
+        region = RegionOrCity.objects.create(name="Afar")
+
+        entry = OutboxEntry.objects.get(object_id=str(region.pk))
+        self.assertEqual(entry.data_payload, codec_for(RegionOrCity).encode(region))
+        self.assertEqual(entry.base_version, "")
+
+    def test_pull_sends_delta_unless_updates_were_coalesced(self):
+        woreda = Woreda.objects.get(pk=self.woreda.pk)
+        self.rename(woreda, "Adama Town")
+
+        change = self.pull()
+        event = ChangeEvent.objects.get(action="U")
+        self.assertEqual(set(change["data_payload"]), {"name", "updated_at"})
+        self.assertEqual(change["base_version"], event.base_version)
+        self.assertEqual(change["version"], event.version)
+
+        self.rename(woreda, "Adama City")
+
+        change = self.pull()
+        self.assertIsNone(change["base_version"])
+        self.assertEqual(
+            change["data_payload"], codec_for(Woreda).encode(Woreda.objects.get())
+        )
+
+
+class GetPendingPagingTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = [
+            self.create_event(self.woreda, object_id=str(uuid.uuid4()))
+            for _ in range(5)
+        ]
+
+    def test_pages_follow_the_sequence(self):
+        response = self.client.get("/api/sync/get-pending/", {"limit": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["has_more"])
+        self.assertEqual(response.data["next_after"], self.events[1].sequence)
+        self.assertEqual(len(response.data["pending_changes"]), 2)
+
+        response = self.client.get(
+            "/api/sync/get-pending/",
+            {"after": response.data["next_after"], "limit": 10},
+        )
+        self.assertFalse(response.data["has_more"])
+        self.assertEqual(
+            [change["sequence"] for change in response.data["pending_changes"]],
+            [event.sequence for event in self.events[2:]],
+        )
+        cursor = StationCursor.for_workstation(self.station, "bulk")
+        self.assertEqual(cursor.delivered_sequence, self.events[-1].sequence)
+
+    def test_rejects_invalid_cursor(self):
+        response = self.client.get("/api/sync/get-pending/", {"after": -1})
+        self.assertEqual(response.status_code, 400)
+
+    def test_skips_events_sent_by_the_station(self):
+        own = self.create_event(self.woreda, source=self.station)
+        response = self.client.get("/api/sync/get-pending/", {"limit": 100})
+        ids = {change["id"] for change in response.data["pending_changes"]}
+        self.assertNotIn(str(own.id), ids)
+        self.assertEqual(len(ids), 5)
+
+
+class PriorityLaneTests(SyncTestCase):
+    def create_events(self, Model, count):
+        return [
+            self.create_event(Model, object_id=str(uuid.uuid4())) for _ in range(count)
+        ]
+
+    def pull(self, limit):
+        response = self.client.get("/api/sync/get-pending/", {"limit": limit})
+        return response.data
+
+    def test_transactional_events_skip_master_data_backlog(self):
+        self.create_events(Woreda, 20)
+        [checkin] = self.create_events(Checkin, 1)
+
+        page = self.pull(5)
+
+        ids = [change["id"] for change in page["pending_changes"]]
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(ids[-1], str(checkin.id))
+        self.assertFalse(page["lanes"]["realtime"]["has_more"])
+        self.assertTrue(page["lanes"]["bulk"]["has_more"])
+
+    def test_low_lanes_keep_their_share(self):
+        self.create_events(Woreda, 20)
+        self.create_events(Checkin, 20)
+
+        page = self.pull(10)
+
+        models = [change["model"] for change in page["pending_changes"]]
+        self.assertEqual(models.count("declaracions.Checkin"), 9)
+        self.assertEqual(models.count("address.Woreda"), 1)
+
+    def test_lanes_are_acknowledged_independently(self):
+        self.create_events(Woreda, 3)
+        checkins = self.create_events(Checkin, 2)
+        bulk = StationCursor.for_workstation(self.station, "bulk")
+
+        watermarks = acknowledge(
+            self.station, event_ids=[event.id for event in checkins]
+        )
+
+        self.assertEqual(watermarks["realtime"], checkins[-1].sequence)
+        self.assertEqual(watermarks["bulk"], bulk.acknowledged_sequence)
+        self.assertFalse(DeliveryException.objects.exists())
+        metrics = backlog(self.station)
+        self.assertEqual(metrics["bulk"]["pending"], 3)
+        self.assertEqual(metrics["realtime"]["pending"], 0)
+
+    def test_acknowledging_through_stays_within_each_lane(self):
+        woredas = self.create_events(Woreda, 20)
+        [checkin] = self.create_events(Checkin, 1)
+        page = self.pull(5)
+        self.assertEqual(page["lanes"]["bulk"]["next_after"], woredas[3].sequence)
+
+        watermarks = acknowledge(self.station, through=checkin.sequence)
+
+        self.assertEqual(watermarks["realtime"], checkin.sequence)
+        self.assertEqual(watermarks["bulk"], woredas[3].sequence)
+        ids = [change["id"] for change in self.pull(5)["pending_changes"]]
+        self.assertEqual(ids[0], str(woredas[4].id))
+
+    def test_lanes_are_acknowledged_through_their_own_positions(self):
+        _, key = APIKey.objects.create_key(name="station-a")
+        StationCredential.objects.filter(location=self.station).update(
+            api_key=StationCredential.hash_key(key)
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        woredas = self.create_events(Woreda, 20)
+        [checkin] = self.create_events(Checkin, 1)
+        self.pull(5)
+
+        response = self.client.post(
+            "/api/sync/acknowledge/",
+            {
+                "acknowledged_through_bulk": woredas[1].sequence,
+                "acknowledged_through_realtime": checkin.sequence,
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["lanes"]["bulk"], woredas[1].sequence)
+        self.assertEqual(response.data["lanes"]["realtime"], checkin.sequence)
+
+
+class WatermarkAcknowledgementTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = [
+            self.create_event(self.woreda, object_id=str(uuid.uuid4()))
+            for _ in range(4)
+        ]
+
+    def test_new_station_starts_at_the_head(self):
+        late = self.create_station("Station C", "key-c")
+        for cursor in StationCursor.objects.filter(workstation=late):
+            self.assertEqual(cursor.acknowledged_sequence, self.events[-1].sequence)
+
+    def test_unlisted_events_are_redelivered(self):
+        acked = [self.events[0].id, self.events[1].id, self.events[3].id]
+        watermark = acknowledge(self.station, event_ids=acked)["bulk"]
+
+        self.assertEqual(watermark, self.events[3].sequence)
+        self.assertEqual(
+            list(
+                DeliveryException.objects.filter(
+                    destination_workstation=self.station
+                ).values_list("change_event_id", flat=True)
+            ),
+            [self.events[2].id],
+        )
+
+        response = self.client.get("/api/sync/get-pending/")
+        self.assertEqual(
+            [change["id"] for change in response.data["pending_changes"]],
+            [str(self.events[2].id)],
+        )
+
+        acknowledge(self.station, event_ids=[self.events[2].id])
+        self.assertFalse(DeliveryException.objects.exists())
+
+    def test_acknowledge_through_with_failures(self):
+        self.deliver(self.station)
+        watermarks = acknowledge(
+            self.station,
+            through=self.events[-1].sequence,
+            failed_ids=[self.events[1].id],
+        )
+        self.assertEqual(set(watermarks.values()), {self.events[-1].sequence})
+        self.assertTrue(
+            DeliveryException.objects.filter(change_event=self.events[1]).exists()
+        )
+
+    def test_fully_acknowledged_waits_for_every_station(self):
+        sent = self.create_event(self.woreda, source=self.station)
+        self.assertNotIn(sent.id, list(fully_acknowledged_events(self.station)))
+
+        self.deliver(self.other_station)
+        acknowledge(self.other_station, through=sent.sequence)
+        self.assertIn(sent.id, list(fully_acknowledged_events(self.station)))
+
+    def test_acknowledge_endpoint_requires_ids_or_watermark(self):
+        _, key = APIKey.objects.create_key(name="station-a")
+        StationCredential.objects.filter(location=self.station).update(
+            api_key=StationCredential.hash_key(key)
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        self.deliver(self.station)
+
+        response = self.client.post("/api/sync/acknowledge/", {}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(
+            "/api/sync/acknowledge/",
+            {"acknowledged_through": self.events[1].sequence},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["acknowledged_through"], self.events[1].sequence)
+
+
+class ConfirmationQueueTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sent = [
+            self.create_event(
+                self.woreda, source=self.station, object_id=str(uuid.uuid4())
+            )
+            for _ in range(3)
+        ]
+        self.deliver(self.other_station)
+        acknowledge(self.other_station, through=self.sent[-1].sequence)
+
+    def pull(self, **params):
+        return self.client.get("/api/sync/get-pending/", params).data
+
+    def test_confirmations_are_paged_and_drained_by_cursor(self):
+        with override_settings(SYNC_CONFIRMATION_LIMIT=2):
+            first = self.pull()
+            self.assertEqual(
+                first["acknowledged_events"], [event.id for event in self.sent[:2]]
+            )
+            self.assertTrue(first["has_more_confirmations"])
+
+            second = self.pull(confirmed_after=first["confirmed_after"])
+        self.assertEqual(second["acknowledged_events"], [self.sent[2].id])
+        self.assertFalse(second["has_more_confirmations"])
+        self.assertEqual(DeliveryConfirmation.objects.count(), 1)
+
+        third = self.pull(confirmed_after=second["confirmed_after"])
+        self.assertEqual(third["acknowledged_events"], [])
+        self.assertFalse(DeliveryConfirmation.objects.exists())
+
+    def test_confirmations_without_a_cursor_are_served_again(self):
+        first = self.pull()
+        self.assertEqual(
+            first["acknowledged_events"], [event.id for event in self.sent]
+        )
+
+        # The response was lost: the station asks again without a cursor.
+        again = self.pull()
+        self.assertEqual(again["acknowledged_events"], first["acknowledged_events"])
+        self.assertEqual(again["confirmed_after"], first["confirmed_after"])
+        self.assertEqual(DeliveryConfirmation.objects.count(), len(self.sent))
+
+        drained = self.pull(confirmed_after=again["confirmed_after"])
+        self.assertEqual(drained["acknowledged_events"], [])
+        self.assertFalse(DeliveryConfirmation.objects.exists())
+
+    def test_events_are_queued_once(self):
+        cursor = self.pull()["confirmed_after"]
+        self.pull(confirmed_after=cursor)
+        self.assertFalse(DeliveryConfirmation.objects.exists())
+        self.assertFalse(ChangeEvent.objects.filter(confirmed_at__isnull=True).exists())
+
+        later = self.create_event(self.woreda, source=self.station)
+        self.assertEqual(self.pull()["acknowledged_events"], [])
+
+        self.deliver(self.other_station)
+        acknowledge(self.other_station, through=later.sequence)
+        self.assertEqual(self.pull()["acknowledged_events"], [later.id])
+
+
+@override_settings(SYNC_RETENTION_DAYS=0)
+class RetentionTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = [
+            self.create_event(self.woreda, object_id=str(uuid.uuid4()))
+            for _ in range(3)
+        ]
+
+    def acknowledge_all(self, through):
+        for station in (self.station, self.other_station):
+            self.deliver(station)
+            acknowledge(station, through=through)
+
+    def test_only_delivered_history_is_deleted(self):
+        self.acknowledge_all(self.events[1].sequence)
+        DeliveryException.objects.create(
+            change_event=self.events[0], destination_workstation=self.station
+        )
+        AppliedChange.objects.create(
+            source_workstation=self.station, event_uuid=uuid.uuid4()
+        )
+
+        deleted = compact(batch_size=1)
+
+        self.assertEqual(deleted["change_events"], 1)
+        self.assertEqual(deleted["applied_changes"], 1)
+        self.assertEqual(
+            set(ChangeEvent.objects.values_list("id", flat=True)),
+            {self.events[0].id, self.events[2].id},
+        )
+
+    def test_unconfirmed_events_of_a_station_are_kept(self):
+        sent = self.create_event(self.woreda, source=self.station)
+        self.acknowledge_all(sent.sequence)
+
+        compact()
+        self.assertTrue(ChangeEvent.objects.filter(pk=sent.pk).exists())
+
+        self.client.get("/api/sync/get-pending/")
+        compact()
+        self.assertFalse(ChangeEvent.objects.exists())
+
+    def test_deleted_events_are_archived(self):
+        self.acknowledge_all(self.events[-1].sequence)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        call_command(
+            "compact_sync_history", archive_dir=directory, stdout=io.StringIO()
+        )
+
+        (name,) = os.listdir(directory)
+        with gzip.open(os.path.join(directory, name), "rt") as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual(
+            [row["id"] for row in rows], [str(event.id) for event in self.events]
+        )
+        self.assertEqual(rows[0]["content_type__model"], "woreda")
+
+
+class CoalescingTests(SyncTestCase):
+    def test_only_latest_event_per_object_is_sent(self):
+        region = RegionOrCity.objects.get()
+        first = self.create_event(self.woreda, action="C")
+        self.create_event(region)
+        self.create_event(self.woreda)
+        deleted = self.create_event(self.woreda, action="D")
+
+        response = self.client.get("/api/sync/get-pending/", {"after": 0})
+        changes = response.data["pending_changes"]
+        self.assertEqual(len(changes), 2)
+        self.assertEqual(changes[-1]["id"], str(deleted.id))
+        self.assertNotIn(str(first.id), {change["id"] for change in changes})
+
+    def test_acknowledging_latest_settles_superseded(self):
+        base = StationCursor.for_workstation(self.station, "bulk").acknowledged_sequence
+        stale = self.create_event(self.woreda)
+        self.deliver(self.station)
+        acknowledge(self.station, through=stale.sequence, failed_ids=[stale.id])
+        self.assertTrue(DeliveryException.objects.filter(change_event=stale).exists())
+
+        latest = self.create_event(self.woreda)
+        response = self.client.get("/api/sync/get-pending/")
+        self.assertEqual(
+            [change["id"] for change in response.data["pending_changes"]],
+            [str(latest.id)],
+        )
+
+        watermark = acknowledge(self.station, event_ids=[latest.id])["bulk"]
+        self.assertEqual(watermark, latest.sequence)
+        self.assertGreater(watermark, base)
+        self.assertFalse(DeliveryException.objects.exists())
+
+
+class PushApplyEngineTests(SyncTestCase):
+    def push(self, changes):
+        return self.client.post("/api/sync/push/", changes, format="json")
+
+    def test_applies_batch_in_dependency_order(self):
+        region_id, zone_id = uuid.uuid4(), uuid.uuid4()
+        changes = [
+            self.change(
+                "address.ZoneOrSubcity",
+                zone_id,
+                {"id": str(zone_id), "name": "Arsi", "region_id": str(region_id)},
+            ),
+            self.change(
+                "address.RegionOrCity",
+                region_id,
+                {"id": str(region_id), "name": "Sidama"},
+            ),
+            self.change(
+                "address.RegionOrCity",
+                region_id,
+                {"id": str(region_id), "name": "Sidama Region"},
+                action="U",
+            ),
+        ]
+        response = self.push(changes)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [result["operation"] for result in response.data["details"]],
+            ["created", "created", "created"],
+        )
+        zone = ZoneOrSubcity.objects.get(pk=zone_id)
+        self.assertEqual(zone.region.name, "Sidama Region")
+        events = ChangeEvent.objects.filter(source_workstation=self.station)
+        self.assertEqual(events.count(), 3)
+        sequences = sorted(events.values_list("sequence", flat=True))
+        self.assertEqual(sequences, list(range(sequences[0], sequences[0] + 3)))
+
+    def exporter(self, exporter_id, **fields):
+        return self.change(
+            "exporters.Exporter",
+            exporter_id,
+            {
+                "id": str(exporter_id),
+                "first_name": "Tigist",
+                "last_name": "Haile",
+                "woreda_id": str(self.woreda.pk),
+                **fields,
+            },
+        )
+
+    def test_models_overriding_save_are_saved_one_by_one(self):
+        good_id, bad_id = uuid.uuid4(), uuid.uuid4()
+        response = self.push(
+            [
+                self.exporter(good_id, phone_number="0911000001"),
+                self.exporter(bad_id, phone_number="0911000002", tin_number="12"),
+            ]
+        )
+
+        self.assertEqual(
+            [result["status"] for result in response.data["details"]],
+            ["applied", "failed"],
+        )
+        self.assertTrue(Exporter.objects.get(pk=good_id).unique_id.startswith("ORC"))
+        self.assertFalse(Exporter.objects.filter(pk=bad_id).exists())
+
+    def test_updates_and_deletes_existing_rows(self):
+        region = RegionOrCity.objects.get()
+        spare = RegionOrCity.objects.create(name="Spare")
+        response = self.push(
+            [
+                self.change(
+                    "address.RegionOrCity",
+                    region.pk,
+                    {"id": str(region.pk), "name": "Oromia Region"},
+                    action="U",
+                ),
+                self.change("address.RegionOrCity", spare.pk, {}, action="D"),
+            ]
+        )
+
+        self.assertEqual(response.status_code, 201)
+        region.refresh_from_db()
+        self.assertEqual(region.name, "Oromia Region")
+        self.assertFalse(RegionOrCity.objects.filter(pk=spare.pk).exists())
+
+    def test_retried_push_is_skipped(self):
+        region_id = uuid.uuid4()
+        changes = [
+            self.change(
+                "address.RegionOrCity",
+                region_id,
+                {"id": str(region_id), "name": "Afar"},
+            )
+        ]
+        self.push(changes)
+        response = self.push(changes)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["details"][0]["status"], "skipped")
+        self.assertEqual(
+            ChangeEvent.objects.filter(source_workstation=self.station).count(), 1
+        )
+
+    def test_pushed_user_status_updates_current_status(self):
+        user = CustomUser.objects.create_user(
+            username="clerk", email="clerk@example.com"
+        )
+        status_id = uuid.uuid4()
+        response = self.push(
+            [
+                self.change(
+                    "users.UserStatus",
+                    status_id,
+                    {
+                        "id": str(status_id),
+                        "status": "inactive",
+                        "user_id": str(user.pk),
+                        "changed_by_id": str(user.pk),
+                    },
+                )
+            ]
+        )
+
+        self.assertEqual(response.status_code, 201)
+        user.refresh_from_db()
+        self.assertEqual(user.current_status, "inactive")
+
+
+class UnchangedPushTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        flush_outbox()
+        self.region = RegionOrCity.objects.get()
+        self.events = ChangeEvent.objects.count()
+
+    def push_region(self, payload):
+        change = self.change("address.RegionOrCity", self.region.pk, payload, "U")
+        return self.client.post("/api/sync/push/", [change], format="json")
+
+    def test_payload_matching_row_is_skipped(self):
+        payload = codec_for(RegionOrCity).encode(self.region)
+
+        with mock.patch.object(RegionOrCity.objects, "bulk_update") as bulk_update:
+            response = self.push_region(payload)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["details"][0]["status"], "skipped")
+        self.assertEqual(response.data["details"][0]["reason"], "unchanged")
+        bulk_update.assert_not_called()
+        self.assertEqual(ChangeEvent.objects.count(), self.events)
+
+    def test_echoed_payload_is_skipped_after_apply(self):
+        payload = {**codec_for(RegionOrCity).encode(self.region), "name": "Oromiya"}
+
+        first = self.push_region(payload)
+        echo = self.push_region(payload)
+
+        self.assertEqual(first.data["details"][0]["status"], "applied")
+        self.assertEqual(echo.data["details"][0]["reason"], "unchanged")
+        self.assertEqual(ChangeEvent.objects.count(), self.events + 1)
+        self.assertEqual(
+            RowVersion.objects.get(object_id=str(self.region.pk)).version,
+            row_hash(payload),
+        )
+
+
+class PartialPushTests(SyncTestCase):
+    def push(self, changes):
+        return self.client.post("/api/sync/push/", changes, format="json")
+
+    def orphan_zone(self, zone_id):
+        return self.change(
+            "address.ZoneOrSubcity",
+            zone_id,
+            {"id": str(zone_id), "name": "Arsi", "region": str(uuid.uuid4())},
+        )
+
+    def test_bad_change_fails_alone(self):
+        good_id, bad_id = uuid.uuid4(), uuid.uuid4()
+        bad = self.orphan_zone(bad_id)
+        response = self.push(
+            [
+                bad,
+                self.change(
+                    "address.RegionOrCity",
+                    good_id,
+                    {"id": str(good_id), "name": "Afar"},
+                ),
+            ]
+        )
+
+        self.assertEqual(response.status_code, 207)
+        details = response.data["details"]
+        self.assertEqual(
+            [result["status"] for result in details], ["failed", "applied"]
+        )
+        self.assertIn("IntegrityError", details[0]["reason"])
+        self.assertTrue(RegionOrCity.objects.filter(pk=good_id).exists())
+        self.assertFalse(ZoneOrSubcity.objects.filter(pk=bad_id).exists())
+        self.assertEqual(
+            ChangeEvent.objects.filter(source_workstation=self.station).count(), 1
+        )
+        letter = DeadLetter.objects.get()
+        self.assertEqual(str(letter.event_uuid), bad["event_uuid"])
+        self.assertEqual(letter.attempts, 1)
+
+    def test_bad_change_does_not_leak_into_later_changes(self):
+        zone = ZoneOrSubcity.objects.get()
+        region = RegionOrCity.objects.create(name="Sidama")
+        ZoneOrSubcity.objects.create(name="Arsi", region=region)
+        response = self.push(
+            [
+                # Takes the name of another zone.
+                self.change(
+                    "address.ZoneOrSubcity",
+                    zone.pk,
+                    {"id": str(zone.pk), "name": "Arsi"},
+                    action="U",
+                ),
+                self.change(
+                    "address.ZoneOrSubcity",
+                    zone.pk,
+                    {"id": str(zone.pk), "region_id": str(region.pk)},
+                    action="U",
+                ),
+            ]
+        )
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(
+            [result["status"] for result in response.data["details"]],
+            ["failed", "applied"],
+        )
+        zone.refresh_from_db()
+        self.assertEqual((zone.name, zone.region_id), ("East Shewa", region.pk))
+
+    @override_settings(SYNC_DEAD_LETTER_ATTEMPTS=2)
+    def test_change_is_dead_lettered_after_repeated_failures(self):
+        bad_id = uuid.uuid4()
+        changes = [self.orphan_zone(bad_id)]
+
+        self.assertEqual(self.push(changes).data["details"][0]["status"], "failed")
+        response = self.push(changes)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data["details"][0]["status"], "dead_lettered")
+        response = self.push(changes)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["details"][0]["status"], "skipped")
+        self.assertEqual(DeadLetter.objects.get().attempts, 2)
+
+    def test_replay_resolves_fixed_letter(self):
+        bad_id = uuid.uuid4()
+        self.push([self.orphan_zone(bad_id)])
+        letter = DeadLetter.objects.get()
+        del letter.data_payload["region"]
+        letter.data_payload["region_id"] = str(RegionOrCity.objects.get().pk)
+        letter.save()
+
+        [result] = replay([letter])
+
+        self.assertEqual(result["status"], "applied")
+        self.assertEqual(ZoneOrSubcity.objects.get(pk=bad_id).region.name, "Oromia")
+        letter.refresh_from_db()
+        self.assertIsNotNone(letter.resolved_at)
+
+
+class DeferredForeignKeyPushTests(SyncFixtures, TransactionTestCase):
+    def test_dangling_foreign_key_id_fails_alone(self):
+        good_id, bad_id = uuid.uuid4(), uuid.uuid4()
+        response = self.client.post(
+            "/api/sync/push/",
+            [
+                self.change(
+                    "address.ZoneOrSubcity",
+                    bad_id,
+                    {"id": str(bad_id), "name": "Arsi", "region_id": str(uuid.uuid4())},
+                ),
+                self.change(
+                    "address.RegionOrCity",
+                    good_id,
+                    {"id": str(good_id), "name": "Afar"},
+                ),
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(
+            [result["status"] for result in response.data["details"]],
+            ["failed", "applied"],
+        )
+        self.assertTrue(RegionOrCity.objects.filter(pk=good_id).exists())
+        self.assertFalse(ZoneOrSubcity.objects.filter(pk=bad_id).exists())
+        self.assertEqual(DeadLetter.objects.get().object_id, str(bad_id))
+
+
+class StationStub(BaseHTTPRequestHandler):
+    """
+    Stands in for a station's notify endpoint. Answers with the queued
+    statuses of the server, then 200.
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.received.append((self.path, body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(
+    SYNC_NOTIFY_BACKOFF=0, SYNC_NOTIFY_ATTEMPTS=3, SYNC_NOTIFY_BREAKER_THRESHOLD=2
+)
+class StationNotificationTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        breaker.reset()
+        self.addCleanup(breaker.reset)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StationStub)
+        self.server.received, self.server.statuses = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.point_at(self.station, f"http://127.0.0.1:{self.server.server_port}")
+        self.point_at(self.other_station, "")
+
+    def point_at(self, station, base_url):
+        StationCredential.objects.filter(location=station).update(base_url=base_url)
+
+    def test_notifies_the_stations_receiving_the_changes(self):
+        event = self.create_event(self.woreda)
+
+        results = notify_stations([station_route(self.station)])
+
+        self.assertEqual(results, {self.station.pk: "sent"})
+        self.assertEqual(
+            self.server.received, [("/api/sync/notify/", {"head": event.sequence})]
+        )
+        self.assertEqual(notify_stations([station_route(self.other_station)]), {})
+
+    def test_server_errors_are_retried(self):
+        self.server.statuses = [503, 502]
+
+        self.assertEqual(notify_stations([BROADCAST]), {self.station.pk: "sent"})
+        self.assertEqual(len(self.server.received), 3)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        with socket.socket() as unused:
+            unused.bind(("127.0.0.1", 0))
+            port = unused.getsockname()[1]
+        self.point_at(self.station, f"http://127.0.0.1:{port}")
+
+        self.assertEqual(notify_stations([BROADCAST]), {self.station.pk: "failed"})
+        self.assertEqual(notify_stations([BROADCAST]), {self.station.pk: "failed"})
+        self.assertTrue(breaker.is_open(self.station.pk))
+        self.assertEqual(notify_stations([BROADCAST]), {self.station.pk: "skipped"})
+
+    @override_settings(SYNC_NOTIFY_ENABLED=True)
+    def test_flushing_changes_queues_a_notification(self):
+        RegionOrCity.objects.create(name="Afar")
+
+        with mock.patch(
+            "orcSync.tasks.task.notify_stations_task.delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            flush_outbox()
+
+        delay.assert_called_once_with([BROADCAST], None)
+
+
+class StreamingWireFormatTests(SyncTestCase):
+    def read_stream(self, response):
+        body = b"".join(response.streaming_content)
+        if response.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_pull_streams_gzipped_ndjson(self):
+        events = [
+            self.create_event(self.woreda, object_id=str(uuid.uuid4()))
+            for _ in range(3)
+        ]
+        response = self.client.get(
+            "/api/sync/get-pending/",
+            {"limit": 2},
+            HTTP_ACCEPT="application/x-ndjson",
+            HTTP_ACCEPT_ENCODING="gzip",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        *changes, end = self.read_stream(response)
+        self.assertEqual(
+            [change["sequence"] for change in changes],
+            [event.sequence for event in events[:2]],
+        )
+        self.assertEqual(end["type"], "end")
+        self.assertEqual(end["next_after"], events[1].sequence)
+        self.assertTrue(end["has_more"])
+        cursor = StationCursor.for_workstation(self.station, "bulk")
+        self.assertEqual(cursor.delivered_sequence, events[1].sequence)
+
+    def test_pull_without_ndjson_accept_stays_json(self):
+        response = self.client.get(
+            "/api/sync/get-pending/", HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertFalse(response.streaming)
+        self.assertIn("pending_changes", response.data)
+
+    def test_push_accepts_gzipped_ndjson(self):
+        region_ids = [uuid.uuid4(), uuid.uuid4()]
+        lines = [
+            json.dumps(
+                self.change(
+                    "address.RegionOrCity",
+                    region_id,
+                    {"id": str(region_id), "name": f"Region {i}"},
+                )
+            )
+            for i, region_id in enumerate(region_ids)
+        ]
+        response = self.client.post(
+            "/api/sync/push/",
+            gzip.compress("\n".join(lines).encode()),
+            content_type="application/x-ndjson",
+            HTTP_CONTENT_ENCODING="gzip",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(RegionOrCity.objects.filter(pk__in=region_ids).count(), 2)
+
+    def test_push_reports_the_invalid_line(self):
+        region_id = uuid.uuid4()
+        body = "\n".join(
+            [
+                json.dumps(
+                    self.change(
+                        "address.RegionOrCity", region_id, {"id": str(region_id)}
+                    )
+                ),
+                json.dumps({"model": "address.RegionOrCity"}),
+            ]
+        )
+        response = self.client.post(
+            "/api/sync/push/", body, content_type="application/x-ndjson"
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["line"], 2)
+        self.assertFalse(RegionOrCity.objects.filter(pk=region_id).exists())
+
+    def test_push_rejects_corrupt_compressed_body(self):
+        response = self.client.post(
+            "/api/sync/push/",
+            b"not gzip",
+            content_type="application/json",
+            HTTP_CONTENT_ENCODING="gzip",
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class BlobTransferTests(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.content = b"truck-photo" * 1000
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+        self.url = f"/api/sync/blobs/{self.sha256}/"
+
+    def put_chunk(self, start, end):
+        return self.client.put(
+            self.url,
+            self.content[start:end],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(self.content)}",
+        )
+
+    def test_resumable_upload_and_ranged_download(self):
+        response = self.put_chunk(0, 4000)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["received"], 4000)
+
+        response = self.put_chunk(0, 4000)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["received"], 4000)
+
+        response = self.put_chunk(4000, len(self.content))
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+
+    def create_truck(self, number, filename):
+        owner = TruckOwner.objects.create(
+            first_name="Abebe", last_name="Kebede", phone_number=f"09{number}"
+        )
+        truck = Truck(
+            owner=owner,
+            plate_number=f"AA-{number}",
+            country_of_origin="Japan",
+            truck_model="FH16",
+            year_of_manufacture=2020,
+            chassis_number=f"C-{number}",
+            engine_number=f"E-{number}",
+            color="white",
+            oil_type="diesel",
+            horse_power=540,
+            engine_displacement=16000,
+            loading_capacity_kg=40000,
+        )
+        truck.truck_image.save(filename, ContentFile(self.content), save=False)
+        truck.save()
+        return truck
+
+    def test_same_content_under_two_names_is_one_blob(self):
+        first = self.create_truck(1, "front.jpg")
+        second = self.create_truck(2, "side.jpg")
+
+        self.assertEqual(
+            list(SyncBlob.objects.values_list("pk", flat=True)), [self.sha256]
+        )
+        self.assertEqual(
+            set(SyncBlobName.objects.values_list("name", flat=True)),
+            {first.truck_image.name, second.truck_image.name},
+        )
+
+    def test_reading_references_neither_reads_files_nor_writes(self):
+        self.create_truck(1, "front.jpg")
+        self.create_truck(2, "side.jpg")
+        trucks = list(Truck.objects.all())
+
+        with mock.patch.object(
+            FieldFile, "open", side_effect=AssertionError
+        ), self.assertNumQueries(1):
+            prefetch_blobs(trucks)
+            payloads = [codec_for(Truck).encode(truck) for truck in trucks]
+
+        for payload in payloads:
+            self.assertEqual(payload["truck_image"]["sha256"], self.sha256)
+            self.assertIsNone(payload["truck_plate_image"])
+
+    def test_files_saved_before_registration_are_registered_by_command(self):
+        self.create_truck(1, "front.jpg")
+        SyncBlobName.objects.all().delete()
+        self.assertIsNone(codec_for(Truck).encode(Truck.objects.get())["truck_image"])
+
+        call_command("register_sync_blobs", stdout=io.StringIO())
+
+        reference = codec_for(Truck).encode(Truck.objects.get())["truck_image"]
+        self.assertEqual(reference["sha256"], self.sha256)
+
+    def test_push_with_unknown_blob_is_rejected(self):
+        truck_id = str(uuid.uuid4())
+        response = self.client.post(
+            "/api/sync/push/",
+            [
+                {
+                    "event_uuid": str(uuid.uuid4()),
+                    "model": "trucks.Truck",
+                    "action": "U",
+                    "object_id": truck_id,
+                    "data_payload": {
+                        "id": truck_id,
+                        "truck_image": {"sha256": self.sha256, "filename": "a.jpg"},
+                    },
+                }
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["missing_blobs"], [self.sha256])
+        self.assertFalse(ChangeEvent.objects.exists())
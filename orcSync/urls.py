@@ -3,8 +3,12 @@ from rest_framework.routers import DefaultRouter
 
 from orcSync.views import (
     AcknowledgeChangesView,
+    BlobView,
     GetPendingChangesView,
     PushChangesView,
+    RangeTreeView,
+    RepairView,
+    SnapshotView,
     StationCredentialDetailView,
     StationCredentialListCreateView,
     WorkStationListView,
@@ -30,4 +34,8 @@ urlpatterns = [
     path("push/", PushChangesView.as_view(), name="push_changes"),
     path("get-pending/", GetPendingChangesView.as_view(), name="get_pending_changes"),
     path("acknowledge/", AcknowledgeChangesView.as_view(), name="acknowledge_changes"),
+    path("blobs/<str:sha256>/", BlobView.as_view(), name="sync_blob"),
+    path("snapshot/", SnapshotView.as_view(), name="sync_snapshot"),
+    path("merkle/", RangeTreeView.as_view(), name="sync_range_tree"),
+    path("merkle/repair/", RepairView.as_view(), name="sync_repair"),
 ]
@@ -1,5 +1,8 @@
 from .acknowledge import AcknowledgeChangesView
+from .blobs import BlobView
 from .get_pending import GetPendingChangesView
+from .merkle import RangeTreeView, RepairView
 from .push import PushChangesView
+from .snapshot import SnapshotView
 from .sync_address import StationCredentialDetailView, StationCredentialListCreateView
 from .workstation_list import WorkStationListView
@@ -1,12 +1,11 @@
-from django.utils import timezone
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_api_key.permissions import HasAPIKey
 
-from orcSync.models import SyncAcknowledgement
+from orcSync.delivery import acknowledge
 from orcSync.permissions import WorkstationHasAPIKey
 from orcSync.serializers import AcknowledgeEventsSerializer
+from utils.api_keys import CachedHasAPIKey
 
 
 class AcknowledgeChangesView(APIView):
@@ -14,7 +13,7 @@ class AcknowledgeChangesView(APIView):
     Allows a workstation to report that it has successfully applied a list of changes.
     """
 
-    permission_classes = [HasAPIKey, WorkstationHasAPIKey]
+    permission_classes = [CachedHasAPIKey, WorkstationHasAPIKey]
 
     def post(self, request, *args, **kwargs):
         serializer = AcknowledgeEventsSerializer(data=request.data)
@@ -25,13 +24,20 @@ class AcknowledgeChangesView(APIView):
 
         event_ids = serializer.validated_data["acknowledged_events"]
 
-        updated_count = SyncAcknowledgement.objects.filter(
-            destination_workstation=workstation,
-            change_event_id__in=event_ids,
-            status="P",
-        ).update(status="A", acknowledged_at=timezone.now())
+        watermarks = acknowledge(
+            workstation,
+            event_ids=event_ids,
+            through=serializer.validated_data.get("acknowledged_through"),
+            lane_through=serializer.validated_data["lane_through"],
+            failed_ids=serializer.validated_data["failed_events"],
+        )
 
         return Response(
-            {"status": "success", "message": f"{updated_count} events acknowledged."},
+            {
+                "status": "success",
+                "message": f"{len(event_ids)} events acknowledged.",
+                "acknowledged_through": min(watermarks.values()),
+                "lanes": watermarks,
+            },
             status=status.HTTP_200_OK,
-        )
\ No newline at end of file
+        )
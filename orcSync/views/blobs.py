@@ -0,0 +1,109 @@
+import re
+
+from django.http import FileResponse, StreamingHttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from orcSync.blobs import CHUNK_SIZE, BlobUploadError, received_size, store_chunk
+from orcSync.models import SyncBlob
+from orcSync.permissions import WorkstationHasAPIKey
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+RANGE_RE = re.compile(r"^bytes=(\d+)-(\d*)$")
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+def _read_range(f, start, length):
+    f.seek(start)
+    while length > 0:
+        chunk = f.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+    f.close()
+
+
+class BlobView(APIView):
+    """
+    Downloads and uploads sync blobs by SHA-256.
+
+    GET streams the blob and honours `Range: bytes=<start>-[<end>]` so an
+    interrupted download can resume. For a blob that is not complete yet it
+    answers 404 with the number of bytes received so far.
+
+    PUT uploads the raw bytes of a chunk described by
+    `Content-Range: bytes <start>-<end>/<total>` (the whole blob when the
+    header is missing). The blob becomes available once its hash is verified.
+    """
+
+    permission_classes = [WorkstationHasAPIKey]
+
+    def get(self, request, sha256, *args, **kwargs):
+        blob = SyncBlob.objects.filter(sha256=sha256).first()
+        if blob is None or not blob.file.storage.exists(blob.file.name):
+            return Response(
+                {"error": "Blob not found.", "received": received_size(sha256)},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        match = RANGE_RE.match(request.headers.get("Range", ""))
+        if not match:
+            response = FileResponse(blob.file.open("rb"))
+            response["Accept-Ranges"] = "bytes"
+            return response
+
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else blob.size - 1
+        end = min(end, blob.size - 1)
+        if start > end:
+            return Response(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        response = StreamingHttpResponse(
+            _read_range(blob.file.open("rb"), start, end - start + 1),
+            status=status.HTTP_206_PARTIAL_CONTENT,
+            content_type="application/octet-stream",
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{blob.size}"
+        response["Content-Length"] = str(end - start + 1)
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    def put(self, request, sha256, *args, **kwargs):
+        if not SHA256_RE.match(sha256):
+            return Response(
+                {"error": "Invalid blob hash."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if SyncBlob.objects.filter(sha256=sha256).exists():
+            return Response({"status": "complete"}, status=status.HTTP_200_OK)
+
+        content_range = request.headers.get("Content-Range")
+        if content_range:
+            match = CONTENT_RANGE_RE.match(content_range)
+            if not match:
+                return Response(
+                    {"error": "Invalid Content-Range header."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            start, total = int(match.group(1)), int(match.group(3))
+        else:
+            start, total = 0, int(request.headers.get("Content-Length") or 0)
+
+        try:
+            result = store_chunk(sha256, request._request, start, total)
+        except BlobUploadError as exc:
+            return Response(
+                {"error": str(exc), "received": exc.received},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        if isinstance(result, SyncBlob):
+            return Response(
+                {"status": "complete", "size": result.size},
+                status=status.HTTP_201_CREATED,
+            )
+        return Response(
+            {"status": "partial", "received": result},
+            status=status.HTTP_202_ACCEPTED,
+        )
@@ -1,53 +1,116 @@
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework_api_key.permissions import HasAPIKey
 
-from orcSync.models import ChangeEvent, SyncAcknowledgement
+from orcSync.delivery import PendingPage, read_confirmations, record_confirmations
 from orcSync.permissions import WorkstationHasAPIKey
-from orcSync.serializers import OutboundChangeSerializer
+from orcSync.serializers import OutboundChangeSerializer, PendingChangesQuerySerializer
+from orcSync.wire import (
+    NDJSON_CONTENT_TYPE,
+    NDJSONRenderer,
+    encode_ndjson,
+    negotiate_encoding,
+    wants_ndjson,
+)
 from workstations.models import WorkStation
 
 
 class GetPendingChangesView(APIView):
     """
-    Provides a workstation with all changes it needs to apply and confirms
-    which of its previously sent changes have been fully processed.
+    Provides a workstation with the next page of changes it needs to apply and
+    confirms which of its previously sent changes have been fully processed.
+
+    Pages are filled from the priority lanes (see orcSync.delivery.PendingPage)
+    and ordered by ChangeEvent.sequence. A workstation continues with the
+    `next_after` of each lane of the previous page, passed as
+    `?after_<lane>=`; a plain `?after=` applies to every lane.
+
+    `acknowledged_events` is a page of the workstation's confirmation queue
+    (see orcSync.delivery.read_confirmations). The workstation passes the
+    `confirmed_after` of the previous page back as `?confirmed_after=` to
+    drain what it has read.
+
+    Clients sending `Accept: application/x-ndjson` receive the page as a
+    stream: one `{"type": "change"}` line per event followed by a single
+    `{"type": "end"}` line carrying the paging fields, compressed according
+    to `Accept-Encoding`. The page itself is read before the first line, and
+    is bounded by `limit`; events are serialized as the stream is consumed.
     """
 
     permission_classes = [WorkstationHasAPIKey]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
 
     def get(self, request, *args, **kwargs):
         workstation = request._request.workstation
 
-        pending_acks = (
-            SyncAcknowledgement.objects.select_related(
-                "change_event", "change_event__content_type"
-            )
-            .prefetch_related("change_event__changed_object")
-            .filter(destination_workstation=workstation, status="P")
+        query_serializer = PendingChangesQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        page = PendingPage(
+            workstation,
+            after=query_serializer.validated_data.get("after"),
+            limit=query_serializer.validated_data["limit"],
+            lane_after=query_serializer.validated_data["lane_after"],
         )
 
-        pending_changes_events = [ack.change_event for ack in pending_acks]
+        if hasattr(workstation, "last_seen"):
+            workstation.last_seen = timezone.now()
+            workstation.save(update_fields=["last_seen"])
 
-        fully_acknowledged_events = (
-            ChangeEvent.objects.filter(source_workstation=workstation)
-            .exclude(acknowledgements__status="P")
-            .values_list("id", flat=True)
-        )
+        confirmed_after = query_serializer.validated_data.get("confirmed_after")
+        if wants_ndjson(request):
+            return self.stream(request, page, confirmed_after)
 
         pending_changes_serializer = OutboundChangeSerializer(
-            pending_changes_events, many=True, context={"request": request}
+            list(page), many=True, context={"request": request}
         )
 
         response_data = {
             "pending_changes": pending_changes_serializer.data,
-            "acknowledged_events": list(fully_acknowledged_events),
+            **self.confirmations(workstation, confirmed_after),
+            "next_after": page.next_after,
+            "has_more": page.has_more,
+            "lanes": page.lanes,
         }
 
-        if hasattr(workstation, "last_seen"):
-            workstation.last_seen = timezone.now()
-            workstation.save(update_fields=["last_seen"])
+        return Response(response_data, status=status.HTTP_200_OK)
+
+    def confirmations(self, workstation, confirmed_after):
+        record_confirmations(workstation)
+        event_ids, confirmed_after, has_more = read_confirmations(
+            workstation, after=confirmed_after
+        )
+        return {
+            "acknowledged_events": event_ids,
+            "confirmed_after": confirmed_after,
+            "has_more_confirmations": has_more,
+        }
+
+    def stream(self, request, page, confirmed_after=None):
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        response = StreamingHttpResponse(
+            encode_ndjson(self.records(request, page, confirmed_after), encoding),
+            content_type=NDJSON_CONTENT_TYPE,
+        )
+        if encoding:
+            response["Content-Encoding"] = encoding
+        response["Vary"] = "Accept, Accept-Encoding"
+        return response
 
-        return Response(response_data, status=status.HTTP_200_OK)
\ No newline at end of file
+    def records(self, request, page, confirmed_after=None):
+        context = {"request": request}
+        for event in page:
+            record = OutboundChangeSerializer(event, context=context).data
+            yield {"type": "change", **record}
+        yield {
+            "type": "end",
+            **self.confirmations(page.workstation, confirmed_after),
+            "next_after": page.next_after,
+            "has_more": page.has_more,
+            "lanes": page.lanes,
+        }
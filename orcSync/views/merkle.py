@@ -0,0 +1,67 @@
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from orcSync.merkle import RangeTree, repair
+from orcSync.permissions import WorkstationHasAPIKey
+from orcSync.serializers import RangeTreeQuerySerializer, RepairRequestSerializer
+
+
+class RangeTreeView(APIView):
+    """
+    Returns a node of a model's hashed range tree so a workstation can find
+    the rows its copy differs in without downloading the model.
+
+    `?model=<label>&prefix=<hex>` answers the node's hash, row count and the
+    hashes of its sixteen children; adding `&rows=true` answers the row hashes
+    of the bucket instead, for comparing leaves row by row.
+    """
+
+    permission_classes = [WorkstationHasAPIKey]
+
+    def get(self, request, *args, **kwargs):
+        workstation = request._request.workstation
+
+        query_serializer = RangeTreeQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        tree = RangeTree(
+            query_serializer.validated_data["model"],
+            workstation,
+            prefix=query_serializer.validated_data["prefix"],
+        )
+        if query_serializer.validated_data["rows"]:
+            return Response(
+                {
+                    "model": tree.Model._meta.label,
+                    "prefix": tree.prefix,
+                    "rows": tree.row_hashes(),
+                },
+                status=status.HTTP_200_OK,
+            )
+        return Response(tree.node(), status=status.HTTP_200_OK)
+
+
+class RepairView(APIView):
+    """
+    Queues ChangeEvents for only the requesting workstation carrying central's
+    state of the listed rows (a delete for rows central does not have). They
+    are delivered through get-pending like any other change.
+    """
+
+    permission_classes = [WorkstationHasAPIKey]
+
+    def post(self, request, *args, **kwargs):
+        workstation = request._request.workstation
+
+        serializer = RepairRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        queued = repair(
+            serializer.validated_data["model"],
+            workstation,
+            serializer.validated_data["object_ids"],
+        )
+        return Response({"queued": queued}, status=status.HTTP_202_ACCEPTED)
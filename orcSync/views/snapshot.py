@@ -0,0 +1,94 @@
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+from orcSync import snapshot
+from orcSync.codec import codec_for
+from orcSync.permissions import WorkstationHasAPIKey
+from orcSync.serializers import (
+    SnapshotChunkQuerySerializer,
+    SnapshotFinishSerializer,
+)
+from orcSync.wire import (
+    NDJSON_CONTENT_TYPE,
+    NDJSONRenderer,
+    encode_ndjson,
+    negotiate_encoding,
+)
+
+
+class SnapshotView(APIView):
+    """
+    Bootstraps a workstation with the current state of the data routed to it.
+
+    GET without parameters starts a snapshot and returns its `as_of` sequence
+    point and the models to download, in import order. GET with `?model=`
+    (and `?after=` to continue) streams the next chunk of that model as
+    NDJSON: one `{"type": "row"}` line per row and a final `{"type": "end"}`
+    line carrying `next_after` and `has_more`, compressed according to
+    `Accept-Encoding`. POST `{"as_of": ...}` once every model is imported to
+    continue incremental sync from that point.
+    """
+
+    permission_classes = [WorkstationHasAPIKey]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+
+    def get(self, request, *args, **kwargs):
+        workstation = request._request.workstation
+
+        if "model" not in request.query_params:
+            return Response(snapshot.manifest(workstation), status=status.HTTP_200_OK)
+
+        query_serializer = SnapshotChunkQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        chunk = snapshot.SnapshotChunk(
+            workstation,
+            query_serializer.validated_data["model"],
+            after=query_serializer.validated_data.get("after"),
+            limit=query_serializer.validated_data["limit"],
+        )
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        response = StreamingHttpResponse(
+            encode_ndjson(self.records(request, chunk), encoding),
+            content_type=NDJSON_CONTENT_TYPE,
+        )
+        if encoding:
+            response["Content-Encoding"] = encoding
+        response["Vary"] = "Accept-Encoding"
+        return response
+
+    def post(self, request, *args, **kwargs):
+        workstation = request._request.workstation
+
+        serializer = SnapshotFinishSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        as_of = snapshot.finish(workstation, serializer.validated_data["as_of"])
+        return Response({"acknowledged_through": as_of}, status=status.HTTP_200_OK)
+
+    def records(self, request, chunk):
+        codec = codec_for(chunk.Model)
+        label = chunk.Model._meta.label
+
+        def blob_url(sha256):
+            return request.build_absolute_uri(reverse("sync_blob", args=[sha256]))
+
+        for instance in chunk:
+            yield {
+                "type": "row",
+                "model": label,
+                "object_id": str(instance.pk),
+                "data_payload": codec.encode(instance, blob_url=blob_url),
+            }
+        yield {
+            "type": "end",
+            "model": label,
+            "next_after": chunk.next_after,
+            "has_more": chunk.has_more,
+        }
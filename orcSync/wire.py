@@ -0,0 +1,167 @@
+"""
+Streaming wire format for the sync endpoints.
+
+Besides plain JSON, get-pending and push speak newline-delimited JSON
+(`application/x-ndjson`): one record per line, so either side can start
+working before the whole body has arrived. Bodies may be compressed with
+gzip or, when the optional `zstandard` package is installed, zstd. Clients
+choose through the usual `Accept`, `Accept-Encoding` and `Content-Encoding`
+headers; anything else falls back to plain JSON.
+"""
+
+import json
+import zlib
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+DECOMPRESS_ERRORS = (zlib.error, zstandard.ZstdError) if zstandard else (zlib.error,)
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+READ_SIZE = 64 * 1024
+FLUSH_EVERY = 50
+
+
+class WireFormatError(ValueError):
+    """
+    Raised for bodies that cannot be decompressed or decoded.
+    """
+
+
+class NDJSONRenderer(JSONRenderer):
+    """
+    Lets DRF content negotiation accept NDJSON clients. Streamed pages bypass
+    rendering; anything else, such as error responses, becomes a single line.
+    """
+
+    media_type = NDJSON_CONTENT_TYPE
+    format = "ndjson"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(data, accepted_media_type, renderer_context) + b"\n"
+
+
+def supported_encodings():
+    return ("zstd", "gzip") if zstandard else ("gzip",)
+
+
+def wants_ndjson(request):
+    return NDJSON_CONTENT_TYPE in request.headers.get("Accept", "")
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Picks the best content encoding the client accepts, or None.
+    """
+    offered = {
+        token.split(";")[0].strip().lower()
+        for token in (accept_encoding or "").split(",")
+    }
+    for encoding in supported_encodings():
+        if encoding in offered:
+            return encoding
+    return None
+
+
+def _compressor(encoding):
+    if encoding == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdCompressor().compressobj()
+    return None
+
+
+def _decompressor(encoding):
+    if not encoding or encoding == "identity":
+        return None
+    if encoding == "gzip":
+        return zlib.decompressobj(31)
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise WireFormatError(f"Unsupported content encoding '{encoding}'.")
+
+
+def encode_ndjson(records, encoding=None):
+    """
+    Yields the NDJSON encoding of `records`, compressed with `encoding`.
+    Compressed output is flushed every few records so the client receives
+    data while the server is still producing it.
+    """
+    compressor = _compressor(encoding)
+    buffered = []
+    for record in records:
+        buffered.append(json.dumps(record, cls=JSONEncoder, separators=(",", ":")))
+        if len(buffered) >= FLUSH_EVERY:
+            yield _emit(compressor, buffered)
+            buffered = []
+    if buffered:
+        yield _emit(compressor, buffered)
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def _emit(compressor, lines):
+    data = ("\n".join(lines) + "\n").encode("utf-8")
+    if compressor is None:
+        return data
+    if zstandard and isinstance(compressor, zstandard.ZstdCompressionObj):
+        flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+    else:
+        flush_mode = zlib.Z_SYNC_FLUSH
+    return compressor.compress(data) + compressor.flush(flush_mode)
+
+
+def iter_chunks(stream, encoding=None):
+    """
+    Reads `stream` in chunks and yields the decompressed bytes.
+    """
+    decompressor = _decompressor(encoding)
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            break
+        if decompressor is None:
+            yield chunk
+            continue
+        try:
+            yield decompressor.decompress(chunk)
+        except DECOMPRESS_ERRORS as exc:
+            raise WireFormatError(f"Invalid {encoding} body: {exc}") from exc
+    if decompressor is not None and hasattr(decompressor, "flush"):
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+def iter_ndjson(stream, encoding=None):
+    """
+    Yields one decoded record per line of an NDJSON body as it is read.
+    """
+    pending = b""
+    for chunk in iter_chunks(stream, encoding):
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _decode_line(line)
+    if pending.strip():
+        yield _decode_line(pending)
+
+
+def read_json(stream, encoding=None):
+    """
+    Decodes a (possibly compressed) plain JSON body.
+    """
+    return _decode_line(b"".join(iter_chunks(stream, encoding)))
+
+
+def _decode_line(line):
+    try:
+        return json.loads(line)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise WireFormatError(f"Invalid JSON: {exc}") from exc
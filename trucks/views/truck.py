@@ -4,10 +4,10 @@ from rest_framework import filters, status, viewsets
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from rest_framework_api_key.permissions import HasAPIKey
 
 from helper.custom_pagination import CustomLimitOffsetPagination
 from trucks.serializers import TruckSerializer
+from utils.api_keys import CachedHasAPIKey
 
 from ..models import Truck, TruckOwner
 
@@ -81,7 +81,7 @@ class TruckViewSet(viewsets.ModelViewSet):
     """
     
     queryset = Truck.objects.all()
-    permission_classes = [HasAPIKey, AllowAny]
+    permission_classes = [CachedHasAPIKey, AllowAny]
     serializer_class = TruckSerializer
     lookup_field = "truck_id"
 
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Sets CustomUser.current_status from the latest UserStatus of every user"
+
+    def handle(self, *args, **options):
+        updated = CustomUser.refresh_current_status()
+        self.stdout.write(f"Updated the status of {updated} users.")
@@ -53,15 +53,53 @@ class CustomUser(BaseModel, AbstractUser):
         name="current_station",
         blank=True,
     )
+    current_status = models.CharField(
+        max_length=10,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="The status of the latest UserStatus, kept by refresh_current_status.",
+    )
+
+    def save(self, *args, **kwargs):
+        """
+        Leaves `current_status` to refresh_current_status, so that saving an
+        instance loaded before a status change does not write the old status
+        back.
+        """
+        if not self._state.adding and not kwargs.get("force_insert"):
+            update_fields = kwargs.get("update_fields")
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.name
+                    for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in deferred
+                ]
+            kwargs["update_fields"] = [
+                name for name in update_fields if name != "current_status"
+            ]
+        super().save(*args, **kwargs)
 
     def get_latest_status(self):
         """
         Returns the most recent status for this user.
         """
-        latest_status = (
-            UserStatus.objects.filter(user=self).order_by("-created_at").first()
+        return self.current_status
+
+    @classmethod
+    def refresh_current_status(cls, user_ids=None):
+        """
+        Sets `current_status` from the latest UserStatus of the given users,
+        or of every user, with a single UPDATE.
+        """
+        latest = UserStatus.objects.filter(user=models.OuterRef("pk")).order_by(
+            "-created_at"
         )
-        return latest_status.status if latest_status else None
+        users = cls.objects.all()
+        if user_ids is not None:
+            users = users.filter(pk__in=user_ids)
+        return users.update(current_status=models.Subquery(latest.values("status")[:1]))
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.username})"
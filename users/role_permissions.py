@@ -0,0 +1,42 @@
+"""
+Per-process cache of the permission codenames of every role.
+
+The whole role -> codenames matrix is read with one query and kept for
+ROLE_PERMISSIONS_CACHE_TTL seconds, so a permission check is a set lookup.
+Changing the permissions of a role, deleting a role or changing a permission
+clears the cache of the process that made the change; other processes pick
+the change up when their copy expires.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+
+from utils.api_keys import TTLCache
+
+_matrix = TTLCache(ttl=settings.ROLE_PERMISSIONS_CACHE_TTL, maxsize=1)
+
+
+def permission_matrix():
+    """
+    Maps the id of every role to the frozenset of its permission codenames.
+    """
+    matrix = _matrix.get("roles")
+    if matrix is None:
+        codenames = defaultdict(set)
+        for group_id, codename in Group.permissions.through.objects.values_list(
+            "group_id", "permission__codename"
+        ):
+            codenames[group_id].add(codename)
+        matrix = {group_id: frozenset(names) for group_id, names in codenames.items()}
+        _matrix.set("roles", matrix)
+    return matrix
+
+
+def role_codenames(role_id):
+    return permission_matrix().get(role_id, frozenset())
+
+
+def invalidate_role_permissions():
+    _matrix.clear()
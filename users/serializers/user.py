@@ -5,7 +5,7 @@ from rest_framework import serializers
 from address.models import Woreda
 from address.serializers import WoredaSerializer
 
-from ..models import CustomUser, Department, UserStatus
+from ..models import CustomUser, Department
 from .department import DepartmentSerializer
 from .group import GroupSerializer
 
@@ -82,7 +82,4 @@ class UserSerializer(serializers.ModelSerializer):
         return attrs
 
     def get_latest_status(self, obj):
-        latest_status = (
-            UserStatus.objects.filter(user=obj).order_by("-created_at").first()
-        )
-        return latest_status.status if latest_status else None
+        return obj.current_status
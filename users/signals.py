@@ -1,10 +1,21 @@
 from django.conf import (  # Import settings to get AUTH_USER_MODEL if needed, though CustomUser is directly imported
     settings,
 )
-from django.db.models.signals import post_delete, post_save, pre_save
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+
+from common.revocation import revoked_tokens
+from orcSync.signals import changes_applied
 
-from .models import CustomUser
+from .models import CustomUser, UserStatus
+from .role_permissions import invalidate_role_permissions
 
 
 @receiver(pre_save, sender=CustomUser)
@@ -40,3 +51,61 @@ def sync_role_with_group(sender, instance, **kwargs):
     instance.groups.clear()
     if instance.role:
         instance.groups.add(instance.role)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def index_revoked_token(sender, instance, created, **kwargs):
+    """
+    Adds tokens blacklisted at logout, rotation or deactivation to the
+    revoked token index once the blacklist entry is committed.
+    """
+    if created:
+        token = instance.token
+        transaction.on_commit(
+            lambda: revoked_tokens.revoke(token.jti, token.expires_at)
+        )
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def clear_role_permissions(sender, **kwargs):
+    """
+    Drops this process's cached role permissions once they may be stale.
+    """
+    invalidate_role_permissions()
+
+
+def revoke_inactive_user_tokens(user_ids):
+    """
+    Blacklists the unexpired tokens of those of the given users who are now
+    inactive, one BlacklistedToken at a time so that each one reaches
+    index_revoked_token.
+    """
+    tokens = OutstandingToken.objects.filter(
+        user__in=CustomUser.objects.filter(
+            pk__in=user_ids, current_status__iexact="inactive"
+        ),
+        expires_at__gt=timezone.now(),
+        blacklistedtoken__isnull=True,
+    )
+    for token in tokens:
+        BlacklistedToken.objects.get_or_create(token=token)
+
+
+@receiver(post_save, sender=UserStatus)
+@receiver(post_delete, sender=UserStatus)
+def refresh_user_status(sender, instance, **kwargs):
+    CustomUser.refresh_current_status([instance.user_id])
+    revoke_inactive_user_tokens([instance.user_id])
+
+
+@receiver(changes_applied, sender=UserStatus)
+def refresh_synced_user_status(sender, instances, **kwargs):
+    """
+    Statuses pushed by a workstation are written in bulk, without post_save.
+    """
+    user_ids = {instance.user_id for instance in instances}
+    CustomUser.refresh_current_status(user_ids)
+    revoke_inactive_user_tokens(user_ids)
@@ -1,3 +1,389 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import redis
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from common.middleware import (
+    AuthenticationPipelineMiddleware,
+    InputValidationMiddleware,
+)
+from common.parsers import ValidatedJSONParser
+from common.revocation import BloomFilter, RevokedTokenIndex, revoked_tokens
+from users.models import CustomUser, UserSession, UserStatus
+from users.role_permissions import invalidate_role_permissions
+from users.serializers.user import UserSerializer
+from users.views.diactivate_views import ActivateandDeactivateUser
+from users.views.permissions import GroupPermission
+from utils import set_current_user
+
+
+@override_settings(REVOKED_TOKENS_REDIS_URL="")
+class AuthenticationPipelineTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="clerk", email="clerk@example.com", password="secret"
+        )
+        self.user.session_token = "session-1"
+        self.user.save(update_fields=["session_token"])
+        self.session = UserSession.objects.create(
+            user=self.user, session_token="session-1"
+        )
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access = self.refresh.access_token
+        self.client = APIClient()
+        self.addCleanup(set_current_user, None)
+
+    def set_cookies(self, access=None):
+        self.client.cookies["access"] = str(access or self.access)
+        self.client.cookies["refresh"] = str(self.refresh)
+        self.client.cookies["session"] = "session-1"
+
+    def test_cookie_user_reaches_the_view(self):
+        self.set_cookies()
+        response = self.client.get("/api/users/profile")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["username"], "clerk")
+
+    def test_one_query_for_user_session_and_status(self):
+        request = RequestFactory().get("/api/users/profile")
+        request.COOKIES.update(
+            access=str(self.access), refresh=str(self.refresh), session="session-1"
+        )
+        middleware = AuthenticationPipelineMiddleware(lambda request: HttpResponse())
+
+        # The revocation check and the user.
+        with self.assertNumQueries(2):
+            middleware(request)
+        self.assertEqual(request.jwt_auth[0], self.user)
+
+    def test_missing_cookies_are_rejected(self):
+        response = self.client.get("/api/users/profile")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["error"], "No access token provided")
+
+    def test_ended_session_is_rejected(self):
+        UserSession.objects.filter(pk=self.session.pk).update(is_active=False)
+        self.set_cookies()
+        response = self.client.get("/api/users/profile")
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response.json()["session_invalidated"])
+
+    def test_inactive_user_is_rejected(self):
+        UserStatus.objects.create(
+            user=self.user, changed_by=self.user, status="inactive"
+        )
+        self.set_cookies()
+        response = self.client.get("/api/users/profile")
+        self.assertEqual(response.status_code, 401)
+
+    def test_revoked_token_is_rejected(self):
+        token = OutstandingToken.objects.create(
+            user=self.user,
+            jti=self.access["jti"],
+            token=str(self.access),
+            expires_at=self.access.current_time + timedelta(minutes=5),
+        )
+        BlacklistedToken.objects.create(token=token)
+        self.set_cookies()
+        response = self.client.get("/api/users/profile")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["code"], "TOKEN_BLACKLISTED")
+
+    def test_expired_access_token_is_refreshed(self):
+        self.access.set_exp(lifetime=timedelta(seconds=-1))
+        self.set_cookies(self.access)
+        response = self.client.get("/api/users/profile")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["username"], "clerk")
+        self.assertNotEqual(response.cookies["access"].value, str(self.access))
+        self.assertEqual(
+            int(response.cookies["access"]["max-age"]),
+            settings.TOKEN_CONFIG["COOKIE_MAX_AGE_SECONDS"],
+        )
+
+
+class FakeRedis:
+    """
+    The commands of a Redis client the revoked token index uses, run as
+    they are queued.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.down = False
+
+    def check(self):
+        if self.down:
+            raise redis.ConnectionError("down")
+
+    def get(self, key):
+        self.check()
+        return self.data.get(key)
+
+    def exists(self, key):
+        self.check()
+        return int(key in self.data)
+
+    def set(self, key, value, ex=None):
+        self.check()
+        self.data[key] = value
+        self.ttls[key] = ex
+
+    def incr(self, key):
+        self.check()
+        self.data[key] = int(self.data.get(key, 0)) + 1
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+@override_settings(REVOKED_TOKENS_REDIS_URL="redis://revoked-tokens")
+class RevokedTokenIndexTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="clerk", email="clerk@example.com", password="secret"
+        )
+        self.redis = FakeRedis()
+        revoked_tokens.reset()
+        revoked_tokens._client = self.redis
+        self.addCleanup(revoked_tokens.reset)
+        self.addCleanup(set_current_user, None)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(100)
+        for item in range(100):
+            bloom.add(f"jti-{item}")
+        self.assertTrue(all(f"jti-{item}" in bloom for item in range(100)))
+        false_positives = sum(f"other-{item}" in bloom for item in range(1000))
+        self.assertLess(false_positives, 10)
+
+    def test_unrevoked_token_costs_no_query(self):
+        revoked_tokens.is_revoked("warm-up")
+        with self.assertNumQueries(0):
+            self.assertFalse(revoked_tokens.is_revoked("never-revoked"))
+
+    def test_blacklisting_feeds_the_index(self):
+        refresh = RefreshToken.for_user(self.user)
+        revoked_tokens.is_revoked("warm-up")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh.blacklist()
+
+        self.assertTrue(revoked_tokens.is_revoked(refresh["jti"]))
+        key = revoked_tokens.jti_key(refresh["jti"])
+        self.assertGreater(self.redis.ttls[key], 0)
+        self.assertEqual(self.redis.data[revoked_tokens.generation_key], 1)
+
+    def other_process(self):
+        index = RevokedTokenIndex()
+        index._client = self.redis
+        index.is_revoked("warm-up")
+        return index
+
+    @override_settings(REVOKED_TOKENS_RETRY=0)
+    def test_failed_revocation_is_written_once_redis_is_back(self):
+        other = self.other_process()
+        refresh = RefreshToken.for_user(self.user)
+        self.redis.down = True
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh.blacklist()
+
+        self.redis.down = False
+        revoked_tokens.is_revoked("another")
+
+        self.assertEqual(self.redis.data[revoked_tokens.generation_key], 1)
+        self.assertTrue(other.is_revoked(refresh["jti"]))
+
+    @override_settings(REVOKED_TOKENS_FILTER_TTL=0)
+    def test_other_processes_rebuild_a_filter_that_is_too_old(self):
+        other = self.other_process()
+        refresh = RefreshToken.for_user(self.user)
+        self.redis.down = True
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh.blacklist()
+        self.redis.down = False
+
+        self.assertTrue(other.is_revoked(refresh["jti"]))
+
+    def test_deactivation_revokes_the_users_tokens(self):
+        admin = CustomUser.objects.create_user(
+            username="admin",
+            email="admin@example.com",
+            role=Group.objects.create(name="admin"),
+        )
+        refresh = RefreshToken.for_user(self.user)
+        revoked_tokens.is_revoked("warm-up")
+        request = APIRequestFactory().post(
+            "/api/users/activate_diactivate", {"user_id": self.user.pk}, format="json"
+        )
+        force_authenticate(request, admin)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = ActivateandDeactivateUser.as_view()(request)
+
+        self.assertEqual(response.data, {"message": "User deactivated successfully."})
+        self.assertTrue(
+            BlacklistedToken.objects.filter(token__jti=refresh["jti"]).exists()
+        )
+        self.assertTrue(revoked_tokens.is_revoked(refresh["jti"]))
+
+    def test_database_is_checked_when_redis_fails(self):
+        refresh = RefreshToken.for_user(self.user)
+        refresh.blacklist()
+        self.redis.down = True
+
+        self.assertTrue(revoked_tokens.is_revoked(refresh["jti"]))
+        self.assertFalse(revoked_tokens.is_revoked("never-revoked"))
+
+
+class RolePermissionTests(TestCase):
+    def setUp(self):
+        self.role = Group.objects.create(name="Controller")
+        self.role.permissions.add(Permission.objects.get(codename="view_woreda"))
+        self.user = CustomUser.objects.create_user(
+            username="controller", email="controller@example.com", role=self.role
+        )
+        invalidate_role_permissions()
+        self.addCleanup(invalidate_role_permissions)
+        self.addCleanup(set_current_user, None)
+
+    def has_permission(self, codename):
+        view = SimpleNamespace(permission_required=codename)
+        return GroupPermission().has_permission(SimpleNamespace(user=self.user), view)
+
+    def test_check_is_a_set_lookup_once_cached(self):
+        self.assertTrue(self.has_permission("view_woreda"))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.has_permission("view_woreda"))
+            self.assertFalse(self.has_permission("delete_woreda"))
+
+    def test_changing_role_permissions_clears_the_cache(self):
+        self.assertFalse(self.has_permission("delete_woreda"))
+        self.role.permissions.add(Permission.objects.get(codename="delete_woreda"))
+        self.assertTrue(self.has_permission("delete_woreda"))
+
+        self.role.permissions.clear()
+        self.assertFalse(self.has_permission("view_woreda"))
+
+
+class CurrentStatusTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user(
+            username="admin", email="admin@example.com"
+        )
+        self.user = CustomUser.objects.create_user(
+            username="clerk", email="clerk@example.com"
+        )
+        self.addCleanup(set_current_user, None)
+
+    def set_status(self, status):
+        return UserStatus.objects.create(
+            user=self.user, changed_by=self.admin, status=status
+        )
+
+    def test_latest_status_is_kept_on_the_user(self):
+        self.set_status("inactive")
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_status, "inactive")
+
+        latest = self.set_status("active")
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_status, "active")
+
+        latest.delete()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_status, "inactive")
+
+    def test_saving_a_stale_instance_keeps_the_status(self):
+        stale = CustomUser.objects.get(pk=self.user.pk)
+        self.set_status("inactive")
+
+        stale.first_name = "Almaz"
+        stale.save()
+
+        self.user.refresh_from_db()
+        self.assertEqual(
+            (self.user.first_name, self.user.current_status), ("Almaz", "inactive")
+        )
+
+    def test_serializing_users_does_not_query_statuses(self):
+        self.set_status("inactive")
+        users = list(
+            CustomUser.objects.prefetch_related("groups", "user_permissions").order_by(
+                "username"
+            )
+        )
+
+        with self.assertNumQueries(0):
+            statuses = [UserSerializer(user).data["latest_status"] for user in users]
+
+        self.assertEqual(statuses, [None, "inactive"])
+
+    def test_backfill_command(self):
+        self.set_status("inactive")
+        CustomUser.objects.update(current_status=None)
+        out = StringIO()
+
+        call_command("backfill_current_status", stdout=out)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_status, "inactive")
+        self.assertIn("Updated the status of 2 users.", out.getvalue())
+
+
+class InputValidationTests(SimpleTestCase):
+    def post(self, payload):
+        request = RequestFactory().post(
+            "/api/users/profile", payload, content_type="application/json"
+        )
+        seen = {}
+
+        def view(request):
+            seen["data"] = Request(request, parsers=[ValidatedJSONParser()]).data
+            return HttpResponse()
+
+        with mock.patch("rest_framework.parsers.JSONParser.parse") as parse:
+            response = InputValidationMiddleware(view)(request)
+        return request, response, seen, parse
+
+    def test_drf_reuses_the_validated_body(self):
+        request, response, seen, parse = self.post(
+            {"name": "Adama", "stations": [{"order": 1, "name": "Checkpoint 1"}]}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        parse.assert_not_called()
+        self.assertIs(seen["data"], request.validated_json)
+
+    def test_rejected_body_is_not_kept(self):
+        request, response, seen, _ = self.post({"comment": "<script>"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)["code"], "XSS_DETECTED")
+        self.assertFalse(hasattr(request, "validated_json"))
+        self.assertEqual(seen, {})
+
+    def test_benchmark_command_reports_each_payload(self):
+        out = StringIO()
+        call_command("bench_input_validation", rows=5, repeat=1, stdout=out)
+        self.assertIn("bulk import", out.getvalue())
@@ -23,7 +23,7 @@ from utils import send_verification_email, set_current_user
 from workstations.serializers import WorkStationSerializer
 from common.encryption import encrypt_json_response
 
-from ..models import CustomUser, UserStatus, UserSession
+from ..models import CustomUser, UserSession
 from users.utils.password_validator import validate_password_strength
 
 
@@ -259,11 +259,8 @@ class LoginView(APIView):
             user = CustomUser.objects.get(username=data["username"])
             
             # Check user status
-            status_record = (
-                UserStatus.objects.filter(user=user).order_by("-created_at").first()
-            )
-            if status_record is not None:
-                if status_record.status == "Inactive":
+            if user.current_status is not None:
+                if user.current_status == "Inactive":
                     return Response(
                         {"error": "User is not active"},
                         status=status.HTTP_401_UNAUTHORIZED,
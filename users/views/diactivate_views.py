@@ -76,11 +76,9 @@ class ActivateandDeactivateUser(APIView):
                 data = request.data
                 user_id = data.get("user_id")
                 user = CustomUser.objects.filter(id=user_id).first()
-                status_record = (
-                    UserStatus.objects.filter(user=user).order_by("-created_at").first()
-                )
+                current_status = user.current_status
 
-                if status_record is None:
+                if current_status is None:
                     created_status = UserStatus.objects.create(
                         user=user, status="Inactive", changed_by=self.request.user
                     )
@@ -90,7 +88,7 @@ class ActivateandDeactivateUser(APIView):
                         status=status.HTTP_200_OK,
                     )
 
-                elif status_record.status == "Active":
+                elif current_status == "Active":
                     created_status = UserStatus.objects.create(
                         user=user, status="Inactive", changed_by=self.request.user
                     )
@@ -1,26 +1,14 @@
-from django.contrib.auth.models import Group
 from rest_framework import permissions
 
+from users.role_permissions import role_codenames
+
 
 class GroupPermission(permissions.BasePermission):
     def has_permission(self, request, view):
         # If the user is not authenticated or does not belong to any group, deny access
 
-        if not request.user.is_authenticated or not request.user.role:
-            return False
-
-        # Get the required permission from the view
-        required_permission = view.permission_required
-
-        # Check if any of the user's groups have the required permission
-        try:
-            group = Group.objects.get(name=request.user.role)
-        except Group.DoesNotExist:
-
+        if not request.user.is_authenticated or not request.user.role_id:
             return False
-        permissions = group.permissions.all()
-
-        if permissions.filter(codename=required_permission).exists():
-            return True
 
-        return False
+        # Check whether the user's role has the permission the view requires
+        return view.permission_required in role_codenames(request.user.role_id)
@@ -7,6 +7,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from helper.custom_pagination import CustomLimitOffsetPagination
+from users.role_permissions import invalidate_role_permissions
 from users.serializers import GroupSerializer, PermissionSerializer, UserSerializer
 
 from ..models import CustomUser
@@ -163,6 +164,7 @@ class GroupViewSet(viewsets.ModelViewSet):
         group = self.get_object()
         permission = Permission.objects.get(id=request.data["permission_id"])
         group.permissions.add(permission)
+        invalidate_role_permissions()
         return Response({"status": "permission assigned"})
 
     @extend_schema(
@@ -199,6 +201,7 @@ class GroupViewSet(viewsets.ModelViewSet):
         group = self.get_object()
         permission = Permission.objects.get(id=request.data["permission_id"])
         group.permissions.remove(permission)
+        invalidate_role_permissions()
         return Response({"status": "permission removed"})
 
 
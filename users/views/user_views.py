@@ -7,10 +7,11 @@ from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
 from rest_framework import filters, generics, permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from common.parsers import ValidatedJSONParser
 from drf_spectacular.utils import extend_schema, OpenApiExample
 from helper.custom_pagination import CustomLimitOffsetPagination
 from users.serializers import (
@@ -32,7 +33,7 @@ class UserViewSet(viewsets.ModelViewSet):
     permission_classes = [GroupPermission]
     permission_required = "view_customuser"
     filter_backends = [filters.SearchFilter]
-    parser_classes = [JSONParser, FormParser, MultiPartParser]
+    parser_classes = [ValidatedJSONParser, FormParser, MultiPartParser]
     pagination_class = CustomLimitOffsetPagination
     headers = {
         "Authorization": f"Bearer {os.environ.get('WEIGHTBRIDGE_TOKEN')}",
@@ -0,0 +1,99 @@
+"""
+In-process cache for API-key verification.
+
+Verifying a key costs a database lookup and, for rest_framework_api_key keys,
+a password-hasher run. Valid keys are cached per process for API_KEY_CACHE_TTL
+seconds under the SHA-256 of the key, so the key itself is never kept in
+memory. Invalid keys are not cached: a key created or restored elsewhere is
+accepted right away, and a flood of bad keys cannot push valid ones out.
+Saving or deleting a key clears the cache of the process that made the
+change; other processes pick the change up when their entries expire.
+"""
+
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_api_key.models import APIKey
+from rest_framework_api_key.permissions import HasAPIKey
+
+
+class TTLCache:
+    """
+    A small thread-safe mapping whose entries expire `ttl` seconds after
+    they were set. The oldest entries are dropped beyond `maxsize`.
+    """
+
+    def __init__(self, ttl=None, maxsize=1024):
+        self._ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, "API_KEY_CACHE_TTL", 60)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            with self._lock:
+                self._data.pop(key, None)
+            return default
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.maxsize:
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def key_digest(key):
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+_api_key_results = TTLCache()
+
+
+def verify_api_key(key):
+    """
+    Returns whether `key` is a valid, unrevoked and unexpired APIKey.
+    """
+    digest = key_digest(key)
+    if _api_key_results.get(digest):
+        return True
+    valid = APIKey.objects.is_valid(key)
+    if valid:
+        _api_key_results.set(digest, True)
+    return valid
+
+
+class CachedHasAPIKey(HasAPIKey):
+    """
+    HasAPIKey with valid keys cached for API_KEY_CACHE_TTL seconds.
+    """
+
+    def has_permission(self, request, view):
+        key = self.get_key(request)
+        if not key:
+            return False
+        return verify_api_key(key)
+
+
+@receiver(post_save, sender=APIKey, dispatch_uid="api_key_cache_save")
+@receiver(post_delete, sender=APIKey, dispatch_uid="api_key_cache_delete")
+def invalidate_api_keys(sender, **kwargs):
+    _api_key_results.clear()